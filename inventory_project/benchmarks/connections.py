@@ -0,0 +1,73 @@
+"""
+Per-request cost of getting a database connection.
+
+"reconnect" closes the connection after every simulated request, which is
+what Django does with CONN_MAX_AGE=0; with a psycopg pool configured the
+close only hands the connection back, so the same numbers show the pool's
+borrow cost instead. "persistent" keeps it open, as CONN_MAX_AGE with health
+checks does. Run it with the settings to compare, e.g.:
+
+    DATABASE_URL=postgres://... DATABASE_POOL=false python benchmarks/connections.py
+    DATABASE_URL=postgres://... DATABASE_POOL=true python benchmarks/connections.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory_project.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+
+
+def simulated_request():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+
+
+def measure(requests, close_between):
+    timings = []
+    for _ in range(requests):
+        if close_between:
+            connection.close()
+        started = time.perf_counter()
+        # What Django does at request start and end
+        connection.close_if_unusable_or_obsolete()
+        simulated_request()
+        timings.append(time.perf_counter() - started)
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection setup cost")
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    reconnect = measure(args.requests, close_between=True)
+    persistent = measure(args.requests, close_between=False)
+    results = {
+        "vendor": connection.vendor,
+        "pool": bool(connection.settings_dict.get("OPTIONS", {}).get("pool")),
+        "reconnect": reconnect,
+        "persistent": persistent,
+        "saving_per_request_ms": round(reconnect["mean_ms"] - persistent["mean_ms"], 3),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
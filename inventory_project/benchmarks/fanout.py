@@ -0,0 +1,88 @@
+"""
+Dashboard fan-out load test.
+
+Fires bursts of parallel GETs at a running server, the way the dashboard
+does, and prints latency percentiles. Run it once against the WSGI
+deployment and once against the ASGI one to compare:
+
+    gunicorn inventory_project.wsgi -w 4 -b 127.0.0.1:8000
+    python benchmarks/fanout.py --base-url http://127.0.0.1:8000 --prefix /api/
+
+    gunicorn inventory_project.asgi:application -k uvicorn.workers.UvicornWorker -w 4 -b 127.0.0.1:8001
+    python benchmarks/fanout.py --base-url http://127.0.0.1:8001 --prefix /api/async/
+
+Start the servers with THROTTLE_ENABLED=false, or the bursts are throttled.
+"""
+
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PATHS = [
+    "products/",
+    "products/?page=2",
+    "products/low_stock/",
+    "categories/",
+    "inventory-history/",
+    "inventory-history/?page=2",
+    "reports/inventory-report/",
+]
+
+
+def fetch(url, token):
+    request = urllib.request.Request(url)
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    started = time.perf_counter()
+    with urllib.request.urlopen(request) as resp:
+        resp.read()
+    return time.perf_counter() - started
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--prefix", default="/api/")
+    parser.add_argument("--token", default="", help="JWT access token")
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--fanout", type=int, default=12)
+    args = parser.parse_args()
+
+    urls = [
+        f"{args.base_url}{args.prefix}{PATHS[i % len(PATHS)]}"
+        for i in range(args.fanout)
+    ]
+    latencies, burst_times = [], []
+    with ThreadPoolExecutor(max_workers=args.fanout) as pool:
+        for _ in range(args.bursts):
+            started = time.perf_counter()
+            latencies.extend(pool.map(lambda url: fetch(url, args.token), urls))
+            burst_times.append(time.perf_counter() - started)
+
+    print(
+        json.dumps(
+            {
+                "base_url": args.base_url + args.prefix,
+                "requests": len(latencies),
+                "throughput_rps": round(len(latencies) / sum(burst_times), 1),
+                "burst_ms_mean": round(statistics.mean(burst_times) * 1000, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
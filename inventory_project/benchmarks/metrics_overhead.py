@@ -0,0 +1,111 @@
+"""
+Latency added by RequestMetricsMiddleware (query observers, serializer
+timing, histogram updates), against the configured (seeded) database:
+
+    python benchmarks/metrics_overhead.py --rounds 7 --iterations 200
+
+Each scenario is sent through two clients, one with the middleware and one
+without, alternating request by request so both see the same database and
+cache state. The overhead is the difference in median latency, taken as the
+median over the rounds. The target is under 2%; the script exits with
+status 1 above --target.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from run import (
+    SCENARIOS,
+    authenticated_client,
+    build_context,
+    configure,
+    send,
+)
+from django.conf import settings
+from django.test import override_settings
+
+METRICS_MIDDLEWARE = "inventory.middleware.RequestMetricsMiddleware"
+READ_SCENARIOS = ["product_list_filtered", "product_retrieve", "low_stock"]
+
+
+def client_with(scenario, context, middleware, warmup):
+    with override_settings(MIDDLEWARE=middleware):
+        client = authenticated_client(scenario, context)
+        # The first request loads the middleware chain for these settings
+        for i in range(warmup):
+            send(scenario, client, i)
+    return client
+
+
+def timed(scenario, client, i):
+    started = time.perf_counter()
+    send(scenario, client, i)
+    return time.perf_counter() - started
+
+
+def measure(scenario, context, rounds, iterations, warmup):
+    middleware = list(settings.MIDDLEWARE)
+    with_metrics = client_with(scenario, context, middleware, warmup)
+    without_metrics = client_with(
+        scenario,
+        context,
+        [name for name in middleware if name != METRICS_MIDDLEWARE],
+        warmup,
+    )
+
+    overheads, baselines = [], []
+    for _ in range(rounds):
+        on, off = [], []
+        for i in range(iterations):
+            # Alternate which client goes first, so neither warms the other
+            if i % 2:
+                on.append(timed(scenario, with_metrics, i))
+                off.append(timed(scenario, without_metrics, i))
+            else:
+                off.append(timed(scenario, without_metrics, i))
+                on.append(timed(scenario, with_metrics, i))
+        baseline = statistics.median(off)
+        baselines.append(baseline)
+        overheads.append((statistics.median(on) - baseline) / baseline * 100)
+    return {
+        "baseline_p50_ms": round(statistics.median(baselines) * 1000, 3),
+        "overhead_pct": round(statistics.median(overheads), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request metrics overhead")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--target", type=float, default=2.0, help="Percent.")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+        help=f"Run only these scenarios (default: {', '.join(READ_SCENARIOS)}).",
+    )
+    args = parser.parse_args()
+
+    configure()
+    context = build_context()
+    results = {}
+    for scenario_class in SCENARIOS:
+        if scenario_class.name not in (args.scenario or READ_SCENARIOS):
+            continue
+        results[scenario_class.name] = measure(
+            scenario_class(context), context, args.rounds, args.iterations, args.warmup
+        )
+        print(scenario_class.name, json.dumps(results[scenario_class.name]))
+
+    worst = max(result["overhead_pct"] for result in results.values())
+    print(json.dumps({"worst_overhead_pct": worst, "target_pct": args.target}))
+    if worst > args.target:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
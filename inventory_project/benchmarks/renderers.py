@@ -0,0 +1,69 @@
+"""
+Render cost of the inventory report with DRF's JSONRenderer versus
+FastJSONRenderer, against the configured (seeded) database:
+
+    python benchmarks/renderers.py --days 90 --rounds 10
+
+Also checks that both renderers produce the same JSON document.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory_project.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from inventory.renderers import FastJSONRenderer, orjson  # noqa: E402
+from inventory.reports import build_inventory_report  # noqa: E402
+
+
+def measure(renderer, data, rounds):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        body = renderer.render(data)
+        timings.append(time.perf_counter() - started)
+    return body, round(statistics.median(timings) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report rendering benchmark")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    end = date.today()
+    report = build_inventory_report(end - timedelta(days=args.days), end)
+    stdlib_body, stdlib_ms = measure(JSONRenderer(), report, args.rounds)
+    fast_body, fast_ms = measure(FastJSONRenderer(), report, args.rounds)
+
+    print(
+        json.dumps(
+            {
+                "orjson": orjson is not None,
+                "history_rows": len(report["sales_history"]),
+                "stock_rows": len(report["stock_levels"]),
+                "bytes": len(fast_body),
+                "json_renderer_ms": stdlib_ms,
+                "fast_renderer_ms": fast_ms,
+                "identical": json.loads(stdlib_body) == json.loads(fast_body),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Scripted benchmark scenarios for the inventory API.
+
+Requests go through Django's test client in-process, so the numbers cover
+the full middleware/view/serializer/ORM stack without network noise. Point
+DATABASE_URL at the SQLite or PostgreSQL database to measure and seed it
+first:
+
+    python manage.py seed_benchmark_data --history 2000000
+    python benchmarks/run.py --output bench-$(git rev-parse --short HEAD).json
+    python benchmarks/run.py --compare bench-abc1234.json
+
+Each scenario reports throughput, p50/p95/p99 latency and queries per
+request; --compare prints the change against an earlier JSON result.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory_project.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from datetime import date, timedelta  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+from inventory.management.commands.seed_benchmark_data import (  # noqa: E402
+    BENCH_USERNAME,
+    BENCH_PASSWORD,
+)
+from inventory.middleware import QueryRecorder  # noqa: E402
+from inventory.models import User, Category, Product, InventoryHistory  # noqa: E402
+
+
+class Scenario:
+    """One benchmark scenario: builds the request for iteration ``i``."""
+
+    method = "get"
+
+    def __init__(self, context):
+        self.context = context
+
+    def request(self, i):
+        raise NotImplementedError
+
+
+class ProductListFiltered(Scenario):
+    name = "product_list_filtered"
+
+    def request(self, i):
+        category = self.context["categories"][i % len(self.context["categories"])]
+        ordering = ("name", "-price", "stock_quantity")[i % 3]
+        return f"/api/products/?category={category}&ordering={ordering}", None
+
+
+class ProductRetrieve(Scenario):
+    name = "product_retrieve"
+
+    def request(self, i):
+        products = self.context["products"]
+        return f"/api/products/{products[i % len(products)]}/", None
+
+
+class OrderPlacement(Scenario):
+    name = "order_placement"
+    method = "post"
+
+    def request(self, i):
+        products = self.context["products"]
+        items = [
+            {
+                "product": products[(i * 3 + n) % len(products)],
+                "quantity": 1,
+                "price_at_purchase": "1.00",
+            }
+            for n in range(3)
+        ]
+        return "/api/orders/", {
+            "order_type": "sale",
+            "total_amount": "3.00",
+            "user": self.context["order_user"],
+            "items": items,
+        }
+
+
+class BulkOrderPlacement(OrderPlacement):
+    name = "bulk_order_placement"
+    batch_size = 100
+
+    def request(self, i):
+        orders = [
+            super(BulkOrderPlacement, self).request(i * self.batch_size + n)[1]
+            for n in range(self.batch_size)
+        ]
+        return "/api/orders/bulk/", orders
+
+
+class LowStock(Scenario):
+    name = "low_stock"
+
+    def request(self, i):
+        return "/api/products/low_stock/", None
+
+
+class InventoryReport(Scenario):
+    name = "inventory_report"
+
+    def request(self, i):
+        # The most recent 30 days of seeded history
+        end = date.today()
+        start = end - timedelta(days=30)
+        return f"/api/reports/inventory-report/?start_date={start}&end_date={end}", None
+
+
+class Login(Scenario):
+    name = "login"
+    method = "post"
+    authenticated = False
+
+    def request(self, i):
+        # /api/token/ is the JWT login used by clients
+        return "/api/token/", {"username": BENCH_USERNAME, "password": BENCH_PASSWORD}
+
+
+SCENARIOS = [
+    ProductListFiltered,
+    ProductRetrieve,
+    OrderPlacement,
+    BulkOrderPlacement,
+    LowStock,
+    InventoryReport,
+    Login,
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_context():
+    auth_user = get_user_model().objects.get(username=BENCH_USERNAME)
+    return {
+        "token": str(RefreshToken.for_user(auth_user).access_token),
+        "order_user": User.objects.get(username=BENCH_USERNAME).pk,
+        "categories": list(Category.objects.values_list("pk", flat=True)[:50]),
+        "products": list(
+            Product.objects.filter(stock_quantity__gte=1000).values_list(
+                "pk", flat=True
+            )[:500]
+        ),
+    }
+
+
+def send(scenario, client, i):
+    path, data = scenario.request(i)
+    if scenario.method == "get":
+        return client.get(path)
+    return client.post(path, data=data, content_type="application/json")
+
+
+def run_scenario(scenario, client, iterations, warmup):
+    for i in range(warmup):
+        send(scenario, client, i)
+
+    latencies, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        recorder = QueryRecorder()
+        request_started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = send(scenario, client, warmup + i)
+        latencies.append(time.perf_counter() - request_started)
+        queries.append(recorder.count)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": iterations,
+        "errors": errors,
+        "throughput_rps": round(iterations / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "queries_mean": round(statistics.mean(queries), 2),
+        "queries_max": max(queries),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline):
+    print(
+        f"{'scenario':<24}{'metric':<16}{'baseline':>12}{'current':>12}{'change':>10}"
+    )
+    for name, result in current["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if not previous:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_mean"):
+            before, after = previous[metric], result[metric]
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+            print(f"{name:<24}{metric:<16}{before:>12}{after:>12}{change:>10}")
+
+
+def configure():
+    """Settings for driving the API with the test client."""
+    if "testserver" not in settings.ALLOWED_HOSTS and "*" not in settings.ALLOWED_HOSTS:
+        settings.ALLOWED_HOSTS.append("testserver")
+    # low_stock sends alert emails; keep them off the network
+    settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+    # Thousands of requests from one user would only measure the throttle
+    settings.THROTTLE_ENABLED = False
+    # The known N+1 warnings would drown the results
+    logging.getLogger("inventory.middleware").setLevel(logging.ERROR)
+
+
+def authenticated_client(scenario, context):
+    client = Client()
+    if getattr(scenario, "authenticated", True):
+        client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {context['token']}"
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory API benchmark suite")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+        help="Run only these scenarios (repeatable).",
+    )
+    parser.add_argument("--output", help="Write JSON results to this file.")
+    parser.add_argument("--compare", help="Earlier JSON result to compare against.")
+    args = parser.parse_args()
+
+    configure()
+    context = build_context()
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "database": connections["default"].vendor,
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "iterations": args.iterations,
+            "rows": {
+                "products": Product.objects.count(),
+                "history": InventoryHistory.objects.count(),
+            },
+        },
+        "scenarios": {},
+    }
+
+    for scenario_class in SCENARIOS:
+        if args.scenario and scenario_class.name not in args.scenario:
+            continue
+        scenario = scenario_class(context)
+        client = authenticated_client(scenario, context)
+        iterations = args.iterations
+        if scenario.name == "login":
+            # Password hashing dominates; fewer rounds give the same picture
+            iterations = max(1, iterations // 10)
+        results["scenarios"][scenario.name] = run_scenario(
+            scenario, client, iterations, min(args.warmup, iterations)
+        )
+        print(scenario.name, json.dumps(results["scenarios"][scenario.name]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text()))
+
+
+if __name__ == "__main__":
+    main()
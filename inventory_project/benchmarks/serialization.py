@@ -0,0 +1,90 @@
+"""
+Serialization cost per 1k products.
+
+Compares the full ProductSerializer, a ?fields= narrowed serializer and the
+.values() fast path used by ProductViewSet.list, against the configured
+database (seed it with ``manage.py seed_benchmark_data`` first):
+
+    python benchmarks/serialization.py --rounds 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory_project.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.request import Request  # noqa: E402
+from rest_framework.test import APIRequestFactory  # noqa: E402
+from inventory.models import Product  # noqa: E402
+from inventory.serializers import ProductSerializer, SerializerColumns  # noqa: E402
+
+BATCH = 1000
+
+
+def make_request(query=""):
+    return Request(APIRequestFactory().get(f"/api/products/{query}"))
+
+
+def full(request):
+    queryset = Product.objects.all()[:BATCH]
+    return ProductSerializer(queryset, many=True, context={"request": request}).data
+
+
+def narrowed(request):
+    serializer = ProductSerializer(context={"request": request})
+    columns = SerializerColumns(serializer)
+    queryset = Product.objects.select_related(*columns.select_related).only(
+        *sorted(columns.only)
+    )[:BATCH]
+    return ProductSerializer(queryset, many=True, context={"request": request}).data
+
+
+def fast(request):
+    columns = SerializerColumns(ProductSerializer(context={"request": request}))
+    return columns.represent(Product.objects.values(*sorted(columns.values))[:BATCH])
+
+
+def measure(function, request, rounds):
+    function(request)  # warm up
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function(request)
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization cost per 1k products")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    if Product.objects.count() < BATCH:
+        sys.exit(f"Need at least {BATCH} products; run seed_benchmark_data first.")
+
+    slim = "?fields=id,name,stock_quantity"
+    results = {
+        "full_serializer_ms": measure(full, make_request(), args.rounds),
+        "full_serializer_select_related_ms": measure(
+            narrowed, make_request(), args.rounds
+        ),
+        "full_fast_path_ms": measure(fast, make_request(), args.rounds),
+        "slim_serializer_only_ms": measure(narrowed, make_request(slim), args.rounds),
+        "slim_fast_path_ms": measure(fast, make_request(slim), args.rounds),
+    }
+    print(json.dumps({"products": BATCH, "median_ms_per_1k": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,157 @@
+import json
 from django.contrib import admin
-from .models import InventoryHistory
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from . import sales
+from .models import (
+    User,
+    Category,
+    Supplier,
+    Warehouse,
+    Product,
+    ProductBarcode,
+    Order,
+    OrderItem,
+    InventoryHistory,
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for changelists over very large tables.
+
+    On PostgreSQL, counts above ``exact_count_limit`` come from the planner's
+    estimate (table statistics for an unfiltered list, EXPLAIN for a filtered
+    one) instead of a COUNT(*) over every row. Smaller results and other
+    databases are counted exactly.
+    """
+
+    exact_count_limit = 10_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                estimate = self.estimate(queryset, cursor)
+            if estimate >= self.exact_count_limit:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(queryset, cursor):
+        if not queryset.query.where:
+            # Sum over partitions too; a partitioned parent has no rows itself
+            table = queryset.model._meta.db_table
+            cursor.execute(
+                "SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0)::bigint "
+                "FROM pg_class WHERE oid = to_regclass(%s) OR oid IN "
+                "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+                [table, table],
+            )
+            return cursor.fetchone()[0]
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables too large to count: estimated pagination
+    and no second full-table count for the "N total" link.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    list_display = ("username", "email", "role", "is_active")
+    list_filter = ("role", "is_active")
+    search_fields = ("username", "email")
+    readonly_fields = ("password", "last_login", "date_joined")
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = (
+        "name",
+        "parent",
+        "product_count",
+        "total_stock",
+        "total_value",
+        "created_at",
+    )
+    search_fields = ("name",)
+    readonly_fields = ("path", "product_count", "total_stock", "total_value")
+
+
+@admin.register(Supplier)
+class SupplierAdmin(LargeTableAdmin):
+    list_display = ("name", "email", "phone_number", "created_at")
+    search_fields = ("name", "email")
+
+
+@admin.register(Warehouse)
+class WarehouseAdmin(admin.ModelAdmin):
+    list_display = ("code", "name", "priority", "is_active")
+    list_filter = ("is_active",)
+    search_fields = ("code", "name")
+
+
+class ProductBarcodeInline(admin.TabularInline):
+    model = ProductBarcode
+    extra = 0
+
+
+@admin.register(Product)
+class ProductAdmin(LargeTableAdmin):
+    list_display = ("name", "sku", "category", "price", "stock_quantity", "threshold")
+    list_select_related = ("category",)
+    list_filter = ("category",)
+    search_fields = ("name", "=sku", "=barcodes__code")
+    autocomplete_fields = ("category",)
+    inlines = [ProductBarcodeInline]
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    autocomplete_fields = ("product",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("product")
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ("id", "user", "order_type", "status", "total_amount", "created_at")
+    list_select_related = ("user",)
+    list_filter = ("status", "order_type")
+    search_fields = ("id", "user__username")
+    autocomplete_fields = ("user",)
+    readonly_fields = ("sales_day",)
+    inlines = [OrderItemInline]
+
+    def save_related(self, request, form, formsets, change):
+        with sales.items_changing(form.instance):
+            super().save_related(request, form, formsets, change)
+
 
-# Register your models here.
-     
 @admin.register(InventoryHistory)
-class InventoryHistoryAdmin(admin.ModelAdmin):
+class InventoryHistoryAdmin(LargeTableAdmin):
     list_display = ("product", "user", "action", "quantity_changed", "timestamp")
-    list_filter = ("action", "timestamp")
+    list_select_related = ("product", "user")
+    list_filter = ("action",)
+    # Drill-down by year/month/day uses the timestamp index (and the monthly
+    # partitions on PostgreSQL)
+    date_hierarchy = "timestamp"
     search_fields = ("product__name", "user__username")
+    autocomplete_fields = ("product", "user")
@@ -0,0 +1,241 @@
+"""
+Async read-only views for the ASGI deployment.
+
+These mirror the list/retrieve paths of ProductViewSet, CategoryViewSet and
+InventoryHistoryViewSet (plus low_stock and the inventory report) using
+Django's async ORM, so a dashboard fanning out parallel GETs does not tie up
+one worker thread per request. Under WSGI they still work, but each call is
+run in its own event loop and there is no benefit.
+
+Lists run the viewset's filter backends with its filter and ordering
+settings, and reads honour ``?fields=``/``?exclude=``, so a query means the
+same under /api/ and /api/async/. Filters are applied in a thread because
+django-filter validates choices with the sync ORM.
+"""
+
+import math
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from . import routers, throttling
+from .middleware import time_serializer
+from .models import Category, Product, InventoryHistory
+from .reports import abuild_inventory_report, parse_report_dates
+from .serializers import (
+    CategorySerializer,
+    ProductSerializer,
+    InventoryHistorySerializer,
+)
+from .views import ProductViewSet, StandardResultsSetPagination
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=DjangoJSONEncoder)
+
+
+def _page_number(request):
+    try:
+        return max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        return 1
+
+
+def _page_size(request):
+    pagination = StandardResultsSetPagination
+    try:
+        size = int(request.GET.get(pagination.page_size_query_param, 0))
+    except ValueError:
+        size = 0
+    if size <= 0:
+        return pagination.page_size
+    return min(size, pagination.max_page_size)
+
+
+class AsyncReplicaReadView(View):
+    """
+    Authenticate and throttle the caller (inventory.throttling, in the
+    ``throttle_scope`` bucket) and route the view's reads to
+    ``read_database`` (the read replica, see inventory.routers) unless they
+    wrote recently.
+    """
+
+    read_database = routers.REPLICA_DB_ALIAS
+    throttle_scope = None
+    http_method_names = ["get", "head", "options"]
+
+    async def authenticate(self, request):
+        # JWTAuthentication looks the user up with the sync ORM
+        try:
+            result = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except exceptions.AuthenticationFailed:
+            result = None
+        return result if result else (None, None)
+
+    async def throttle_wait(self, request, token):
+        role = throttling.request_role(self.user, token)
+        if role == throttling.ANON_ROLE:
+            ident = BaseThrottle().get_ident(request)
+        else:
+            ident = self.user.pk
+        return await sync_to_async(throttling.throttle_wait)(
+            self.throttle_scope, role, ident
+        )
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.user, token = await self.authenticate(request)
+        wait = await self.throttle_wait(request, token)
+        if wait is not None:
+            response = _json(
+                {
+                    "detail": f"Request was throttled. Expected available in {wait:.0f} seconds."
+                },
+                status=429,
+            )
+            response["Retry-After"] = str(math.ceil(wait))
+            return response
+        pinned = await routers.ais_pinned(self.user)
+        token = routers.use_read_database(None if pinned else self.read_database)
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        finally:
+            routers.reset_read_database(token)
+
+
+class AsyncReadOnlyView(AsyncReplicaReadView):
+    """List or retrieve ``queryset`` with the async ORM."""
+
+    queryset = None
+    serializer_class = None
+    requires_auth = False
+    filter_backends = api_settings.DEFAULT_FILTER_BACKENDS
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    def filter_queryset(self, request, queryset):
+        # ``request`` is a DRF Request; the backends read the same view
+        # attributes as on a GenericAPIView
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+    def serialize(self, request, instance, many=False):
+        context = {"request": Request(request)}
+        serializer = self.serializer_class(instance, many=many, context=context)
+        return time_serializer(serializer).data
+
+    async def get(self, request, pk=None):
+        if self.requires_auth and self.user is None:
+            return _json(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+        if pk is not None:
+            return await self.retrieve(request, pk)
+        return await self.list(request)
+
+    async def retrieve(self, request, pk):
+        try:
+            obj = await self.get_queryset().aget(pk=pk)
+        except self.queryset.model.DoesNotExist:
+            return _json(
+                {
+                    "detail": "No %s matches the given query."
+                    % (self.queryset.model._meta.object_name)
+                },
+                status=404,
+            )
+        return _json(self.serialize(request, obj))
+
+    async def list(self, request):
+        try:
+            queryset = await sync_to_async(self.filter_queryset)(
+                Request(request), self.get_queryset()
+            )
+        except exceptions.ValidationError as exc:
+            return _json(exc.detail, status=400)
+        page, page_size = _page_number(request), _page_size(request)
+        offset = (page - 1) * page_size
+
+        count = await queryset.acount()
+        objects = [
+            obj async for obj in queryset[offset : offset + page_size].aiterator()
+        ]
+        results = self.serialize(request, objects, many=True)
+        return _json(
+            {
+                "count": count,
+                "next": (
+                    self._page_link(request, page + 1)
+                    if offset + page_size < count
+                    else None
+                ),
+                "previous": self._page_link(request, page - 1) if page > 1 else None,
+                "results": results,
+            }
+        )
+
+    def _page_link(self, request, page):
+        params = request.GET.copy()
+        params["page"] = page
+        return request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+
+
+class AsyncProductView(AsyncReadOnlyView):
+    queryset = Product.objects.select_related("category")
+    serializer_class = ProductSerializer
+    requires_auth = True
+    filter_backends = ProductViewSet.filter_backends
+    filterset_class = ProductViewSet.filterset_class
+    ordering_fields = ProductViewSet.ordering_fields
+
+
+class AsyncCategoryView(AsyncReadOnlyView):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+
+
+class AsyncInventoryHistoryView(AsyncReadOnlyView):
+    queryset = InventoryHistory.objects.select_related("product", "user").order_by(
+        "-timestamp"
+    )
+    serializer_class = InventoryHistorySerializer
+
+
+class AsyncLowStockView(AsyncReadOnlyView):
+    queryset = Product.objects.select_related("category")
+    serializer_class = ProductSerializer
+    requires_auth = True
+    throttle_scope = "expensive"
+
+    async def get(self, request):
+        if self.user is None:
+            return _json(
+                {"detail": "Authentication credentials were not provided."},
+                status=401,
+            )
+        products = [
+            obj
+            async for obj in self.get_queryset()
+            .filter(stock_quantity__lt=F("threshold"))
+            .aiterator()
+        ]
+        if products:
+            # send_mail blocks on SMTP, keep it off the event loop
+            await sync_to_async(ProductViewSet().send_low_stock_email)(products)
+        return _json([self.serializer_class(obj).data for obj in products])
+
+
+class AsyncInventoryReportView(AsyncReplicaReadView):
+    throttle_scope = "expensive"
+
+    async def get(self, request):
+        start_date, end_date = parse_report_dates(request.GET)
+        return _json(await abuild_inventory_report(start_date, end_date))
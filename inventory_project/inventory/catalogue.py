@@ -0,0 +1,316 @@
+"""
+Memory-mapped product catalogue snapshot.
+
+The refresh_product_catalogue command keeps a compact binary copy of the
+product columns ProductSerializer renders in PRODUCT_CATALOGUE_PATH. Every
+worker on the host maps the same file read-only, so the page cache holds
+one copy for all of them, and looks products up by id or SKU with a binary
+search over sorted arrays, no query and no unpickling.
+
+File layout (native byte order, host-local):
+
+    header   HEADER
+    ids      int64 x count, sorted
+    records  RECORD x count, in id order
+    skus     uint32 x sku_count, record numbers sorted by SKU
+    strings  UTF-8 text the records point into (offset, length)
+
+Refreshes read only the products whose ``updated_at`` moved since the
+previous snapshot and write a new file next to the old one, then rename it
+over it; readers pick the new file up within a second. Renaming a category
+bumps ``updated_at`` of its products (inventory.signals), so their
+``category__name`` is re-read too. Deleted products are found by comparing
+the snapshot's ids with the table's (one index-only scan of ``id``) and
+dropped from the new file.
+
+Readers only use a snapshot younger than PRODUCT_CATALOGUE_MAX_AGE, so
+stock figures served from it can be that many seconds old.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from .models import Product
+
+MAGIC = b"INVCAT01"
+# magic, count, sku_count, built_at, watermark (microseconds since the epoch)
+HEADER = struct.Struct("=8sIIqq")
+# price (cents), stock_quantity, threshold, created_at, updated_at, then
+# (offset, length) of name, sku, description and category name
+RECORD = struct.Struct("=qqqqq8I")
+NULL = 0xFFFFFFFF
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Snapshot rows have the shape of Product.objects.values(*COLUMNS)
+COLUMNS = (
+    "id",
+    "name",
+    "sku",
+    "description",
+    "category__name",
+    "price",
+    "stock_quantity",
+    "threshold",
+    "created_at",
+    "updated_at",
+)
+
+# Re-read rows changed this long before the last watermark, for
+# transactions that committed after it with an older updated_at
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def to_micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+class Snapshot:
+    """A read-only mapping of one snapshot file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.stat = os.fstat(file.fileno())
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, sku_count, built_at, watermark = HEADER.unpack_from(
+            self.buffer
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a product catalogue snapshot.")
+        self.built_at = built_at / 1_000_000
+        self.watermark = from_micros(watermark)
+
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        self.ids = view[offset : offset + 8 * self.count].cast("q")
+        self.records_offset = offset = offset + 8 * self.count
+        offset += RECORD.size * self.count
+        self.skus = view[offset : offset + 4 * sku_count].cast("I")
+        self.strings_offset = offset + 4 * sku_count
+
+    @property
+    def age(self):
+        return time.time() - self.built_at
+
+    def record(self, index):
+        return RECORD.unpack_from(
+            self.buffer, self.records_offset + index * RECORD.size
+        )
+
+    def record_bytes(self, index):
+        start = self.records_offset + index * RECORD.size
+        return self.buffer[start : start + RECORD.size]
+
+    def string(self, offset, length):
+        if length == NULL:
+            return None
+        start = self.strings_offset + offset
+        return self.buffer[start : start + length].decode()
+
+    def strings(self):
+        return self.buffer[self.strings_offset :]
+
+    def sku_bytes(self, index):
+        _, _, _, _, _, _, _, offset, length, *_ = self.record(index)
+        start = self.strings_offset + offset
+        return self.buffer[start : start + length]
+
+    def index_of(self, pk):
+        ids = self.ids
+        low, high = 0, len(ids)
+        while low < high:
+            middle = (low + high) // 2
+            if ids[middle] < pk:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(ids) and ids[low] == pk:
+            return low
+        return None
+
+    def index_of_sku(self, sku):
+        target = sku.encode()
+        skus = self.skus
+        low, high = 0, len(skus)
+        while low < high:
+            middle = (low + high) // 2
+            if self.sku_bytes(skus[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(skus) and self.sku_bytes(skus[low]) == target:
+            return skus[low]
+        return None
+
+    def row(self, index):
+        price, stock, threshold, created, updated, *strings = self.record(index)
+        name, sku, description, category = (
+            self.string(strings[i], strings[i + 1]) for i in range(0, 8, 2)
+        )
+        return {
+            "id": self.ids[index],
+            "name": name,
+            "sku": sku,
+            "description": description,
+            "category__name": category,
+            "price": Decimal(price).scaleb(-2),
+            "stock_quantity": stock,
+            "threshold": threshold,
+            "created_at": from_micros(created),
+            "updated_at": from_micros(updated),
+        }
+
+    def get(self, pk):
+        """The product row with id ``pk``, or None."""
+        index = self.index_of(pk)
+        return None if index is None else self.row(index)
+
+    def get_by_sku(self, sku):
+        index = self.index_of_sku(sku)
+        return None if index is None else self.row(index)
+
+
+class SnapshotWriter:
+    """Collect records (new rows, or raw records of an older snapshot)."""
+
+    def __init__(self, base=None):
+        self.records = {}
+        self.strings = bytearray()
+        if base is not None:
+            # Keep the old records and their strings as they are; strings of
+            # rows that change are left behind until the next full rebuild
+            self.strings += base.strings()
+            for index, pk in enumerate(base.ids):
+                self.records[pk] = base.record_bytes(index)
+
+    def add_string(self, value):
+        if value is None:
+            return 0, NULL
+        data = value.encode()
+        offset = len(self.strings)
+        self.strings += data
+        return offset, len(data)
+
+    def add(self, row):
+        self.records[row["id"]] = RECORD.pack(
+            int(row["price"] * 100),
+            row["stock_quantity"],
+            row["threshold"],
+            to_micros(row["created_at"]),
+            to_micros(row["updated_at"]),
+            *self.add_string(row["name"]),
+            *self.add_string(row["sku"]),
+            *self.add_string(row["description"]),
+            *self.add_string(row["category__name"]),
+        )
+
+    def write(self, path, watermark):
+        ids = sorted(self.records)
+        records = [self.records[pk] for pk in ids]
+        skus = []
+        for index, record in enumerate(records):
+            offset, length = RECORD.unpack(record)[7:9]
+            if length != NULL:
+                skus.append((bytes(self.strings[offset : offset + length]), index))
+        skus.sort()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(
+                    HEADER.pack(
+                        MAGIC,
+                        len(ids),
+                        len(skus),
+                        int(time.time() * 1_000_000),
+                        to_micros(watermark),
+                    )
+                )
+                file.write(struct.pack(f"={len(ids)}q", *ids))
+                file.write(b"".join(records))
+                file.write(struct.pack(f"={len(skus)}I", *(i for _, i in skus)))
+                file.write(self.strings)
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return len(ids)
+
+
+def refresh(path, full=False):
+    """
+    Bring the snapshot at ``path`` up to date: rows changed since its
+    watermark only, or every product with ``full`` (or when there is no
+    usable snapshot). Returns ``(rows read, products in the snapshot)``.
+    """
+    base = None
+    if not full:
+        try:
+            base = Snapshot(path)
+        except (OSError, ValueError):
+            base = None
+
+    queryset = Product.objects.order_by()
+    if base is not None:
+        queryset = queryset.filter(updated_at__gte=base.watermark - REFRESH_OVERLAP)
+    writer = SnapshotWriter(base)
+    watermark = base.watermark if base is not None else EPOCH
+    read = 0
+    for row in queryset.values(*COLUMNS).iterator(chunk_size=5000):
+        writer.add(row)
+        watermark = max(watermark, row["updated_at"])
+        read += 1
+
+    if base is not None:
+        # Drop products deleted since the last snapshot. Counting rows would
+        # miss a delete and a create in the same window.
+        existing = set(Product.objects.values_list("id", flat=True).order_by())
+        for pk in writer.records.keys() - existing:
+            del writer.records[pk]
+    return read, writer.write(path, watermark)
+
+
+_current = None
+_checked_at = 0.0
+
+
+def snapshot():
+    """
+    This process's mapping of the catalogue snapshot, reopened when the file
+    is replaced; None if the snapshot is disabled, missing or too old.
+    """
+    global _current, _checked_at
+    path = getattr(settings, "PRODUCT_CATALOGUE_PATH", None)
+    if not path:
+        return None
+    now = time.monotonic()
+    if now - _checked_at >= 1.0:
+        _checked_at = now
+        try:
+            stat = os.stat(path)
+        except OSError:
+            _current = None
+        else:
+            if _current is None or (stat.st_ino, stat.st_mtime_ns) != (
+                _current.stat.st_ino,
+                _current.stat.st_mtime_ns,
+            ):
+                try:
+                    _current = Snapshot(path)
+                except (OSError, ValueError):
+                    _current = None
+    if _current is None or _current.age > getattr(
+        settings, "PRODUCT_CATALOGUE_MAX_AGE", 10
+    ):
+        return None
+    return _current
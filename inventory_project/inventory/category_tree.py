@@ -0,0 +1,288 @@
+"""
+Category hierarchy and subtree totals.
+
+Each Category stores its materialised path, its ancestors' ids and its own
+as fixed-width decimal segments ("0000000003" + "0000000017"). A subtree
+is therefore the range of paths starting with the root's path (see
+subtree()), which the path index answers without recursion. Because the
+paths are made of digits only, they sort the same under every database
+collation.
+
+Every category also keeps totals over the products of its subtree: the
+product count, total stock and inventory value (price x stock). They are
+kept up to date incrementally. Product writes (Product.save and delete,
+stock.save_totals, cycle counts) hand their differences to apply_deltas(),
+which adds them to the category and all its ancestors with one UPDATE.
+That UPDATE runs after the writing transaction commits: every product
+write touches the root category, so applying it inside the transaction
+would make all writers queue on the root row until the slowest (a bulk
+order, a cycle count) commits. Totals therefore trail a commit by one
+statement, and a crash in between leaves them off until the next
+rebuild_category_tree. Moving a category moves its subtree's totals
+between the old and new ancestors. rebuild() recomputes paths and totals
+from scratch, e.g. after bulk loads. All of these bump updated_at of the
+categories they change, so the category change feed delivers the new
+totals.
+
+Paths fit Category.path, so categories nest at most MAX_DEPTH (25) levels.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from functools import partial
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Count
+from django.db.models import Max, Value, When
+from django.db.models.functions import Concat, Length, Substr
+from django.utils import timezone
+from .models import Category, Product
+
+SEGMENT_WIDTH = 10
+MAX_DEPTH = Category._meta.get_field("path").max_length // SEGMENT_WIDTH
+ZERO = (0, 0, Decimal(0))
+
+
+def segment(pk):
+    if pk >= 10**SEGMENT_WIDTH - 1:
+        raise ValueError(f"Category id {pk} does not fit in a path segment.")
+    return f"{pk:0{SEGMENT_WIDTH}d}"
+
+
+def ancestor_paths(path):
+    """Paths of the category at ``path`` and its ancestors, root first."""
+    return [path[:end] for end in range(SEGMENT_WIDTH, len(path) + 1, SEGMENT_WIDTH)]
+
+
+def subtree(path, field="path"):
+    """Condition for the category at ``path`` and everything below it."""
+    following = path[:-SEGMENT_WIDTH] + segment(int(path[-SEGMENT_WIDTH:]) + 1)
+    return Q(**{f"{field}__gte": path, f"{field}__lt": following})
+
+
+def product_state(product):
+    return product.category_id, product.stock_quantity, product.price
+
+
+def state_totals(state):
+    """``(category id, (count, stock, value))`` of a product state."""
+    category_id, stock, price = state
+    return category_id, (1, stock, Decimal(price) * stock)
+
+
+def add_paths(totals_by_path):
+    """Add ``{path: (count, stock, value)}`` to those categories."""
+    totals_by_path = {
+        path: totals for path, totals in totals_by_path.items() if any(totals)
+    }
+    if not totals_by_path:
+        return
+
+    def column(index, output_field):
+        return Case(
+            *(
+                When(path=path, then=Value(totals[index]))
+                for path, totals in totals_by_path.items()
+            ),
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    Category.objects.filter(path__in=list(totals_by_path)).update(
+        product_count=F("product_count") + column(0, IntegerField()),
+        total_stock=F("total_stock") + column(1, IntegerField()),
+        total_value=F("total_value")
+        + column(2, DecimalField(max_digits=16, decimal_places=2)),
+        updated_at=timezone.now(),
+    )
+
+
+def apply_deltas(deltas):
+    """
+    Add ``{category id: (count, stock, value)}`` differences to the
+    categories and all their ancestors, in one UPDATE once the current
+    transaction commits (right away outside one). Dropped on rollback.
+    """
+    deltas = {pk: totals for pk, totals in deltas.items() if pk and any(totals)}
+    if deltas:
+        # A failure must not turn a committed write into an error; the
+        # totals are repaired by rebuild_category_tree
+        transaction.on_commit(partial(propagate, deltas), robust=True)
+
+
+def propagate(deltas):
+    """apply_deltas() without waiting for the transaction."""
+    by_path = defaultdict(lambda: ZERO)
+    # Paths as of now, so a category moved in the meantime is handled
+    paths = Category.objects.filter(pk__in=list(deltas)).values_list("pk", "path")
+    for pk, path in paths:
+        for ancestor in ancestor_paths(path):
+            by_path[ancestor] = tuple(
+                total + delta for total, delta in zip(by_path[ancestor], deltas[pk])
+            )
+    add_paths(by_path)
+
+
+def add_delta(deltas, category_id, totals, sign=1):
+    current = deltas.get(category_id, ZERO)
+    deltas[category_id] = tuple(
+        total + sign * value for total, value in zip(current, totals)
+    )
+
+
+def record_products(products):
+    """
+    Apply the changes of saved ``products`` since they were loaded (or
+    last recorded) to the category totals. Products without a recorded
+    state count as new.
+    """
+    deltas = {}
+    for product in products:
+        old = getattr(product, "_category_state", None)
+        new = product_state(product)
+        if old == new:
+            continue
+        if old is not None:
+            add_delta(deltas, *state_totals(old), sign=-1)
+        add_delta(deltas, *state_totals(new))
+        product._category_state = new
+    apply_deltas(deltas)
+
+
+def remove_product(product):
+    """Take a deleted product out of its category's totals."""
+    state = getattr(product, "_category_state", None) or product_state(product)
+    deltas = {}
+    add_delta(deltas, *state_totals(state), sign=-1)
+    apply_deltas(deltas)
+
+
+def depth_below(path):
+    """Levels from the category at ``path`` down to its deepest descendant."""
+    longest = Category.objects.filter(subtree(path)).aggregate(
+        longest=Max(Length("path"))
+    )["longest"]
+    return (longest or len(path)) // SEGMENT_WIDTH - len(path) // SEGMENT_WIDTH
+
+
+def depth_after_move(path, parent_path):
+    """
+    Depth of the deepest category in the subtree at ``path`` (just the
+    category itself when it has no path yet) once placed below
+    ``parent_path``.
+    """
+    depth = len(parent_path) // SEGMENT_WIDTH + 1
+    if path:
+        depth += depth_below(path)
+    return depth
+
+
+def place(category):
+    """
+    Set the path of a saved ``category`` from its parent. When the parent
+    changed, the subtree's paths are rewritten and its totals moved from
+    the old ancestors to the new ones.
+    """
+    parent_path = ""
+    if category.parent_id:
+        parent_path = (
+            Category.objects.filter(pk=category.parent_id)
+            .values_list("path", flat=True)
+            .get()
+        )
+    old_path = category.path
+    new_path = parent_path + segment(category.pk)
+    if old_path == new_path:
+        return
+    if old_path and new_path.startswith(old_path):
+        raise ValueError("A category cannot be moved below itself.")
+    if depth_after_move(old_path, parent_path) > MAX_DEPTH:
+        raise ValueError(f"Categories nest at most {MAX_DEPTH} levels deep.")
+
+    if old_path:
+        totals = (
+            Category.objects.filter(pk=category.pk)
+            .values_list("product_count", "total_stock", "total_value")
+            .get()
+        )
+        add_paths(
+            {
+                path: tuple(-value for value in totals)
+                for path in ancestor_paths(old_path)[:-1]
+            }
+        )
+        Category.objects.filter(subtree(old_path)).update(
+            path=Concat(Value(new_path), Substr("path", len(old_path) + 1)),
+            updated_at=timezone.now(),
+        )
+        add_paths({path: totals for path in ancestor_paths(new_path)[:-1]})
+    else:
+        Category.objects.filter(pk=category.pk).update(
+            path=new_path, updated_at=timezone.now()
+        )
+    category.path = new_path
+
+
+def remove(category):
+    """Take a category that is being deleted out of its ancestors' totals."""
+    totals = (
+        Category.objects.filter(pk=category.pk)
+        .values_list("product_count", "total_stock", "total_value")
+        .first()
+    )
+    if totals is not None and category.path:
+        add_paths(
+            {
+                path: tuple(-value for value in totals)
+                for path in ancestor_paths(category.path)[:-1]
+            }
+        )
+
+
+def rebuild():
+    """Recompute every category's path and totals; returns how many."""
+    categories = {
+        category.pk: category
+        for category in Category.objects.only("id", "parent_id", "path")
+    }
+    paths = {}
+
+    def path_of(pk, seen=()):
+        if pk not in paths:
+            parent_id = categories[pk].parent_id
+            if parent_id in seen:
+                raise ValueError(f"Category {pk} is its own ancestor.")
+            parent = path_of(parent_id, seen + (pk,)) if parent_id else ""
+            paths[pk] = parent + segment(pk)
+        return paths[pk]
+
+    by_path = defaultdict(lambda: ZERO)
+    own = (
+        Product.objects.filter(category__isnull=False)
+        .values("category")
+        .annotate(
+            count=Count("id"),
+            stock=Sum("stock_quantity"),
+            value=Sum(F("price") * F("stock_quantity"), output_field=DecimalField()),
+        )
+        .order_by()
+    )
+    for row in own:
+        totals = (row["count"], row["stock"], row["value"])
+        for ancestor in ancestor_paths(path_of(row["category"])):
+            by_path[ancestor] = tuple(a + b for a, b in zip(by_path[ancestor], totals))
+
+    now = timezone.now()
+    for pk, category in categories.items():
+        category.path = path_of(pk)
+        category.updated_at = now
+        (
+            category.product_count,
+            category.total_stock,
+            category.total_value,
+        ) = by_path[category.path]
+    Category.objects.bulk_update(
+        categories.values(),
+        ["path", "product_count", "total_stock", "total_value", "updated_at"],
+        batch_size=500,
+    )
+    return len(categories)
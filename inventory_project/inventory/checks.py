@@ -0,0 +1,30 @@
+"""
+Deployment checks (``manage.py check --deploy``), run in the release phase.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+# Caches whose add() is not one atomic step shared by every worker
+PROCESS_LOCAL_CACHES = (DummyCache, FileBasedCache, LocMemCache)
+
+
+@register(Tags.caches, deploy=True)
+def check_idempotency_cache(app_configs, **kwargs):
+    if "inventory.middleware.IdempotencyMiddleware" not in settings.MIDDLEWARE:
+        return []
+    alias = getattr(settings, "IDEMPOTENCY_CACHE", "default")
+    if not isinstance(caches[alias], PROCESS_LOCAL_CACHES):
+        return []
+    return [
+        Error(
+            f"IDEMPOTENCY_CACHE {alias!r} is not shared between worker "
+            "processes, so a retry that reaches another worker runs again.",
+            hint="Set REDIS_URL or point IDEMPOTENCY_CACHE at a shared cache.",
+            id="inventory.E001",
+        )
+    ]
@@ -0,0 +1,74 @@
+"""
+Product lookup by SKU or barcode, for scanners.
+
+A batch of codes is resolved with one query (a UNION of the SKU and barcode
+indexes) and each hit is cached for PRODUCT_CODE_CACHE_TTL seconds, so a
+code scanned again shortly after costs one cache read for the whole batch
+and no query. Cached stock figures can be that many seconds old. SKUs are
+read from the catalogue snapshot first when there is a fresh one.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from . import catalogue
+from .models import Product, ProductBarcode
+
+# Columns returned for each code, in this order
+LOOKUP_FIELDS = ("id", "sku", "name", "stock_quantity", "threshold")
+
+
+def cache_key(code):
+    return f"product-code:{code}"
+
+
+def find_products(codes):
+    """``{code: row}`` for the codes that match a SKU or a barcode."""
+    by_barcode = (
+        ProductBarcode.objects.filter(code__in=codes)
+        .order_by()
+        .values_list("code", *(f"product__{name}" for name in LOOKUP_FIELDS))
+    )
+    by_sku = (
+        Product.objects.filter(sku__in=codes)
+        .order_by()
+        .values_list("sku", *LOOKUP_FIELDS)
+    )
+    found = {}
+    for code, *values in by_barcode.union(by_sku, all=True):
+        row = dict(zip(LOOKUP_FIELDS, values))
+        # A code that is one product's SKU and another's barcode means the SKU
+        if code not in found or row["sku"] == code:
+            found[code] = row
+    return found
+
+
+def lookup(codes):
+    """
+    Resolve ``codes`` to stock rows. Returns ``(results, missing)``: the
+    found rows in request order, each with its ``code``, and the unknown
+    codes.
+    """
+    codes = list(dict.fromkeys(codes))
+    found = {}
+    snapshot = catalogue.snapshot()
+    if snapshot is not None:
+        # SKUs are in the catalogue snapshot; barcodes still go to the cache
+        for code in codes:
+            row = snapshot.get_by_sku(code)
+            if row is not None:
+                found[code] = {name: row[name] for name in LOOKUP_FIELDS}
+    keys = {code: cache_key(code) for code in codes if code not in found}
+    cached = cache.get_many(keys.values()) if keys else {}
+    found.update((code, cached[key]) for code, key in keys.items() if key in cached)
+    misses = [code for code in codes if code not in found]
+    if misses:
+        loaded = find_products(misses)
+        if loaded:
+            cache.set_many(
+                {keys[code]: row for code, row in loaded.items()},
+                getattr(settings, "PRODUCT_CODE_CACHE_TTL", 5),
+            )
+        found.update(loaded)
+    results = [{"code": code, **found[code]} for code in codes if code in found]
+    missing = [code for code in codes if code not in found]
+    return results, missing
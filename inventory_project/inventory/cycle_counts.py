@@ -0,0 +1,183 @@
+"""
+Cycle-count reconciliation.
+
+reconcile() loads physical counts of product totals into a temporary
+staging table (with COPY on PostgreSQL) and compares them with
+Product.stock_quantity in one join. Applying the differences takes a fixed
+number of set-based statements whatever the size of the upload, all joined
+against the staging table: one UPDATE of the default warehouse's
+locations, one INSERT ... SELECT of InventoryHistory rows and one UPDATE of
+the product totals. Category totals get the differences. History rows are
+"add" or "remove" by the sign of the difference, like every other stock
+change and like the rows the triggers write.
+
+As with direct edits of stock_quantity, differences are applied at the
+default warehouse, and a count that would take its location below zero is
+rejected. With HISTORY_CAPTURE = "trigger" the history rows come from the
+triggers instead. Cycle-count history rows are not sent to the live stream.
+"""
+
+import io
+from decimal import Decimal
+from django.db import connections, router
+from django.utils import timezone
+from . import category_tree, feed, history_capture, stock
+from .models import Product, StockLocation, InventoryHistory
+
+STAGING_TABLE = "inventory_cycle_count"
+
+VARIANCE_SQL = """
+    SELECT s.product_id, p.name, p.stock_quantity, s.counted, l.quantity,
+        p.category_id, p.price
+    FROM {staging} s
+    LEFT JOIN {product} p ON p.id = s.product_id
+    LEFT JOIN {location} l ON l.product_id = s.product_id AND l.warehouse_id = %s
+    ORDER BY s.product_id
+"""
+
+# Lock the counted products in pk order, as inventory.stock does
+LOCK_SQL = """
+    SELECT count(*) FROM (
+        SELECT p.id FROM {product} p JOIN {staging} s ON s.product_id = p.id
+        ORDER BY p.id FOR UPDATE OF p
+    ) locked
+"""
+
+LOCATION_SQL = """
+    UPDATE {location}
+    SET quantity = {location}.quantity + s.counted - p.stock_quantity, updated_at = %s
+    FROM {staging} s JOIN {product} p ON p.id = s.product_id
+    WHERE {location}.product_id = s.product_id
+        AND {location}.warehouse_id = %s
+        AND s.counted <> p.stock_quantity
+"""
+
+HISTORY_SQL = """
+    INSERT INTO {history} (product_id, user_id, action, quantity_changed, timestamp)
+    SELECT s.product_id, CAST(%s AS {user_type}),
+        CASE WHEN s.counted > p.stock_quantity THEN 'add' ELSE 'remove' END,
+        s.counted - p.stock_quantity, %s
+    FROM {staging} s JOIN {product} p ON p.id = s.product_id
+    WHERE s.counted <> p.stock_quantity
+"""
+
+PRODUCT_SQL = """
+    UPDATE {product}
+    SET stock_quantity = s.counted, updated_at = %s
+    FROM {staging} s
+    WHERE {product}.id = s.product_id AND {product}.stock_quantity <> s.counted
+"""
+
+
+class CycleCountError(ValueError):
+    pass
+
+
+def _create_staging(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE {STAGING_TABLE} "
+        "(product_id bigint PRIMARY KEY, counted integer NOT NULL)"
+    )
+
+
+def _load_staging(cursor, connection, counts):
+    if connection.vendor != "postgresql":
+        cursor.executemany(
+            f"INSERT INTO {STAGING_TABLE} (product_id, counted) VALUES (%s, %s)",
+            list(counts.items()),
+        )
+        return
+    data = "".join(f"{pk}\t{counted}\n" for pk, counted in counts.items())
+    sql = f"COPY {STAGING_TABLE} (product_id, counted) FROM STDIN"
+    raw = cursor.cursor
+    if hasattr(raw, "copy_expert"):
+        # psycopg2
+        raw.copy_expert(sql, io.StringIO(data))
+    else:
+        with raw.copy(sql) as copy:
+            copy.write(data)
+
+
+def reconcile(counts, user=None, apply=True):
+    """
+    Compare ``counts`` (``{product id: counted quantity}``) with the stock
+    totals and, with ``apply``, set the totals to the counts. ``user`` is
+    the inventory User the history rows are attributed to. Returns the
+    variance report. Raises CycleCountError for unknown products and counts
+    the default warehouse cannot absorb; nothing is changed then.
+    """
+    connection = connections[router.db_for_write(Product)]
+    warehouse = stock.default_warehouse()
+    names = {
+        "staging": STAGING_TABLE,
+        "product": Product._meta.db_table,
+        "location": StockLocation._meta.db_table,
+        "history": InventoryHistory._meta.db_table,
+        "user_type": InventoryHistory._meta.get_field("user").rel_db_type(connection),
+    }
+
+    with (
+        feed.hold(),
+        history_capture.acting_user(user),
+        connection.cursor() as cursor,
+    ):
+        _create_staging(cursor)
+        _load_staging(cursor, connection, counts)
+        if apply and connection.vendor == "postgresql":
+            cursor.execute(LOCK_SQL.format(**names))
+        cursor.execute(VARIANCE_SQL.format(**names), [warehouse.pk])
+        rows = cursor.fetchall()
+
+        missing = [pk for pk, name, *_ in rows if name is None]
+        if missing:
+            raise CycleCountError(f"Products do not exist: {missing}")
+        variances, unlocated, short, deltas = [], [], [], {}
+        for pk, name, previous, counted, located, category_id, price in rows:
+            if counted == previous:
+                continue
+            category_tree.add_delta(
+                deltas,
+                category_id,
+                (0, counted - previous, Decimal(str(price)) * (counted - previous)),
+            )
+            variances.append(
+                {
+                    "product": pk,
+                    "name": name,
+                    "previous_quantity": previous,
+                    "counted_quantity": counted,
+                    "variance": counted - previous,
+                }
+            )
+            if (located or 0) + counted - previous < 0:
+                short.append(pk)
+            elif located is None:
+                unlocated.append(pk)
+        if short:
+            raise CycleCountError(
+                f"The default warehouse holds too little of products {short} to "
+                "apply their counts; adjust stock at the other warehouses first."
+            )
+
+        if apply and variances:
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            StockLocation.objects.bulk_create(
+                StockLocation(product_id=pk, warehouse=warehouse) for pk in unlocated
+            )
+            cursor.execute(LOCATION_SQL.format(**names), [now, warehouse.pk])
+            if not history_capture.enabled():
+                cursor.execute(
+                    HISTORY_SQL.format(**names), [user.pk if user else None, now]
+                )
+            cursor.execute(PRODUCT_SQL.format(**names), [now])
+            category_tree.apply_deltas(deltas)
+        cursor.execute(f"DROP TABLE {STAGING_TABLE}")
+
+    return {
+        "applied": apply,
+        "counted": len(rows),
+        "adjusted": len(variances),
+        "net_variance": sum(row["variance"] for row in variances),
+        "variances": variances,
+    }
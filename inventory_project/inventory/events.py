@@ -0,0 +1,176 @@
+"""
+Stock change events for the inventory-history stream.
+
+InventoryHistory rows are published once their transaction commits. On
+PostgreSQL the event goes out through ``pg_notify`` and every process runs
+one LISTEN thread that hands it to its local subscribers; on other databases
+(SQLite) events are only fanned out inside the process that wrote them, and
+streams fall back to a cheap ``id > last_id`` catch-up query on every
+heartbeat so writes from other workers still arrive.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "inventory_history"
+
+
+def history_event(history):
+    """Event payload for an InventoryHistory row."""
+    return {
+        "id": history.pk,
+        "product": history.product_id,
+        "product_name": history.product.name,
+        "category": history.product.category_id,
+        "user": history.user.username if history.user_id else None,
+        "action": history.action,
+        "quantity_changed": history.quantity_changed,
+        "timestamp": history.timestamp,
+    }
+
+
+def encode_event(event):
+    return json.dumps(event, cls=DjangoJSONEncoder)
+
+
+class SyncSubscription:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def put(self, event):
+        self._queue.put(event)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+
+    def put(self, event):
+        # publish() may run on any thread
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Fan events out to the subscribers of this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class PostgresListener(threading.Thread):
+    """LISTEN on CHANNEL and forward notifications to the local broker."""
+
+    def __init__(self, broker, alias="default", poll_timeout=5):
+        super().__init__(name="inventory-history-listener", daemon=True)
+        self.broker = broker
+        self.alias = alias
+        self.poll_timeout = poll_timeout
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as e:
+                logger.error(f"Inventory history listener failed: {e}")
+                threading.Event().wait(self.poll_timeout)
+
+    def listen(self):
+        # A dedicated connection, never handed back to Django
+        db = connections.create_connection(self.alias)
+        db.ensure_connection()
+        raw = db.connection
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+        if hasattr(raw, "poll"):
+            # psycopg2
+            while True:
+                if select.select([raw], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                raw.poll()
+                while raw.notifies:
+                    self.forward(raw.notifies.pop(0).payload)
+        else:
+            # psycopg 3
+            for notify in raw.notifies():
+                self.forward(notify.payload)
+
+    def forward(self, payload):
+        try:
+            self.broker.publish(json.loads(payload))
+        except ValueError:
+            logger.error(f"Dropping malformed inventory history event: {payload!r}")
+
+
+broker = InProcessBroker()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def uses_notify():
+    return connection.vendor == "postgresql"
+
+
+def ensure_listener():
+    global _listener
+    if not uses_notify() or _listener is not None:
+        return
+    with _listener_lock:
+        if _listener is None:
+            _listener = PostgresListener(broker)
+            _listener.start()
+
+
+def publish(event):
+    if uses_notify():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, encode_event(event)])
+    else:
+        broker.publish(json.loads(encode_event(event)))
+
+
+def subscribe(subscription):
+    ensure_listener()
+    return broker.subscribe(subscription)
+
+
+def unsubscribe(subscription):
+    broker.unsubscribe(subscription)
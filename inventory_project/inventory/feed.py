@@ -0,0 +1,184 @@
+"""
+Change feeds for downstream sync.
+
+A feed pages through a model's rows in ``(updated_at, id)`` order
+(``(timestamp, id)`` for the append-only InventoryHistory) from a cursor,
+using keyset conditions an index on those columns answers directly, so a
+consumer that is up to date reads only the rows that changed.
+
+Deleting a Category, Supplier, Product or Order leaves a Tombstone row
+(see signals.py); feeds page through their model's tombstones the same way
+over ``(deleted_at, id)``. Tombstones are kept TOMBSTONE_RETENTION_DAYS; a
+consumer that stays away longer must resync from scratch.
+
+The cursor is opaque to clients and holds both positions. Rows changed in
+the last FEED_SETTLE_SECONDS are held back, so that a transaction that
+commits late with an older ``updated_at`` is not skipped. A transaction
+can run longer than that (a 5000-order bulk create, a large cycle count),
+so the feeds also stop short of the oldest write still in progress (see
+write_horizon()): on PostgreSQL every open transaction that has written,
+elsewhere the writes wrapped in hold() by this process.
+"""
+
+import base64
+import binascii
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Category, Supplier, Product, Order, Tombstone
+
+# Models whose deletes are recorded. InventoryHistory rows are only ever
+# archived, which is retention rather than deletion.
+TOMBSTONE_MODELS = (Category, Supplier, Product, Order)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+START = ((EPOCH, 0), (EPOCH, 0))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+# Start of each write in progress in this process, see hold()
+_holds = {}
+_holds_lock = threading.Lock()
+
+# Start of the oldest other transaction that has written (it has an xid)
+OLDEST_WRITE_SQL = """
+SELECT min(xact_start) FROM pg_stat_activity
+WHERE datname = current_database()
+  AND backend_type = 'client backend'
+  AND backend_xid IS NOT NULL
+  AND pid <> pg_backend_pid()
+"""
+
+
+@contextmanager
+def hold():
+    """
+    Keep the feeds from moving past the start of the write in this block
+    until it ends. For writes that can outlast FEED_SETTLE_SECONDS; enter
+    it outside the write's transaction, so it ends after the commit.
+    """
+    token = object()
+    with _holds_lock:
+        _holds[token] = timezone.now()
+    try:
+        yield
+    finally:
+        with _holds_lock:
+            del _holds[token]
+
+
+def write_horizon(model):
+    """
+    When the oldest write to ``model``'s database that may still commit
+    started, or None. Rows stamped since then may not be visible yet.
+    """
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(OLDEST_WRITE_SQL)
+            return cursor.fetchone()[0]
+    with _holds_lock:
+        return min(_holds.values(), default=None)
+
+
+def _micros(value):
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def encode_cursor(position):
+    (rows_at, rows_id), (deleted_at, deleted_id) = position
+    data = [_micros(rows_at), rows_id, _micros(deleted_at), deleted_id]
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The ``((changed_at, id), (deleted_at, id))`` position of ``cursor``."""
+    if not cursor:
+        return START
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        rows_at, rows_id, deleted_at, deleted_id = (int(value) for value in data)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor.")
+    return (
+        (EPOCH + timedelta(microseconds=rows_at), rows_id),
+        (EPOCH + timedelta(microseconds=deleted_at), deleted_id),
+    )
+
+
+def after(field, timestamp, pk):
+    """Rows strictly after ``(timestamp, pk)`` in ``(field, id)`` order."""
+    return Q(**{f"{field}__gte": timestamp}) & (
+        Q(**{f"{field}__gt": timestamp}) | Q(pk__gt=pk)
+    )
+
+
+def changes(queryset, field, cursor, limit):
+    """
+    One page of the feed over ``queryset`` after ``cursor``: up to
+    ``limit`` changed rows and tombstones together, oldest first.
+    Returns ``(rows, tombstones, next_cursor, has_more)``; rows carry their
+    position as ``feed_position``.
+    """
+    (rows_at, rows_id), (deleted_at, deleted_id) = decode_cursor(cursor)
+    until = timezone.now()
+    horizon = write_horizon(queryset.model)
+    if horizon is not None:
+        until = min(until, horizon)
+    # The settle time also covers clock skew and stamps taken just before
+    # a transaction's first statement
+    until -= timedelta(seconds=getattr(settings, "FEED_SETTLE_SECONDS", 5))
+
+    rows = list(
+        queryset.annotate(feed_position=F(field))
+        .filter(after(field, rows_at, rows_id), **{f"{field}__lt": until})
+        .order_by(field, "pk")[: limit + 1]
+    )
+    tombstones = []
+    if queryset.model in TOMBSTONE_MODELS:
+        tombstones = list(
+            Tombstone.objects.filter(
+                after("deleted_at", deleted_at, deleted_id),
+                model=queryset.model._meta.label_lower,
+                deleted_at__lt=until,
+            ).order_by("deleted_at", "id")[: limit + 1]
+        )
+
+    entries = sorted(
+        [(row.feed_position, 0, row.pk, row) for row in rows]
+        + [
+            (tombstone.deleted_at, 1, tombstone.pk, tombstone)
+            for tombstone in tombstones
+        ],
+        key=lambda entry: entry[:3],
+    )
+    has_more = len(entries) > limit
+    page_rows, page_tombstones = [], []
+    for timestamp, kind, pk, entry in entries[:limit]:
+        if kind == 0:
+            page_rows.append(entry)
+            rows_at, rows_id = timestamp, pk
+        else:
+            page_tombstones.append(entry)
+            deleted_at, deleted_id = timestamp, pk
+    next_cursor = encode_cursor(((rows_at, rows_id), (deleted_at, deleted_id)))
+    return page_rows, page_tombstones, next_cursor, has_more
+
+
+def record_tombstone(instance):
+    Tombstone.objects.create(model=instance._meta.label_lower, object_id=instance.pk)
+
+
+def prune_tombstones(days):
+    """Delete tombstones older than ``days``; returns how many."""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
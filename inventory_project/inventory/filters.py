@@ -0,0 +1,21 @@
+import django_filters
+from . import category_tree
+from .models import Category, Product
+
+
+class ProductFilter(django_filters.FilterSet):
+    category_tree = django_filters.NumberFilter(
+        method="filter_category_tree",
+        label="Category, including its subcategories",
+    )
+
+    class Meta:
+        model = Product
+        fields = ["category", "price"]
+
+    def filter_category_tree(self, queryset, name, value):
+        path = Category.objects.filter(pk=value).values_list("path", flat=True).first()
+        if not path:
+            return queryset.none()
+        # A range on the indexed category path, no recursion
+        return queryset.filter(category_tree.subtree(path, "category__path"))
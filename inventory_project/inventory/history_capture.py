@@ -0,0 +1,249 @@
+"""
+Database-side capture of stock changes.
+
+With HISTORY_CAPTURE = "trigger", triggers on the product table write the
+InventoryHistory row for every change of ``stock_quantity`` (and every new
+product) inside the statement that makes it: API edits, order allocation,
+stock adjustments, the admin and bulk updates alike, without a separate
+INSERT from Python. Edits that leave the stock alone are still logged as
+"update" by the views.
+
+The acting user is handed to the triggers through a session variable:
+``inventory.user_id`` set with ``set_config(..., true)`` on PostgreSQL,
+and the ``inventory_user_id()`` SQL function this module registers on
+every SQLite connection. On SQLite the triggers therefore only work on
+connections opened by Django.
+
+The PostgreSQL ``set_config`` is a statement of its own, sent when a
+block's user is not already set for the transaction. A lone block that
+changes one product makes as many round trips as the Python path
+(set_config and UPDATE instead of UPDATE and INSERT); the trigger saves
+round trips when a block changes several products, when several blocks
+for the same user share a transaction, or when stock changes without a
+user.
+
+The triggers also send the inventory-history stream event (see
+inventory.events): with ``pg_notify`` on PostgreSQL, and through the
+``inventory_history_event()`` function on SQLite, which hands it to this
+process's subscribers once the transaction commits. ``migrate`` installs
+or drops the triggers to match the setting; run it after changing the
+setting.
+"""
+
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from django.conf import settings
+from django.db import connections, router, transaction
+from . import events
+from .models import Product, InventoryHistory, User
+
+FUNCTION = "inventory_capture_stock_change"
+INSERT_TRIGGER = "inventory_product_stock_insert"
+UPDATE_TRIGGER = "inventory_product_stock_update"
+
+# Primary key of the user history rows are attributed to, for SQLite
+_acting_user_id = ContextVar("history_acting_user_id", default=None)
+
+
+def enabled():
+    return getattr(settings, "HISTORY_CAPTURE", "python") == "trigger"
+
+
+@contextmanager
+def acting_user(user):
+    """
+    Attribute the history rows triggers write in this block to ``user`` (an
+    inventory User, or None). The block runs in a transaction.
+    """
+    alias = router.db_for_write(Product)
+    with transaction.atomic(using=alias):
+        if not enabled() or user is None:
+            yield
+            return
+        token = _acting_user_id.set(user.pk)
+        try:
+            connection = connections[alias]
+            if connection.vendor == "postgresql":
+                _set_user(connection, user.pk)
+            yield
+        finally:
+            _acting_user_id.reset(token)
+
+
+def _set_user(connection, user_id):
+    """
+    set_config the acting user, unless the transaction already has it.
+
+    Django replaces ``connection.run_on_commit`` at every commit, rollback
+    and savepoint rollback, which are the points where a transaction-local
+    setting may be lost, so the list identifies the stretch of transaction
+    the user is known to be set for.
+    """
+    commit_hooks, known_user_id = getattr(
+        connection, "inventory_acting_user", (None, None)
+    )
+    if commit_hooks is connection.run_on_commit and known_user_id == user_id:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('inventory.user_id', %s, true)", [str(user_id)]
+        )
+    connection.inventory_acting_user = (connection.run_on_commit, user_id)
+
+
+def _publish_event(connection, payload):
+    # Called by the SQLite triggers with the event of each row they write.
+    # Like the post_save events of the Python path, it is published once the
+    # transaction commits; outside one, the statement commits on its own.
+    event = json.loads(payload)
+    if connection.in_atomic_block:
+        connection.on_commit(partial(events.broker.publish, event))
+    else:
+        events.broker.publish(event)
+
+
+def register_functions(connection):
+    if connection.vendor == "sqlite":
+        connection.connection.create_function(
+            "inventory_user_id", 0, _acting_user_id.get
+        )
+        connection.connection.create_function(
+            "inventory_history_event", 1, partial(_publish_event, connection)
+        )
+
+
+def _tables():
+    return {
+        "product": Product._meta.db_table,
+        "history": InventoryHistory._meta.db_table,
+        "user": User._meta.db_table,
+        "channel": events.CHANNEL,
+        "function": FUNCTION,
+        "insert_trigger": INSERT_TRIGGER,
+        "update_trigger": UPDATE_TRIGGER,
+    }
+
+
+POSTGRESQL_INSTALL = [
+    """
+    CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+    DECLARE
+        acting_user bigint := NULLIF(current_setting('inventory.user_id', true), '')::bigint;
+        delta integer;
+        change varchar(10);
+        history_id bigint;
+        history_at timestamptz := clock_timestamp();
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            delta := NEW.stock_quantity;
+        ELSE
+            delta := NEW.stock_quantity - OLD.stock_quantity;
+        END IF;
+        change := CASE WHEN TG_OP = 'INSERT' OR delta > 0 THEN 'add' ELSE 'remove' END;
+        INSERT INTO {history} (product_id, user_id, action, quantity_changed, timestamp)
+        VALUES (NEW.id, acting_user, change, delta, history_at)
+        RETURNING id INTO history_id;
+        PERFORM pg_notify('{channel}', json_build_object(
+            'id', history_id,
+            'product', NEW.id,
+            'product_name', NEW.name,
+            'category', NEW.category_id,
+            'user', (SELECT username FROM {user} WHERE id = acting_user),
+            'action', change,
+            'quantity_changed', delta,
+            'timestamp', history_at
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS {insert_trigger} ON {product}",
+    """
+    CREATE TRIGGER {insert_trigger} AFTER INSERT ON {product}
+    FOR EACH ROW EXECUTE FUNCTION {function}()
+    """,
+    "DROP TRIGGER IF EXISTS {update_trigger} ON {product}",
+    """
+    CREATE TRIGGER {update_trigger} AFTER UPDATE OF stock_quantity ON {product}
+    FOR EACH ROW WHEN (OLD.stock_quantity IS DISTINCT FROM NEW.stock_quantity)
+    EXECUTE FUNCTION {function}()
+    """,
+]
+
+POSTGRESQL_DROP = [
+    "DROP TRIGGER IF EXISTS {insert_trigger} ON {product}",
+    "DROP TRIGGER IF EXISTS {update_trigger} ON {product}",
+    "DROP FUNCTION IF EXISTS {function}()",
+]
+
+# Django stores SQLite datetimes as UTC text
+SQLITE_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Hands the stream event of the history row just written to Python
+SQLITE_EVENT = """
+        SELECT inventory_history_event(json_object(
+            'id', history.id,
+            'product', NEW.id,
+            'product_name', NEW.name,
+            'category', NEW.category_id,
+            'user', (SELECT username FROM {user} WHERE id = history.user_id),
+            'action', history.action,
+            'quantity_changed', history.quantity_changed,
+            'timestamp', strftime('%Y-%m-%dT%H:%M:%fZ', history.timestamp)
+        ))
+        FROM {history} AS history WHERE history.id = last_insert_rowid();
+"""
+
+SQLITE_INSTALL = [
+    "DROP TRIGGER IF EXISTS {insert_trigger}",
+    """
+    CREATE TRIGGER {insert_trigger} AFTER INSERT ON {product}
+    BEGIN
+        INSERT INTO {history} (product_id, user_id, action, quantity_changed, timestamp)
+        VALUES (NEW.id, inventory_user_id(), 'add', NEW.stock_quantity, %s);
+    %s
+    END
+    """ % (SQLITE_NOW, SQLITE_EVENT),
+    "DROP TRIGGER IF EXISTS {update_trigger}",
+    """
+    CREATE TRIGGER {update_trigger} AFTER UPDATE OF stock_quantity ON {product}
+    WHEN OLD.stock_quantity IS NOT NEW.stock_quantity
+    BEGIN
+        INSERT INTO {history} (product_id, user_id, action, quantity_changed, timestamp)
+        VALUES (
+            NEW.id,
+            inventory_user_id(),
+            CASE WHEN NEW.stock_quantity > OLD.stock_quantity THEN 'add' ELSE 'remove' END,
+            NEW.stock_quantity - OLD.stock_quantity,
+            %s
+        );
+    %s
+    END
+    """ % (SQLITE_NOW, SQLITE_EVENT),
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS {insert_trigger}",
+    "DROP TRIGGER IF EXISTS {update_trigger}",
+]
+
+STATEMENTS = {
+    "postgresql": (POSTGRESQL_INSTALL, POSTGRESQL_DROP),
+    "sqlite": (SQLITE_INSTALL, SQLITE_DROP),
+}
+
+
+def sync_triggers(connection):
+    """Install or drop the triggers on ``connection`` to match the setting."""
+    if connection.vendor not in STATEMENTS:
+        return
+    tables = connection.introspection.table_names()
+    if Product._meta.db_table not in tables:
+        return
+    install, drop = STATEMENTS[connection.vendor]
+    names = _tables()
+    with connection.cursor() as cursor:
+        for statement in install if enabled() else drop:
+            cursor.execute(statement.format(**names))
@@ -0,0 +1,220 @@
+"""
+Monthly partitions and the archive for InventoryHistory.
+
+On PostgreSQL the history table is range-partitioned by month on
+``timestamp`` (migration 0009), so date-range queries only scan the
+partitions they need. ``ensure_partitions`` creates upcoming months ahead of
+the inserts.
+
+``archive_period`` moves the rows of a time range into an
+InventoryHistoryArchive block (gzip CSV, in the database or in a file) and
+removes them from the live table. Whole months are dropped as partitions
+instead of deleted row by row. ``archived_history`` reads the archived rows
+of a range back, so reports cover the archived period transparently.
+"""
+
+import csv
+import gzip
+import io
+from datetime import datetime, time, timezone as dt_timezone
+from pathlib import Path
+from django.db import connections, router, transaction
+from django.utils import timezone
+from .models import InventoryHistory, InventoryHistoryArchive
+
+ARCHIVE_COLUMNS = [
+    "id",
+    "timestamp",
+    "product_id",
+    "product_name",
+    "user_id",
+    "action",
+    "quantity_changed",
+]
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{InventoryHistory._meta.db_table}_p{month:%Y_%m}"
+
+
+def _connection():
+    return connections[router.db_for_write(InventoryHistory)]
+
+
+def is_partitioned():
+    connection = _connection()
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [InventoryHistory._meta.db_table],
+        )
+        return cursor.fetchone() is not None
+
+
+def partition_exists(month):
+    with _connection().cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [partition_name(month)])
+        return cursor.fetchone()[0] is not None
+
+
+def ensure_partitions(start, end):
+    """
+    Create the monthly partitions covering ``start`` to ``end``. Rows of a
+    new month that already landed in the default partition are moved into
+    it. Returns the names of the partitions created.
+    """
+    table = InventoryHistory._meta.db_table
+    created = []
+    month = month_start(start)
+    while month <= end:
+        name = partition_name(month)
+        if not partition_exists(month):
+            lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+            with transaction.atomic(using=_connection().alias):
+                with _connection().cursor() as cursor:
+                    cursor.execute(
+                        f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"
+                    )
+                    cursor.execute(
+                        f"WITH moved AS (DELETE FROM {table}_default "
+                        "WHERE timestamp >= %s AND timestamp < %s RETURNING *) "
+                        f"INSERT INTO {name} SELECT * FROM moved",
+                        [lower, upper],
+                    )
+                    # DDL takes no query parameters
+                    cursor.execute(
+                        f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                        f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+                    )
+            created.append(name)
+        month = add_months(month, 1)
+    return created
+
+
+def _write_csv(rows, stream):
+    with io.TextIOWrapper(
+        gzip.GzipFile(fileobj=stream, mode="wb"), encoding="utf-8", newline=""
+    ) as text:
+        writer = csv.writer(text)
+        writer.writerow(ARCHIVE_COLUMNS)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def archive_period(start, end, directory=None, batch_size=5000):
+    """
+    Move history rows with ``start <= timestamp < end`` into an archive
+    block, written to ``directory`` as a .csv.gz file when given and stored
+    in the database otherwise. Returns the archive, or None when the range
+    has no rows.
+    """
+    queryset = InventoryHistory.objects.filter(timestamp__gte=start, timestamp__lt=end)
+    rows = (
+        queryset.order_by("timestamp", "pk")
+        .values_list(
+            "pk",
+            "timestamp",
+            "product_id",
+            "product__name",
+            "user_id",
+            "action",
+            "quantity_changed",
+        )
+        .iterator(chunk_size=batch_size)
+    )
+    buffer = io.BytesIO()
+    count = _write_csv(rows, buffer)
+    if not count:
+        return None
+
+    archive = InventoryHistoryArchive(
+        period_start=start, period_end=end, row_count=count
+    )
+    if directory:
+        path = Path(directory) / (
+            f"inventory_history_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.csv.gz"
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(buffer.getvalue())
+        archive.path = str(path)
+    else:
+        archive.data = buffer.getvalue()
+
+    whole_month = start == month_start(start) and end == add_months(start, 1)
+    with transaction.atomic(using=_connection().alias):
+        archive.save()
+        if whole_month and is_partitioned() and partition_exists(start):
+            with _connection().cursor() as cursor:
+                cursor.execute(f"DROP TABLE {partition_name(start)}")
+        else:
+            queryset.delete()
+    return archive
+
+
+def _read_archive(archive):
+    if archive.path:
+        stream = open(archive.path, "rb")
+    else:
+        stream = io.BytesIO(archive.data)
+    with stream, io.TextIOWrapper(
+        gzip.GzipFile(fileobj=stream), encoding="utf-8"
+    ) as text:
+        yield from csv.DictReader(text)
+
+
+def _as_datetime(value):
+    # Report filters may be dates, which the ORM compares as local midnight
+    if value is None or isinstance(value, datetime):
+        return value
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+def archived_history(start=None, end=None):
+    """
+    Archived rows with ``start <= timestamp <= end`` (either bound optional),
+    newest first, shaped like the report's history rows.
+
+    A generator: blocks are read one at a time, newest first, so memory
+    holds the matching rows of one block (at most a month) rather than the
+    whole archive. The daily archive run adds later rows of a month as
+    another block with a later end, so this order keeps rows newest first.
+    """
+    start, end = _as_datetime(start), _as_datetime(end)
+    archives = InventoryHistoryArchive.objects.order_by("-period_end", "-period_start")
+    if start:
+        archives = archives.filter(period_end__gt=start)
+    if end:
+        archives = archives.filter(period_start__lte=end)
+
+    # Only the ids; each block's data is loaded when it is read
+    for pk in list(archives.values_list("pk", flat=True)):
+        rows = []
+        for row in _read_archive(InventoryHistoryArchive.objects.get(pk=pk)):
+            timestamp = datetime.fromisoformat(row["timestamp"])
+            if (start and timestamp < start) or (end and timestamp > end):
+                continue
+            rows.append(
+                {
+                    "product__name": row["product_name"],
+                    "action": row["action"],
+                    "quantity_changed": int(row["quantity_changed"]),
+                    "timestamp": timestamp,
+                }
+            )
+        rows.sort(key=lambda row: row["timestamp"], reverse=True)
+        yield from rows
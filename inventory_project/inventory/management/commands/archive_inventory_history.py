@@ -0,0 +1,79 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from inventory import history_storage
+from inventory.models import InventoryHistory
+
+
+class Command(BaseCommand):
+    help = (
+        "Move InventoryHistory rows older than the retention window into "
+        "compressed archive blocks (database or .csv.gz files), one block per "
+        "month, and create upcoming monthly partitions on PostgreSQL. Run it "
+        "daily, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=getattr(settings, "HISTORY_RETENTION_DAYS", 365),
+        )
+        parser.add_argument(
+            "--to",
+            choices=["table", "files"],
+            default="table",
+            help="Store archive blocks in the database or as .csv.gz files.",
+        )
+        parser.add_argument(
+            "--directory",
+            default=getattr(settings, "HISTORY_ARCHIVE_DIR", None),
+            help="Directory for --to files (default HISTORY_ARCHIVE_DIR).",
+        )
+        parser.add_argument("--partitions-ahead", type=int, default=3)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the months that would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        if options["retention_days"] < 1:
+            raise CommandError("--retention-days must be at least 1.")
+        directory = options["directory"] if options["to"] == "files" else None
+        if options["to"] == "files" and not directory:
+            raise CommandError("--to files needs --directory or HISTORY_ARCHIVE_DIR.")
+
+        now = timezone.now()
+        cutoff = now - timedelta(days=options["retention_days"])
+        oldest = (
+            InventoryHistory.objects.order_by("timestamp")
+            .values_list("timestamp", flat=True)
+            .first()
+        )
+
+        month = history_storage.month_start(oldest) if oldest else cutoff
+        while month < cutoff:
+            end = min(history_storage.add_months(month, 1), cutoff)
+            if options["dry_run"]:
+                count = InventoryHistory.objects.filter(
+                    timestamp__gte=month, timestamp__lt=end
+                ).count()
+                self.stdout.write(f"{month:%Y-%m}: {count} rows would be archived")
+            else:
+                archive = history_storage.archive_period(
+                    month, end, directory=directory, batch_size=options["batch_size"]
+                )
+                if archive:
+                    self.stdout.write(f"{month:%Y-%m}: archived {archive.row_count}")
+            month = history_storage.add_months(month, 1)
+
+        if history_storage.is_partitioned() and not options["dry_run"]:
+            created = history_storage.ensure_partitions(
+                now, history_storage.add_months(now, options["partitions_ahead"])
+            )
+            for name in created:
+                self.stdout.write(f"created partition {name}")
+        self.stdout.write(self.style.SUCCESS("History archive up to date."))
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from inventory import sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold daily product sales rollups older than the retention window into "
+        "monthly ones. Run it daily, e.g. from cron. With --rebuild, recompute "
+        "the rollups from the orders first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "SALES_DAILY_RETENTION_DAYS", 90),
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Recompute the rollups from the orders, e.g. after bulk loads.",
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1.")
+        if options["rebuild"]:
+            counted = sales.rebuild()
+            self.stdout.write(f"Counted {counted} sale orders.")
+        compacted = sales.compact(options["days"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Compacted {compacted} daily sales rows.")
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from inventory import report_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired report job results and old failed jobs. Run it "
+        "hourly, e.g. from cron."
+    )
+
+    def handle(self, *args, **options):
+        deleted = report_jobs.prune()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} report jobs."))
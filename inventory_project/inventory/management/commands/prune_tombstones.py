@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from inventory import feed
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change feed tombstones older than the retention window. Run "
+        "it daily, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=getattr(settings, "TOMBSTONE_RETENTION_DAYS", 30),
+        )
+
+    def handle(self, *args, **options):
+        if options["days"] < 1:
+            raise CommandError("--days must be at least 1.")
+        deleted = feed.prune_tombstones(options["days"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstones."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from inventory import category_tree
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute category paths and subtree totals from scratch, e.g. after "
+        "loading products with bulk inserts or raw SQL."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = category_tree.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} categories."))
@@ -0,0 +1,52 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from inventory import catalogue
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the memory-mapped product catalogue snapshot that workers on "
+        "this host read products from (PRODUCT_CATALOGUE_PATH). With "
+        "--interval it keeps running and refreshes it incrementally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--path",
+            default=getattr(settings, "PRODUCT_CATALOGUE_PATH", None),
+            help="Snapshot file (default PRODUCT_CATALOGUE_PATH).",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Seconds between refreshes; 0 refreshes once and exits.",
+        )
+        parser.add_argument(
+            "--rebuild-every",
+            type=float,
+            default=3600,
+            help="Seconds between full rebuilds, which compact the file.",
+        )
+        parser.add_argument("--full", action="store_true", help="Rebuild now.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not path:
+            raise CommandError("Set PRODUCT_CATALOGUE_PATH or pass --path.")
+        full = options["full"]
+        rebuilt_at = time.monotonic()
+        while True:
+            started = time.monotonic()
+            if started - rebuilt_at >= options["rebuild_every"]:
+                full, rebuilt_at = True, started
+            read, total = catalogue.refresh(path, full=full)
+            full = False
+            self.stdout.write(
+                f"{path}: {total} products, {read} read in "
+                f"{(time.monotonic() - started) * 1000:.0f} ms"
+            )
+            if not options["interval"]:
+                break
+            time.sleep(max(options["interval"] - (time.monotonic() - started), 0))
@@ -0,0 +1,248 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from inventory import category_tree, sales
+from inventory.models import (
+    User,
+    Category,
+    Supplier,
+    Product,
+    Warehouse,
+    StockLocation,
+    Order,
+    OrderItem,
+    InventoryHistory,
+)
+
+BENCH_USERNAME = "bench"
+BENCH_PASSWORD = "bench-password"
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk_create keep the timestamps we generate instead of now()."""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with deterministic synthetic data for the benchmark "
+        "suite (benchmarks/run.py)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--suppliers", type=int, default=20)
+        parser.add_argument("--warehouses", type=int, default=5)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument("--orders", type=int, default=20_000)
+        parser.add_argument("--items-per-order", type=int, default=3)
+        parser.add_argument("--history", type=int, default=1_000_000)
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Delete existing inventory data first.",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        self.days = options["days"]
+
+        if options["flush"]:
+            self.flush()
+
+        self.create_users()
+        categories = self.create_categories(options["categories"])
+        self.create_suppliers(options["suppliers"])
+        products = self.create_products(options["products"], categories)
+        self.create_stock_locations(options["warehouses"])
+        self.create_orders(options["orders"], options["items_per_order"], products)
+        self.create_history(options["history"], products)
+        # Rows were bulk-inserted past the incremental category totals and
+        # sales rollups
+        category_tree.rebuild()
+        sales.rebuild()
+        self.stdout.write(self.style.SUCCESS("Benchmark data ready."))
+
+    def flush(self):
+        for model in (
+            InventoryHistory,
+            OrderItem,
+            Order,
+            StockLocation,
+            Product,
+            Warehouse,
+            Supplier,
+            Category,
+        ):
+            model.objects.all().delete()
+
+    def random_timestamp(self):
+        return self.now - timedelta(seconds=self.rng.randrange(self.days * 86400))
+
+    def bulk_create(self, model, rows, label):
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(rows[start : start + self.batch_size])
+        self.stdout.write(f"{label}: {len(rows)}")
+
+    def create_users(self):
+        # Login goes through django.contrib.auth, orders reference inventory.User
+        for model in {get_user_model(), User}:
+            user, _ = model.objects.get_or_create(username=BENCH_USERNAME)
+            user.set_password(BENCH_PASSWORD)
+            user.save()
+        self.bench_user = User.objects.get(username=BENCH_USERNAME)
+
+    def create_categories(self, count):
+        existing = set(Category.objects.values_list("name", flat=True))
+        rows = [
+            Category(name=f"category {i:04d}")
+            for i in range(count)
+            if f"category {i:04d}" not in existing
+        ]
+        self.bulk_create(Category, rows, "categories")
+        return list(Category.objects.values_list("pk", flat=True))
+
+    def create_suppliers(self, count):
+        rows = [
+            Supplier(
+                name=f"supplier {i:04d}",
+                phone_number=f"+2330{i:08d}",
+                email=f"supplier{i}@example.com",
+                address=f"{i} Warehouse Road",
+            )
+            for i in range(count)
+        ]
+        self.bulk_create(Supplier, rows, "suppliers")
+
+    def create_products(self, count, categories):
+        rows = []
+        for i in range(count):
+            created = self.random_timestamp()
+            rows.append(
+                Product(
+                    name=f"product {i:07d}",
+                    description=f"Synthetic product {i} for benchmarks. " * 4,
+                    category_id=self.rng.choice(categories) if categories else None,
+                    price=Decimal(self.rng.randrange(100, 100_000)) / 100,
+                    stock_quantity=self.rng.randrange(0, 1_000_000),
+                    threshold=self.rng.choice((5, 10, 20, 50)),
+                    created_at=created,
+                    updated_at=created,
+                )
+            )
+        created_at = Product._meta.get_field("created_at")
+        updated_at = Product._meta.get_field("updated_at")
+        with explicit_timestamps(created_at, updated_at):
+            self.bulk_create(Product, rows, "products")
+        return list(Product.objects.values_list("pk", "price"))
+
+    def create_stock_locations(self, count):
+        """Split the stock of products without locations over 1-3 warehouses."""
+        for i in range(count):
+            Warehouse.objects.get_or_create(
+                code=f"WH{i + 1}",
+                defaults={"name": f"warehouse {i + 1}", "priority": (i + 1) * 10},
+            )
+        warehouses = list(Warehouse.objects.values_list("pk", flat=True))
+        if not warehouses:
+            return
+        products = Product.objects.filter(
+            stock_quantity__gt=0, locations__isnull=True
+        ).values_list("pk", "stock_quantity")
+        rows = []
+        for product_id, quantity in products.iterator():
+            chosen = self.rng.sample(
+                warehouses, self.rng.randint(1, min(3, len(warehouses)))
+            )
+            cuts = sorted(self.rng.randint(0, quantity) for _ in chosen[1:])
+            shares = [b - a for a, b in zip([0, *cuts], [*cuts, quantity])]
+            rows.extend(
+                StockLocation(product_id=product_id, warehouse_id=pk, quantity=share)
+                for pk, share in zip(chosen, shares)
+            )
+        self.bulk_create(StockLocation, rows, "stock locations")
+
+    def create_orders(self, count, items_per_order, products):
+        if not products:
+            return
+        created_at = Order._meta.get_field("created_at")
+        updated_at = Order._meta.get_field("updated_at")
+        for start in range(0, count, self.batch_size):
+            orders, lines = [], []
+            for _ in range(min(self.batch_size, count - start)):
+                created = self.random_timestamp()
+                items = [
+                    (product_id, price, self.rng.randrange(1, 10))
+                    for product_id, price in self.rng.sample(
+                        products, min(items_per_order, len(products))
+                    )
+                ]
+                orders.append(
+                    Order(
+                        order_type=self.rng.choice(Order.OrderTypeChoices.values),
+                        status=Order.StatusChoices.COMPLETED,
+                        total_amount=sum(price * qty for _, price, qty in items),
+                        user=self.bench_user,
+                        created_at=created,
+                        updated_at=created,
+                    )
+                )
+                lines.append(items)
+            with transaction.atomic(), explicit_timestamps(created_at, updated_at):
+                Order.objects.bulk_create(orders)
+                OrderItem.objects.bulk_create(
+                    OrderItem(
+                        order=order,
+                        product_id=product_id,
+                        quantity=quantity,
+                        price_at_purchase=price,
+                    )
+                    for order, items in zip(orders, lines)
+                    for product_id, price, quantity in items
+                )
+        self.stdout.write(f"orders: {count}")
+
+    def create_history(self, count, products):
+        if not products:
+            return
+        product_ids = [product_id for product_id, _ in products]
+        actions = [choice for choice, _ in InventoryHistory.ACTION_CHOICES]
+        timestamp = InventoryHistory._meta.get_field("timestamp")
+        for start in range(0, count, self.batch_size):
+            rows = []
+            for _ in range(min(self.batch_size, count - start)):
+                action = self.rng.choice(actions)
+                quantity = self.rng.randrange(1, 500)
+                rows.append(
+                    InventoryHistory(
+                        product_id=self.rng.choice(product_ids),
+                        user=self.bench_user if self.rng.random() < 0.5 else None,
+                        action=action,
+                        quantity_changed=-quantity if action == "remove" else quantity,
+                        timestamp=self.random_timestamp(),
+                    )
+                )
+            with transaction.atomic(), explicit_timestamps(timestamp):
+                InventoryHistory.objects.bulk_create(rows)
+            if (start // self.batch_size) % 20 == 0:
+                self.stdout.write(f"history: {start + len(rows)}/{count}")
+        self.stdout.write(f"history: {count}")
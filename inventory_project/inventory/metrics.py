@@ -0,0 +1,160 @@
+"""
+In-process request metrics, exposed in the Prometheus text format.
+
+Each worker process keeps its own registry; Prometheus should scrape every
+worker (or the per-process numbers are summed on the Prometheus side).
+
+The endpoint is closed by default. It answers scrapers that send
+``Authorization: Bearer <METRICS_TOKEN>``, clients in METRICS_ALLOWED_IPS
+and staff users logged in to the admin.
+"""
+
+import hmac
+import threading
+from bisect import bisect_left
+from django.conf import settings
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+
+    def inc(self, labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, labels, value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+
+    def observe(self, labels, value):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 2)
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self):
+        for labels, row in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", bound),), cumulative
+            yield f"{self.name}_sum", labels, row[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics:
+                lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+registry = Registry()
+
+request_latency = registry.register(
+    Histogram(
+        "inventory_request_duration_seconds",
+        "Request latency by view and action.",
+        LATENCY_BUCKETS,
+    )
+)
+request_queries = registry.register(
+    Histogram(
+        "inventory_request_db_queries",
+        "Database queries per request by view and action.",
+        QUERY_BUCKETS,
+    )
+)
+request_db_time = registry.register(
+    Histogram(
+        "inventory_request_db_duration_seconds",
+        "Time spent in the database per request by view and action.",
+        LATENCY_BUCKETS,
+    )
+)
+request_serializer_time = registry.register(
+    Histogram(
+        "inventory_request_serializer_duration_seconds",
+        "Time spent building serializer data per request by view and action.",
+        LATENCY_BUCKETS,
+    )
+)
+response_size = registry.register(
+    Histogram(
+        "inventory_response_size_bytes",
+        "Response body size by view and action.",
+        SIZE_BUCKETS,
+    )
+)
+n_plus_one = registry.register(
+    Counter(
+        "inventory_n_plus_one_total",
+        "Requests that repeated one SQL template past the N+1 threshold.",
+    )
+)
+
+
+def can_read_metrics(request):
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token and hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        return True
+    if request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", ()):
+        return True
+    user = getattr(request, "user", None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponse(
+            "Forbidden\n", status=403, content_type="text/plain; charset=utf-8"
+        )
+    return HttpResponse(
+        registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,785 @@
+import cProfile
+import gzip
+import hashlib
+import logging
+import random
+import re
+import secrets
+import struct
+import uuid
+import zlib
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from time import perf_counter
+from asgiref.sync import (
+    async_to_sync,
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import get_random_string
+from rest_framework.exceptions import APIException, AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics, profiling
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Running total of serializer .data time for the current request
+_serializer_time = ContextVar("serializer_time", default=None)
+
+
+def _timed_data(data):
+    def timed_data(self):
+        totals = _serializer_time.get()
+        if totals is None:
+            return data(self)
+        started = perf_counter()
+        try:
+            return data(self)
+        finally:
+            totals[0] += perf_counter() - started
+
+    return timed_data
+
+
+# Serializer class -> subclass whose .data is timed, built on first use
+_timed_classes = {}
+
+
+def time_serializer(serializer):
+    """
+    Count ``serializer.data`` towards the current request's serializer time.
+
+    Only this instance is affected: its class is swapped for a cached
+    subclass with a timed ``data``, so serializers used outside a view (or
+    outside RequestMetricsMiddleware) are left alone. Views opt in through
+    inventory.views.SerializerTimingMixin.
+    """
+    cls = type(serializer)
+    if _serializer_time.get() is None or getattr(cls, "_timed", False):
+        return serializer
+    timed = _timed_classes.get(cls)
+    if timed is None:
+        timed = type(
+            cls.__name__,
+            (cls,),
+            {
+                "__module__": cls.__module__,
+                "data": property(_timed_data(cls.data.fget)),
+                "_timed": True,
+            },
+        )
+        _timed_classes[cls] = timed
+    serializer.__class__ = timed
+    return serializer
+
+
+# Execute wrappers observing the queries of the current request. A
+# ContextVar follows the request into sync_to_async threads, which the
+# per-connection execute_wrapper() stack does not.
+_query_observers = ContextVar("query_observers", default=())
+
+
+def run_query_observers(execute, sql, params, many, context):
+    for observer in _query_observers.get():
+        execute = partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def install_query_observers(connection):
+    """Add run_query_observers to a new connection (see signals.py)."""
+    if run_query_observers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(run_query_observers)
+
+
+@contextmanager
+def observe_queries(observer):
+    """Pass the queries run in this block, on any thread, to ``observer``."""
+    token = _query_observers.set(_query_observers.get() + (observer,))
+    try:
+        yield observer
+    finally:
+        _query_observers.reset(token)
+
+
+class AsyncCapableMiddleware:
+    """
+    Middleware that runs in both modes. Under ASGI ``__acall__`` awaits the
+    rest of the chain, so Django does not run the whole chain in a thread
+    to adapt it to a sync-only middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class QueryRecorder:
+    """execute_wrapper that counts queries, DB time and repeated SQL."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.templates = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += perf_counter() - started
+            self.count += 1
+            # Django SQL is already parameterised, so the string is the template
+            self.templates[sql] = self.templates.get(sql, 0) + 1
+
+    def repeated(self, threshold):
+        return {sql: n for sql, n in self.templates.items() if n >= threshold}
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Record latency, query count/time, serializer time and response size per
+    view and action, and log likely N+1 patterns.
+
+    Metrics are served by inventory.metrics.metrics_view.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.n_plus_one_threshold = getattr(
+            settings, "METRICS_N_PLUS_ONE_THRESHOLD", 10
+        )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with self.measure() as measurement:
+            response = self.get_response(request)
+        self.record(request, response, measurement)
+        return response
+
+    async def __acall__(self, request):
+        with self.measure() as measurement:
+            response = await self.get_response(request)
+        self.record(request, response, measurement)
+        return response
+
+    @contextmanager
+    def measure(self):
+        recorder = QueryRecorder()
+        token = _serializer_time.set([0.0])
+        started = perf_counter()
+        try:
+            with observe_queries(recorder):
+                yield recorder
+            recorder.elapsed = perf_counter() - started
+            recorder.serializer_time = _serializer_time.get()[0]
+        finally:
+            _serializer_time.reset(token)
+
+    def record(self, request, response, recorder):
+        labels = self.get_labels(request)
+        repeated = recorder.repeated(self.n_plus_one_threshold)
+        with metrics.registry.lock:
+            metrics.request_latency.observe(labels, recorder.elapsed)
+            metrics.request_queries.observe(labels, recorder.count)
+            metrics.request_db_time.observe(labels, recorder.duration)
+            metrics.request_serializer_time.observe(labels, recorder.serializer_time)
+            if not response.streaming:
+                metrics.response_size.observe(labels, len(response.content))
+            if repeated:
+                metrics.n_plus_one.inc(labels)
+
+        for sql, count in repeated.items():
+            logger.warning(
+                f"Possible N+1 in {labels[0][1]}.{labels[1][1]}: "
+                f"{count} executions of {sql[:200]}"
+            )
+
+    @staticmethod
+    def get_labels(request):
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return (("view", "unresolved"), ("action", request.method.lower()))
+        # DRF views carry their class as "cls", Django views as "view_class"
+        view_class = getattr(match.func, "cls", None) or getattr(
+            match.func, "view_class", None
+        )
+        view = view_class.__name__ if view_class else match.func.__name__
+        actions = getattr(match.func, "actions", None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return (("view", view), ("action", action))
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that also runs under ASGI. Whitenoise itself is
+    sync-only, which makes Django run the chain below it in a thread for
+    every request; here only the static files are served from a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+re_accepts_br = re.compile(r"\bbr\b")
+re_accepts_gzip = re.compile(r"\bgzip\b")
+
+
+class GzipCompressor:
+    """
+    Raw deflate with a hand-written gzip header, so the header can carry a
+    random-length file name as padding.
+    """
+
+    def __init__(self, level, padding=b""):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        flags = gzip.FNAME if padding else 0
+        # Magic, deflate, flags, no mtime, no extra flags, unknown OS
+        self.pending = struct.pack("<BBBBIBB", 0x1F, 0x8B, 8, flags, 0, 0, 255)
+        if padding:
+            self.pending += padding + b"\x00"
+        self.crc = 0
+        self.size = 0
+
+    def compress(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        output, self.pending = self.pending + self.compressor.compress(data), b""
+        return output
+
+    def finish(self):
+        trailer = struct.pack("<II", self.crc, self.size & 0xFFFFFFFF)
+        return self.pending + self.compressor.flush() + trailer
+
+
+class BrotliCompressor:
+    """
+    Brotli has no header field to pad, so the padding goes into a metadata
+    meta-block, which decoders skip. flush() first byte-aligns the stream.
+    """
+
+    def __init__(self, quality, padding=b""):
+        self.compressor = brotli.Compressor(quality=quality)
+        self.pending = b""
+        if padding:
+            # ISLAST=0, MNIBBLES=0, reserved bit, one MSKIPLEN byte, the
+            # length minus one, then the skipped bytes (at most 256)
+            skip = len(padding) - 1
+            self.pending = (
+                self.compressor.flush()
+                + bytes((0b010110 | (skip & 3) << 6, skip >> 2))
+                + padding
+            )
+
+    def compress(self, data):
+        output, self.pending = self.pending + self.compressor.process(data), b""
+        return output
+
+    def finish(self):
+        return self.pending + self.compressor.finish()
+
+
+class CompressionMiddleware(AsyncCapableMiddleware):
+    """
+    Brotli/gzip response compression for large API payloads.
+
+    Like django.middleware.gzip.GZipMiddleware, but with a configurable size
+    threshold and content types, Brotli when the client and server support
+    it, and one continuous compressor per streaming response (sync or async)
+    so streamed exports compress as well as buffered ones. Event streams are
+    left alone, they have to reach the client unbuffered.
+
+    As a BREACH mitigation every compressed response is padded with up to
+    COMPRESSION_MAX_RANDOM_BYTES random bytes, as GZipMiddleware does: in
+    the gzip file name, or in a skipped metadata block for Brotli. 0 turns
+    the padding off.
+
+    Under ASGI responses are compressed on the event loop: compressing one
+    response is short CPU work, a thread hop would cost more than it saves.
+
+    Settings: COMPRESSION_MIN_SIZE, COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_BROTLI_QUALITY, COMPRESSION_CONTENT_TYPES and
+    COMPRESSION_MAX_RANDOM_BYTES.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.min_size = getattr(settings, "COMPRESSION_MIN_SIZE", 1024)
+        self.gzip_level = getattr(settings, "COMPRESSION_GZIP_LEVEL", 6)
+        self.brotli_quality = getattr(settings, "COMPRESSION_BROTLI_QUALITY", 5)
+        self.content_types = tuple(
+            getattr(
+                settings,
+                "COMPRESSION_CONTENT_TYPES",
+                ("application/json", "text/html", "text/plain", "text/csv"),
+            )
+        )
+        self.max_random_bytes = min(
+            getattr(settings, "COMPRESSION_MAX_RANDOM_BYTES", 100), 256
+        )
+
+    def get_compressor(self, request):
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is not None and re_accepts_br.search(accept_encoding):
+            return "br", BrotliCompressor(self.brotli_quality, self.get_padding())
+        if re_accepts_gzip.search(accept_encoding):
+            return "gzip", GzipCompressor(self.gzip_level, self.get_padding())
+        return None, None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def get_padding(self):
+        if self.max_random_bytes <= 0:
+            return b""
+        length = secrets.randbelow(self.max_random_bytes) + 1
+        return get_random_string(length).encode()
+
+    def process_response(self, request, response):
+        if response.has_header("Content-Encoding"):
+            return response
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if not content_type.startswith(self.content_types):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding, compressor = self.get_compressor(request)
+        if compressor is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async(
+                    response.streaming_content, compressor
+                )
+            else:
+                response.streaming_content = self.compress_sync(
+                    response.streaming_content, compressor
+                )
+            del response.headers["Content-Length"]
+        else:
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    @staticmethod
+    def compress_sync(chunks, compressor):
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def compress_async(chunks, compressor):
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class IdempotencyMiddleware(AsyncCapableMiddleware):
+    """
+    Idempotency-Key support for API writes.
+
+    The first POST/PUT/PATCH/DELETE with a given key runs normally and its
+    response is stored in the IDEMPOTENCY_CACHE cache for IDEMPOTENCY_TTL
+    seconds. A retry with the same key, caller and path gets the stored
+    response back (with ``Idempotent-Replayed: true``) before the view, and
+    so the ORM, is reached. For the same reason the caller is the user id
+    in a valid bearer token, read from the token itself: a client that
+    refreshes its token keeps its keys. Requests without a valid token are
+    told apart by their Authorization header.
+
+    While the first request runs, the key is held by an advisory lock (an
+    atomic cache.add of a random token) and concurrent retries get 409. The
+    lock is only released by the request holding its token, so a request
+    that outlived IDEMPOTENCY_LOCK_TIMEOUT cannot drop the lock another
+    request took since. Reusing a key for a different body gets 422. Server
+    errors, 409 and 429 responses are not stored, so those requests can be
+    retried for real.
+
+    The lock and the stored responses are only as shared as the cache.
+    With the default LocMemCache they are per process: retries that reach
+    another gunicorn worker run again. Point IDEMPOTENCY_CACHE at a shared
+    cache (REDIS_URL) to get one run per key across workers; ``check
+    --deploy`` fails without one (inventory.checks).
+    """
+
+    # Deletes the lock only while it still holds the caller's token
+    release_script = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    methods = ("POST", "PUT", "PATCH", "DELETE")
+    # Stored per key; Set-Cookie belongs to the original exchange only
+    excluded_headers = ("Set-Cookie", "Content-Length")
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.cache = caches[getattr(settings, "IDEMPOTENCY_CACHE", "default")]
+        self.ttl = getattr(settings, "IDEMPOTENCY_TTL", 24 * 60 * 60)
+        self.lock_timeout = getattr(settings, "IDEMPOTENCY_LOCK_TIMEOUT", 60)
+        self.path_prefixes = tuple(getattr(settings, "IDEMPOTENCY_PATHS", ("/api/",)))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        key = request.headers.get("Idempotency-Key")
+        if not self.applies(request, key):
+            return self.get_response(request)
+        if len(key) > 255:
+            return self.invalid_key()
+
+        cache_key = "idempotency:" + self.scope(request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        stored = self.cache.get(cache_key)
+        if stored is not None:
+            return self.replay(stored, fingerprint)
+
+        lock_key = cache_key + ":lock"
+        lock_token = uuid.uuid4().hex
+        if not self.cache.add(lock_key, lock_token, self.lock_timeout):
+            return self.in_progress()
+        try:
+            # The first request may have finished between get() and add()
+            stored = self.cache.get(cache_key)
+            if stored is not None:
+                return self.replay(stored, fingerprint)
+            response = self.get_response(request)
+            if self.storable(response):
+                self.cache.set(
+                    cache_key, self.serialize(response, fingerprint), self.ttl
+                )
+            return response
+        finally:
+            self.release(lock_key, lock_token)
+
+    async def __acall__(self, request):
+        key = request.headers.get("Idempotency-Key")
+        if not self.applies(request, key):
+            return await self.get_response(request)
+        if len(key) > 255:
+            return self.invalid_key()
+
+        cache_key = "idempotency:" + self.scope(request, key)
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        stored = await self.cache.aget(cache_key)
+        if stored is not None:
+            return self.replay(stored, fingerprint)
+
+        lock_key = cache_key + ":lock"
+        lock_token = uuid.uuid4().hex
+        if not await self.cache.aadd(lock_key, lock_token, self.lock_timeout):
+            return self.in_progress()
+        try:
+            stored = await self.cache.aget(cache_key)
+            if stored is not None:
+                return self.replay(stored, fingerprint)
+            response = await self.get_response(request)
+            if self.storable(response):
+                await self.cache.aset(
+                    cache_key, self.serialize(response, fingerprint), self.ttl
+                )
+            return response
+        finally:
+            await sync_to_async(self.release)(lock_key, lock_token)
+
+    def release(self, lock_key, lock_token):
+        """Delete the lock if it still holds ``lock_token``."""
+        if isinstance(self.cache, RedisCache):
+            # Compare and delete in one step on the server
+            client = self.cache._cache.get_client(lock_key, write=True)
+            client.eval(
+                self.release_script,
+                1,
+                self.cache.make_and_validate_key(lock_key),
+                self.cache._cache._serializer.dumps(lock_token),
+            )
+        elif self.cache.get(lock_key) == lock_token:
+            # Other caches have no compare-and-delete; this only leaves the
+            # window between the two calls
+            self.cache.delete(lock_key)
+
+    def applies(self, request, key):
+        return (
+            bool(key)
+            and request.method in self.methods
+            and request.path.startswith(self.path_prefixes)
+        )
+
+    @staticmethod
+    def invalid_key():
+        return JsonResponse(
+            {"detail": "Idempotency-Key must be at most 255 characters."},
+            status=400,
+        )
+
+    @staticmethod
+    def in_progress():
+        return JsonResponse(
+            {"detail": "A request with this Idempotency-Key is in progress."},
+            status=409,
+            headers={"Retry-After": "1"},
+        )
+
+    @staticmethod
+    def caller(request):
+        header = request.headers.get("Authorization", "")
+        authentication = JWTAuthentication()
+        try:
+            raw_token = authentication.get_raw_token(header.encode())
+            if raw_token is not None:
+                token = authentication.get_validated_token(raw_token)
+                return f"user:{token[jwt_settings.USER_ID_CLAIM]}"
+        except (AuthenticationFailed, KeyError):
+            pass
+        return f"header:{header}"
+
+    @classmethod
+    def scope(cls, request, key):
+        parts = (
+            cls.caller(request),
+            request.method,
+            request.get_full_path(),
+            key,
+        )
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    @staticmethod
+    def storable(response):
+        return (
+            not response.streaming
+            and response.status_code < 500
+            and (response.status_code not in (409, 429))
+        )
+
+    def serialize(self, response, fingerprint):
+        return {
+            "fingerprint": fingerprint,
+            "status": response.status_code,
+            "headers": [
+                (name, value)
+                for name, value in response.headers.items()
+                if name not in self.excluded_headers
+            ],
+            "content": response.content,
+        }
+
+    @staticmethod
+    def replay(stored, fingerprint):
+        if stored["fingerprint"] != fingerprint:
+            return JsonResponse(
+                {
+                    "detail": "This Idempotency-Key was already used with a "
+                    "different request body."
+                },
+                status=422,
+            )
+        response = HttpResponse(stored["content"], status=stored["status"])
+        for name, value in stored["headers"]:
+            response.headers[name] = value
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Opt-in request profiling (inventory.profiling), off unless
+    PROFILING_ENABLED is set.
+
+    A random PROFILING_SAMPLE_RATE fraction of requests, and requests from
+    admins that send the PROFILING_HEADER header, run under cProfile. With
+    PROFILING_SLOW_THRESHOLD set, every other request is stack-sampled and
+    kept when it turns out slower than the threshold. The SQL of profiled
+    requests is kept with the profile, and the response names the profile
+    in ``X-Profile-Id``.
+
+    Streaming responses are profiled up to the point the view returns.
+    Under ASGI only profiled requests leave the async path: with
+    PROFILING_SLOW_THRESHOLD set that is every request under
+    PROFILING_PATHS.
+    """
+
+    skip = "skip"
+
+    def __init__(self, get_response):
+        if not getattr(settings, "PROFILING_ENABLED", False):
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = getattr(settings, "PROFILING_SAMPLE_RATE", 0.0)
+        self.slow_threshold = getattr(settings, "PROFILING_SLOW_THRESHOLD", 0.0)
+        self.header = getattr(settings, "PROFILING_HEADER", "X-Profile")
+        self.path_prefixes = tuple(getattr(settings, "PROFILING_PATHS", ("/api/",)))
+        self.sampler = None
+        if self.slow_threshold:
+            self.sampler = profiling.StackSampler(
+                getattr(settings, "PROFILING_SAMPLE_INTERVAL", 0.01)
+            )
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        reason = self.get_reason(request)
+        if reason == self.skip:
+            return self.get_response(request)
+        return self.profile(request, reason, self.get_response)
+
+    async def __acall__(self, request):
+        if request.headers.get(self.header):
+            # is_admin() authenticates with the sync ORM
+            reason = await sync_to_async(self.get_reason)(request)
+        else:
+            reason = self.get_reason(request)
+        if reason == self.skip:
+            return await self.get_response(request)
+        # cProfile and the stack sampler follow one thread. Profiled requests
+        # run the rest of the chain from the request's sync thread, like a
+        # sync-only middleware; sync views and the async ORM run there too.
+        return await sync_to_async(self.profile)(
+            request, reason, async_to_sync(self.get_response)
+        )
+
+    def get_reason(self, request):
+        """
+        "requested" or "sampled" for a cProfile run, None for stack sampling
+        only, or ``skip`` when the request is not profiled.
+        """
+        if not request.path.startswith(self.path_prefixes):
+            return self.skip
+        if request.headers.get(self.header) and self.is_admin(request):
+            return "requested"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return self.skip if self.sampler is None else None
+
+    def profile(self, request, reason, get_response):
+        queries = profiling.QueryLog()
+        profiler = samples = None
+        started_at = timezone.now()
+        started = perf_counter()
+        with ExitStack() as stack:
+            stack.enter_context(observe_queries(queries))
+            if reason is not None:
+                profiler = self.start_profiler()
+                if profiler is not None:
+                    stack.callback(profiler.disable)
+            else:
+                samples = self.sampler.watch()
+                stack.callback(self.sampler.unwatch)
+            response = get_response(request)
+        elapsed = perf_counter() - started
+
+        if reason is None:
+            if elapsed < self.slow_threshold:
+                return response
+            reason = "slow"
+        if profiler is None and samples is None:
+            return response
+        labels = RequestMetricsMiddleware.get_labels(request)
+        user = getattr(request, "user", None)
+        meta = {
+            "reason": reason,
+            "method": request.method,
+            "path": request.get_full_path(),
+            "view": labels[0][1],
+            "action": labels[1][1],
+            "user": user.get_username() if user and user.is_authenticated else None,
+            "status": response.status_code,
+            "started_at": started_at.isoformat(),
+            "duration": round(elapsed, 6),
+        }
+        try:
+            profile_id = profiling.save(meta, queries.queries, profiler, samples)
+        except Exception as e:
+            logger.error(f"Failed to store request profile: {e}")
+            return response
+        response.headers["X-Profile-Id"] = profile_id
+        return response
+
+    @staticmethod
+    def start_profiler():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is running in this process
+            return None
+        return profiler
+
+    @staticmethod
+    def is_admin(request):
+        # DRF authenticates in the view; the header is checked before it so
+        # that the whole request is profiled
+        drf_request = Request(
+            request,
+            authenticators=[
+                authenticator()
+                for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES
+            ],
+        )
+        try:
+            user = drf_request.user
+        except APIException:
+            return False
+        return bool(user and user.is_staff)
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0007_usertoken"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InventoryHistoryArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("period_start", models.DateTimeField()),
+                ("period_end", models.DateTimeField()),
+                ("row_count", models.PositiveIntegerField()),
+                ("data", models.BinaryField(blank=True, null=True)),
+                ("path", models.CharField(blank=True, max_length=500)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["period_start"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="inventoryhistory",
+            index=models.Index(
+                fields=["timestamp"], name="inventory_history_timestamp"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="inventoryhistoryarchive",
+            index=models.Index(
+                fields=["period_start", "period_end"], name="inventory_archive_period"
+            ),
+        ),
+    ]
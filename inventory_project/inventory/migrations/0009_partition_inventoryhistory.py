@@ -0,0 +1,165 @@
+"""
+Rebuild inventory_inventoryhistory as a table range-partitioned by month on
+``timestamp`` (PostgreSQL only, other databases are left untouched).
+
+Existing rows are copied into the new partitions, so on a large table run
+this in a maintenance window. Later partitions are created ahead of time by
+the archive_inventory_history command; rows outside every partition land in
+the default partition.
+
+The primary key becomes (id, timestamp), as PostgreSQL requires the
+partition key in unique constraints; ids still come from one sequence, so
+Django keeps treating ``id`` as the primary key.
+
+Reversing it copies the rows back into a plain table with ``id`` as the
+primary key. Rows moved to the archive stay there.
+"""
+
+from django.db import migrations
+
+TABLE = "inventory_inventoryhistory"
+LEGACY_TABLE = "inventory_inventoryhistory_unpartitioned"
+SEQUENCE = "inventory_inventoryhistory_id_seq"
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+        [TABLE],
+    )
+    return cursor.fetchone() is not None
+
+
+def foreign_keys_and_indexes(constraints):
+    foreign_keys = {
+        name: (info["columns"][0], *info["foreign_key"])
+        for name, info in constraints.items()
+        if info["foreign_key"]
+    }
+    indexes = {
+        name: info["columns"]
+        for name, info in constraints.items()
+        if info["index"] and not info["primary_key"] and not info["unique"]
+    }
+    return foreign_keys, indexes
+
+
+def create_table(execute, partitioned):
+    # The partitioned table needs the partition key in its primary key; the
+    # plain table gets its primary key after the copy
+    execute(f"""
+        CREATE TABLE {TABLE} (
+            id bigint NOT NULL,
+            action varchar(10) NOT NULL,
+            quantity_changed integer NOT NULL,
+            timestamp timestamp with time zone NOT NULL,
+            product_id bigint NOT NULL,
+            user_id bigint NULL
+            {", PRIMARY KEY (id, timestamp)" if partitioned else ""}
+        ) {"PARTITION BY RANGE (timestamp)" if partitioned else ""}
+        """)
+
+
+def copy_rows(execute):
+    execute(
+        f"INSERT INTO {TABLE} (id, action, quantity_changed, timestamp, product_id, "
+        f"user_id) SELECT id, action, quantity_changed, timestamp, product_id, "
+        f"user_id FROM {LEGACY_TABLE}"
+    )
+
+
+def add_foreign_keys_and_indexes(execute, foreign_keys, indexes):
+    for name, (column, to_table, to_column) in foreign_keys.items():
+        execute(
+            f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+            f"REFERENCES {to_table} ({to_column}) DEFERRABLE INITIALLY DEFERRED"
+        )
+    for name, columns in indexes.items():
+        execute(f"CREATE INDEX {name} ON {TABLE} ({', '.join(columns)})")
+
+
+def partition_history(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return
+        constraints = connection.introspection.get_constraints(cursor, TABLE)
+        cursor.execute(
+            "SELECT date_trunc('month', MIN(timestamp) AT TIME ZONE 'UTC'), "
+            "date_trunc('month', now() AT TIME ZONE 'UTC') "
+            f"FROM {TABLE}"
+        )
+        first, current = cursor.fetchone()
+
+    foreign_keys, indexes = foreign_keys_and_indexes(constraints)
+
+    execute = schema_editor.execute
+    execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}")
+    create_table(execute, partitioned=True)
+    month = first or current
+    while month <= add_months(current, 3):
+        execute(
+            f"CREATE TABLE {TABLE}_p{month:%Y_%m} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') "
+            f"TO ('{add_months(month, 1):%Y-%m-%d} 00:00:00+00')"
+        )
+        month = add_months(month, 1)
+    execute(f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT")
+    copy_rows(execute)
+    # Dropping the old table frees its identity sequence and index names
+    execute(f"DROP TABLE {LEGACY_TABLE}")
+
+    execute(f"CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+    execute(
+        f"SELECT setval('{SEQUENCE}', COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, "
+        "false)"
+    )
+    execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+    add_foreign_keys_and_indexes(execute, foreign_keys, indexes)
+
+
+def unpartition_history(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return
+        constraints = connection.introspection.get_constraints(cursor, TABLE)
+    foreign_keys, indexes = foreign_keys_and_indexes(constraints)
+
+    execute = schema_editor.execute
+    execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}")
+    create_table(execute, partitioned=False)
+    copy_rows(execute)
+    # Drops the partitions and the sequence too, and frees the index names
+    execute(f"DROP TABLE {LEGACY_TABLE}")
+
+    execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)")
+    # An identity column, as Django creates for BigAutoField
+    execute(f"ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+    execute(
+        f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {TABLE}), 0) + 1, false)"
+    )
+    add_foreign_keys_and_indexes(execute, foreign_keys, indexes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0008_inventoryhistory_archive"),
+    ]
+
+    operations = [
+        # The partitioned table has the same columns and indexes, Django's
+        # model state does not change
+        migrations.RunPython(partition_history, unpartition_history),
+    ]
@@ -0,0 +1,45 @@
+"""
+Put the existing stock of every product at the default warehouse, so each
+Product.stock_quantity starts out equal to the sum of its locations.
+"""
+
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 5000
+
+
+def create_default_locations(apps, schema_editor):
+    Product = apps.get_model("inventory", "Product")
+    Warehouse = apps.get_model("inventory", "Warehouse")
+    StockLocation = apps.get_model("inventory", "StockLocation")
+
+    products = Product.objects.filter(stock_quantity__gt=0).values_list(
+        "pk", "stock_quantity"
+    )
+    if not products.exists():
+        return
+    warehouse, _ = Warehouse.objects.get_or_create(
+        code=getattr(settings, "DEFAULT_WAREHOUSE_CODE", "MAIN"),
+        defaults={"name": "Main warehouse", "priority": 0},
+    )
+    batch = []
+    for product_id, quantity in products.order_by("pk").iterator(chunk_size=BATCH_SIZE):
+        batch.append(
+            StockLocation(product_id=product_id, warehouse=warehouse, quantity=quantity)
+        )
+        if len(batch) == BATCH_SIZE:
+            StockLocation.objects.bulk_create(batch)
+            batch = []
+    StockLocation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0010_warehouses"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_default_locations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+"""
+Nest categories. Existing categories become roots: their path is their own
+id segment, and their totals are those of their products.
+"""
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+
+# inventory.category_tree.SEGMENT_WIDTH
+SEGMENT_WIDTH = 10
+
+
+def fill_paths_and_totals(apps, schema_editor):
+    Category = apps.get_model("inventory", "Category")
+    Product = apps.get_model("inventory", "Product")
+
+    totals = {
+        row["category"]: row
+        for row in Product.objects.filter(category__isnull=False)
+        .values("category")
+        .annotate(
+            count=Count("id"),
+            stock=Sum("stock_quantity"),
+            value=Sum(F("price") * F("stock_quantity"), output_field=DecimalField()),
+        )
+        .order_by()
+    }
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.path = f"{category.pk:0{SEGMENT_WIDTH}d}"
+        row = totals.get(category.pk)
+        if row is not None:
+            category.product_count = row["count"]
+            category.total_stock = row["stock"]
+            category.total_value = row["value"]
+    Category.objects.bulk_update(
+        categories,
+        ["path", "product_count", "total_stock", "total_value"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0014_report_jobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="children",
+                to="inventory.category",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="product_count",
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="total_stock",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="total_value",
+            field=models.DecimalField(
+                decimal_places=2, default=0, editable=False, max_digits=16
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="category",
+            index=models.Index(fields=["path"], name="category_path"),
+        ),
+        migrations.RunPython(fill_paths_and_totals, migrations.RunPython.noop),
+    ]
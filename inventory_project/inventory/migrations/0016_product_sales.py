@@ -0,0 +1,118 @@
+"""
+Per-product sales rollups. Existing completed sale orders are counted on the
+day they were last updated; run "manage.py compact_product_sales" afterwards
+to fold the older days into months.
+"""
+
+import django.db.models.deletion
+from collections import defaultdict
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils import timezone
+
+
+def count_completed_sales(apps, schema_editor):
+    Order = apps.get_model("inventory", "Order")
+    OrderItem = apps.get_model("inventory", "OrderItem")
+    ProductSales = apps.get_model("inventory", "ProductSales")
+
+    by_day = defaultdict(list)
+    completed = Order.objects.filter(order_type="sale", status="completed")
+    for pk, updated_at in completed.values_list("pk", "updated_at").iterator():
+        by_day[timezone.localdate(updated_at)].append(pk)
+    for day, pks in by_day.items():
+        for start in range(0, len(pks), 500):
+            Order.objects.filter(pk__in=pks[start : start + 500]).update(sales_day=day)
+
+    totals = (
+        OrderItem.objects.filter(order__sales_day__isnull=False)
+        .values("order__sales_day", "product_id")
+        .annotate(
+            total_units=Sum("quantity"),
+            total_revenue=Sum(
+                F("quantity") * F("price_at_purchase"),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            total_orders=Count("order_id", distinct=True),
+        )
+        .order_by()
+    )
+    ProductSales.objects.bulk_create(
+        (
+            ProductSales(
+                product_id=row["product_id"],
+                period="day",
+                start=row["order__sales_day"],
+                units=row["total_units"],
+                revenue=row["total_revenue"],
+                orders=row["total_orders"],
+            )
+            for row in totals.iterator()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0015_category_tree"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="sales_day",
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name="ProductSales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("day", "Day"), ("month", "Month")], max_length=5
+                    ),
+                ),
+                ("start", models.DateField()),
+                ("units", models.BigIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("orders", models.IntegerField(default=0)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="sales",
+                        to="inventory.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["period", "start", "product"],
+                        name="product_sales_start",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("product", "period", "start"),
+                        name="product_sales_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(count_completed_sales, migrations.RunPython.noop),
+    ]
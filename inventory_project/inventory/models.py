@@ -1,8 +1,10 @@
-from django.db import models
+import uuid
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 
 # from .models import Product
 
@@ -56,14 +58,54 @@ class UserToken(models.Model):
 
 class Category(models.Model):
     name = models.CharField(max_length=255, unique=True)
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="children",
+    )
+    # Materialised path and subtree totals, maintained by inventory.category_tree
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    product_count = models.IntegerField(default=0, editable=False)
+    total_stock = models.BigIntegerField(default=0, editable=False)
+    total_value = models.DecimalField(
+        max_digits=16, decimal_places=2, default=0, editable=False
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name.title()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        category = super().from_db(db, field_names, values)
+        # As loaded, to notice renames (inventory.signals)
+        if "name" in field_names:
+            category._stored_name = category.name
+        return category
+
+    def clean(self):
+        if self.parent_id and self.path and self.parent.path.startswith(self.path):
+            raise ValidationError(
+                {"parent": "A category cannot be moved below itself."}
+            )
+
+    def save(self, *args, **kwargs):
+        # inventory.category_tree imports this module
+        from .category_tree import place
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            place(self)
+
     class Meta:
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["updated_at", "id"], name="category_updated_id"),
+            models.Index(fields=["path"], name="category_path"),
+        ]
 
 
 class Supplier(models.Model):
@@ -77,6 +119,7 @@ class Supplier(models.Model):
     
     class Meta:
         ordering = ['name']
+        indexes = [models.Index(fields=["updated_at", "id"], name="supplier_updated_id")]
 
     def __str__(self):
         return self.name
@@ -84,6 +127,7 @@ class Supplier(models.Model):
 
 class Product(models.Model):
     name = models.CharField(max_length=255)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     category = models.ForeignKey(
         Category,
@@ -105,6 +149,18 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # As loaded, for the category totals (inventory.category_tree)
+        if {"category_id", "stock_quantity", "price"}.issubset(field_names):
+            product._category_state = (
+                product.category_id,
+                product.stock_quantity,
+                product.price,
+            )
+        return product
+
     def is_below_threshold(self):
         """Check if stock quantity is below the threshold."""
         return self.stock_quantity < self.threshold
@@ -126,6 +182,75 @@ class Product(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [models.Index(fields=["updated_at", "id"], name="product_updated_id")]
+
+
+class ProductBarcode(models.Model):
+    """A barcode printed on a product; a product can carry several."""
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="barcodes"
+    )
+    code = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.code
+
+
+class Warehouse(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    code = models.CharField(max_length=20, unique=True)
+    address = models.TextField(blank=True)
+    # Order fulfilment picks from lower numbers first
+    priority = models.PositiveIntegerField(default=100)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["priority", "name"]
+
+    def __str__(self):
+        return self.name
+
+
+class StockLocation(models.Model):
+    """
+    Quantity of a product held at one warehouse. Product.stock_quantity is
+    the total over its locations, kept up to date by inventory.stock.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="locations"
+    )
+    warehouse = models.ForeignKey(
+        Warehouse, on_delete=models.PROTECT, related_name="stock"
+    )
+    quantity = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "warehouse"], name="unique_product_warehouse"
+            ),
+            models.CheckConstraint(
+                condition=models.Q(quantity__gte=0), name="stock_location_quantity_gte_0"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["warehouse", "product"], name="stock_location_warehouse"),
+            # Fulfilment only looks at locations that have stock
+            models.Index(
+                fields=["product", "-quantity"],
+                condition=models.Q(quantity__gt=0),
+                name="stock_location_available",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product} @ {self.warehouse}: {self.quantity}"
 
 
 class Order(models.Model):
@@ -147,13 +272,19 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="orders")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Day the order's items are counted on in ProductSales (inventory.sales);
+    # null while it is not a completed sale
+    sales_day = models.DateField(null=True, blank=True, editable=False)
 
-    def save(self, *args, **kwargs):
-        if not self.pk:  # Calculate total_amount only for new orders
-            self.total_amount = sum(
-                item.price_at_purchase * item.quantity for item in self.items.all()
-            )
-        super().save(*args, **kwargs)
+    def calculate_total(self):
+        """
+        Sum of price_at_purchase * quantity over the order's items.
+        Items need a saved order, so callers set total_amount after creating them.
+        """
+        return sum(item.price_at_purchase * item.quantity for item in self.items.all())
+
+    class Meta:
+        indexes = [models.Index(fields=["updated_at", "id"], name="order_updated_id")]
 
 
 class OrderItem(models.Model):
@@ -167,11 +298,64 @@ class OrderItem(models.Model):
     )
 
     def save(self, *args, **kwargs):
-        if self.quantity > self.product.stock_quantity:
-            raise ValueError("Insufficient stock for this product.")
-        self.product.stock_quantity -= self.quantity
-        self.product.save()
-        super().save(*args, **kwargs)
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # inventory.stock imports this module
+        from .stock import allocate
+
+        with transaction.atomic():
+            # Raises InsufficientStock (a ValueError) when the product is short
+            allocations = allocate([self])
+            super().save(*args, **kwargs)
+            OrderItemAllocation.objects.bulk_create(allocations)
+
+
+class OrderItemAllocation(models.Model):
+    """The warehouse (and quantity) an order item was picked from."""
+
+    order_item = models.ForeignKey(
+        OrderItem, on_delete=models.CASCADE, related_name="allocations"
+    )
+    warehouse = models.ForeignKey(
+        Warehouse, on_delete=models.PROTECT, related_name="allocations"
+    )
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.quantity} x {self.order_item.product} from {self.warehouse}"
+
+
+class ProductSales(models.Model):
+    """
+    Units, revenue and number of completed sale orders of a product over one
+    day, or one month once compacted (inventory.sales).
+    """
+
+    class PeriodChoices(models.TextChoices):
+        DAY = "day", "Day"
+        MONTH = "month", "Month"
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales")
+    period = models.CharField(max_length=5, choices=PeriodChoices.choices)
+    start = models.DateField()
+    units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "period", "start"], name="product_sales_unique"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["period", "start", "product"], name="product_sales_start"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.product} {self.period} {self.start}: {self.units}"
 
 
 class InventoryHistory(models.Model):
@@ -190,7 +374,93 @@ class InventoryHistory(models.Model):
 
     class Meta:
         ordering = ["-timestamp"]  # Default ordering by timestamp descending
+        indexes = [models.Index(fields=["timestamp"], name="inventory_history_timestamp")]
 
     def __str__(self):
         user_name = self.user.username if self.user else "System"
         return f"{self.product.name} - {self.action} by {user_name}"
+
+
+class InventoryHistoryArchive(models.Model):
+    """
+    One gzip-compressed CSV block of InventoryHistory rows moved out of the
+    live table by the archive_inventory_history command. The CSV is stored in
+    ``data``, or in the file at ``path`` when archiving to files.
+    """
+
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()  # exclusive
+    row_count = models.PositiveIntegerField()
+    data = models.BinaryField(null=True, blank=True)
+    path = models.CharField(max_length=500, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["period_start"]
+        indexes = [
+            models.Index(
+                fields=["period_start", "period_end"],
+                name="inventory_archive_period",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.period_start:%Y-%m-%d} - {self.period_end:%Y-%m-%d} ({self.row_count} rows)"
+
+
+class Tombstone(models.Model):
+    """A deleted row, kept for change feed consumers (inventory.feed)."""
+
+    model = models.CharField(max_length=50)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["model", "deleted_at", "id"], name="tombstone_model_deleted"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.model} {self.object_id} deleted at {self.deleted_at}"
+
+
+class ReportJob(models.Model):
+    """A report run in the background (inventory.report_jobs)."""
+
+    class StatusChoices(models.TextChoices):
+        PENDING = "pending", "Pending"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=20)
+    params = models.JSONField(default=dict)
+    params_hash = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=10, choices=StatusChoices.choices, default=StatusChoices.PENDING
+    )
+    error = models.TextField(blank=True)
+    result_size = models.PositiveBigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["params_hash", "created_at"], name="report_job_params")
+        ]
+        constraints = [
+            # One queued or running job per report and parameters
+            models.UniqueConstraint(
+                fields=["params_hash"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="report_job_active_params",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.kind} report {self.pk} ({self.status})"
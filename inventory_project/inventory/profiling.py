@@ -0,0 +1,211 @@
+"""
+Request profiles for slow endpoints.
+
+ProfilingMiddleware (see PROFILING_* in settings) profiles a random
+PROFILING_SAMPLE_RATE fraction of requests with cProfile, and records a
+statistical stack profile of every other request, kept only when it takes
+longer than PROFILING_SLOW_THRESHOLD seconds. An admin can have one request
+profiled with cProfile by sending the PROFILING_HEADER header.
+
+Each profile is stored in PROFILING_DIR as ``<id>.json``, with the request,
+its timing and every SQL statement it ran (without parameters), next to
+the profile itself: ``<id>.prof`` (pstats, for ``python -m pstats`` or
+snakeviz) or ``<id>.folded`` (collapsed stacks, for flame graph tools).
+Only the newest PROFILING_MAX_PROFILES are kept. Admins list and download
+them at /api/profiles/.
+
+The stack sampler is one thread per process that looks at the watched
+request threads every PROFILING_SAMPLE_INTERVAL seconds, so requests that
+turn out fast cost a dictionary update and the SQL list.
+"""
+
+import io
+import json
+import marshal
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+from time import perf_counter, sleep
+from django.conf import settings
+
+# Profile ids: a sortable UTC timestamp and a random suffix
+re_profile_id = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+
+EXTENSIONS = {"cprofile": ".prof", "stack": ".folded"}
+
+
+def profile_dir():
+    return Path(getattr(settings, "PROFILING_DIR", "profiles"))
+
+
+def new_id():
+    now = datetime.now(dt_timezone.utc)
+    return f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+
+
+class QueryLog:
+    """execute_wrapper that keeps every statement and its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "sql": sql,
+                    "many": many,
+                    "duration": round(perf_counter() - started, 6),
+                    "database": context["connection"].alias,
+                }
+            )
+
+
+class StackSampler:
+    """Collect the call stacks of watched threads at a fixed interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.watched = {}
+        self.lock = threading.Lock()
+        # Set while there are threads to sample
+        self.busy = threading.Event()
+        self.thread = None
+
+    def watch(self):
+        """Start sampling the current thread; returns its stack counter."""
+        samples = Counter()
+        with self.lock:
+            self.watched[threading.get_ident()] = samples
+            self.busy.set()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="request-stack-sampler", daemon=True
+                )
+                self.thread.start()
+        return samples
+
+    def unwatch(self):
+        with self.lock:
+            self.watched.pop(threading.get_ident(), None)
+
+    def run(self):
+        while True:
+            self.busy.wait()
+            sleep(self.interval)
+            with self.lock:
+                watched = list(self.watched.items())
+                if not watched:
+                    self.busy.clear()
+                    continue
+            frames = sys._current_frames()
+            for ident, samples in watched:
+                frame = frames.get(ident)
+                if frame is not None:
+                    samples[self.stack(frame)] += 1
+
+    @staticmethod
+    def stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+def _write(path, content):
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def save(meta, queries, profiler=None, samples=None):
+    """
+    Store a profile: ``profiler`` (a stopped cProfile.Profile) or stack
+    ``samples``, with the request ``meta`` and its ``queries``. Returns the
+    profile id.
+    """
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = new_id()
+    kind = "cprofile" if profiler is not None else "stack"
+    if profiler is not None:
+        top = io.StringIO()
+        stats = pstats.Stats(profiler, stream=top)
+        content = marshal.dumps(stats.stats)
+    else:
+        content = "".join(
+            f"{stack} {count}\n" for stack, count in samples.most_common()
+        ).encode()
+    _write(directory / f"{profile_id}{EXTENSIONS[kind]}", content)
+
+    meta = dict(
+        meta,
+        id=profile_id,
+        kind=kind,
+        query_count=len(queries),
+        query_time=round(sum(query["duration"] for query in queries), 6),
+        queries=queries,
+    )
+    if profiler is not None:
+        # The slowest calls, as "python -m pstats" prints them
+        stats.sort_stats("cumulative").print_stats(30)
+        meta["top"] = top.getvalue()
+    _write(directory / f"{profile_id}.json", json.dumps(meta).encode())
+    rotate()
+    return profile_id
+
+
+def rotate():
+    """Delete all but the newest PROFILING_MAX_PROFILES profiles."""
+    keep = getattr(settings, "PROFILING_MAX_PROFILES", 200)
+    stored = sorted(profile_dir().glob("*.json"), reverse=True)
+    for path in stored[keep:]:
+        for extension in (".json", *EXTENSIONS.values()):
+            path.with_suffix(extension).unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first, without the SQL."""
+    profiles = []
+    for path in sorted(profile_dir().glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(path.read_bytes())
+        except (OSError, ValueError):
+            # Rotated away or being written
+            continue
+        meta.pop("queries", None)
+        meta.pop("top", None)
+        profiles.append(meta)
+    return profiles
+
+
+def load(profile_id):
+    """Metadata of a profile, or None."""
+    if not re_profile_id.match(profile_id):
+        return None
+    try:
+        return json.loads((profile_dir() / f"{profile_id}.json").read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+def artefact(meta):
+    """Path of the profile file of ``meta``."""
+    return profile_dir() / f"{meta['id']}{EXTENSIONS[meta['kind']]}"
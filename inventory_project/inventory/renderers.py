@@ -0,0 +1,54 @@
+"""
+JSON renderer and parser backed by orjson when it is installed.
+
+Output matches DRF's JSONRenderer: Decimal, datetime, date and time values
+are handed to DRF's own JSONEncoder (so timezone-aware timestamps keep the
+``...Z`` format and Decimals serialize the same way), everything else is
+encoded natively by orjson. Without orjson both classes behave exactly like
+their DRF parents.
+"""
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        renderer_context = renderer_context or {}
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(data, default=JSONEncoder().default, option=option)
+        except (orjson.JSONEncodeError, TypeError):
+            # e.g. integers beyond 64 bits; the stdlib encoder copes
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace("-", "") != "utf8":
+                body = body.decode(encoding).encode("utf-8")
+            return orjson.loads(body)
+        except (orjson.JSONDecodeError, UnicodeError) as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
@@ -0,0 +1,225 @@
+"""
+Background report jobs.
+
+A job runs one of REPORTS for a set of parameters and stores the result as
+a gzip-compressed JSON file in REPORT_RESULTS_DIR, kept for
+REPORT_RESULT_TTL seconds. Jobs are identified by a hash of the report and
+its parameters: submitting a report that is already queued, running or has
+an unexpired result returns that job instead of starting another, so
+identical requests share one run and one file.
+
+Jobs run on Celery (inventory.tasks) when CELERY_BROKER_URL is set.
+Without a broker they run in a thread of the submitting process once its
+transaction commits, so the request returns at once. That thread still
+shares the web worker's CPU and dies with it; a job lost that way is
+failed after REPORT_JOB_TIMEOUT and can be submitted again. The
+prune_report_jobs command removes expired results.
+
+Clients that do not accept gzip get the result decompressed on the fly,
+with the Content-Length taken from the gzip trailer.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import ReportJob
+from .renderers import FastJSONRenderer
+from .reports import (
+    build_inventory_report,
+    build_movement_report,
+    build_valuation_report,
+)
+
+logger = logging.getLogger(__name__)
+
+REPORTS = {
+    "inventory": build_inventory_report,
+    "valuation": build_valuation_report,
+    "movement": build_movement_report,
+}
+
+# Reports that take no parameters
+UNDATED = {"valuation"}
+
+ACTIVE = [ReportJob.StatusChoices.PENDING, ReportJob.StatusChoices.RUNNING]
+
+
+def params_hash(kind, params):
+    data = json.dumps([kind, params], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def result_file(job):
+    return Path(settings.REPORT_RESULTS_DIR) / f"{job.pk}.json.gz"
+
+
+def is_available(job):
+    """Whether ``job`` has a result that can still be downloaded."""
+    return (
+        job.status == ReportJob.StatusChoices.DONE
+        and job.expires_at > timezone.now()
+        and result_file(job).exists()
+    )
+
+
+def expire_stuck_jobs():
+    """Fail jobs queued or running for longer than REPORT_JOB_TIMEOUT."""
+    cutoff = timezone.now() - timedelta(
+        seconds=getattr(settings, "REPORT_JOB_TIMEOUT", 3600)
+    )
+    return ReportJob.objects.filter(status__in=ACTIVE, created_at__lt=cutoff).update(
+        status=ReportJob.StatusChoices.FAILED,
+        error="Timed out.",
+        finished_at=timezone.now(),
+    )
+
+
+def submit(kind, params):
+    """
+    Queue report ``kind`` for ``params`` unless an identical job can be
+    reused. Returns ``(job, created)``.
+    """
+    digest = params_hash(kind, params)
+    expire_stuck_jobs()
+    job = (
+        ReportJob.objects.filter(params_hash=digest)
+        .filter(
+            Q(status__in=ACTIVE)
+            | Q(status=ReportJob.StatusChoices.DONE, expires_at__gt=timezone.now())
+        )
+        .order_by("-created_at")
+        .first()
+    )
+    if job is not None and (job.status in ACTIVE or is_available(job)):
+        return job, False
+
+    try:
+        with transaction.atomic():
+            job = ReportJob.objects.create(kind=kind, params=params, params_hash=digest)
+    except IntegrityError:
+        # An identical job was submitted at the same time
+        return ReportJob.objects.get(params_hash=digest, status__in=ACTIVE), False
+    transaction.on_commit(lambda: enqueue(job.pk))
+    return job, True
+
+
+def enqueue(job_id):
+    if getattr(settings, "CELERY_BROKER_URL", ""):
+        # Celery is only needed with a broker
+        from .tasks import run_report_job
+
+        run_report_job.delay(str(job_id))
+    else:
+        threading.Thread(
+            target=run_in_thread,
+            args=(job_id,),
+            name=f"report-job-{job_id}",
+            daemon=True,
+        ).start()
+
+
+def run_in_thread(job_id):
+    try:
+        run(job_id)
+    finally:
+        # Connections are per thread; this one's would never be reused
+        connections.close_all()
+
+
+def write_result(job, data):
+    """Write ``data`` as the job's gzipped JSON file; returns its size."""
+    path = result_file(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    content = gzip.compress(FastJSONRenderer().render(data), mtime=0)
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(content)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(content)
+
+
+def read_result(job, chunk_size=64 * 1024):
+    """The job's result decompressed, as an iterator of chunks."""
+    file = gzip.open(result_file(job), "rb")
+
+    def chunks():
+        with file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+
+    return chunks()
+
+
+def result_length(job):
+    """
+    Decompressed size of the job's result, from the gzip trailer (ISIZE,
+    the size modulo 2**32; results are rendered in memory, far below that).
+    """
+    with open(result_file(job), "rb") as file:
+        file.seek(-4, os.SEEK_END)
+        return struct.unpack("<I", file.read(4))[0]
+
+
+def run(job_id):
+    """Run a queued job. Jobs already picked up elsewhere are skipped."""
+    taken = ReportJob.objects.filter(
+        pk=job_id, status=ReportJob.StatusChoices.PENDING
+    ).update(status=ReportJob.StatusChoices.RUNNING, started_at=timezone.now())
+    if not taken:
+        return
+    job = ReportJob.objects.get(pk=job_id)
+    try:
+        dates = {
+            name: parse_date(job.params[name]) if job.params.get(name) else None
+            for name in ("start_date", "end_date")
+        }
+        size = write_result(job, REPORTS[job.kind](**dates))
+    except Exception as e:
+        logger.exception(f"Report job {job_id} failed")
+        ReportJob.objects.filter(pk=job_id).update(
+            status=ReportJob.StatusChoices.FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+        return
+    finished_at = timezone.now()
+    ReportJob.objects.filter(pk=job_id).update(
+        status=ReportJob.StatusChoices.DONE,
+        result_size=size,
+        finished_at=finished_at,
+        expires_at=finished_at + timedelta(seconds=settings.REPORT_RESULT_TTL),
+    )
+
+
+def prune():
+    """Delete expired results and old failed jobs; returns how many."""
+    now = timezone.now()
+    expired = ReportJob.objects.filter(
+        Q(status=ReportJob.StatusChoices.DONE, expires_at__lte=now)
+        | Q(
+            status=ReportJob.StatusChoices.FAILED,
+            finished_at__lte=now - timedelta(seconds=settings.REPORT_RESULT_TTL),
+        )
+    )
+    count = 0
+    for job in expired.iterator():
+        result_file(job).unlink(missing_ok=True)
+        job.delete()
+        count += 1
+    return count
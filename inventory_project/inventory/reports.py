@@ -0,0 +1,145 @@
+from django.db.models import (
+    Sum,
+    F,
+    Q,
+    Count,
+    DecimalField,
+    ExpressionWrapper,
+    BooleanField,
+)
+from django.db.models.functions import TruncMonth
+from django.utils.dateparse import parse_date
+from asgiref.sync import sync_to_async
+from .history_storage import archived_history, month_start
+from .models import Product, InventoryHistory
+
+
+def parse_report_dates(query_params):
+    """Read optional start_date / end_date query parameters."""
+    start_date_param = query_params.get("start_date")
+    end_date_param = query_params.get("end_date")
+
+    start_date = parse_date(str(start_date_param)) if start_date_param else None
+    end_date = parse_date(str(end_date_param)) if end_date_param else None
+    return start_date, end_date
+
+
+def history_date_filter(start_date=None, end_date=None):
+    history_filter = Q()
+    if start_date and end_date:
+        history_filter &= Q(timestamp__range=(start_date, end_date))
+    elif start_date:
+        history_filter &= Q(timestamp__gte=start_date)
+    elif end_date:
+        history_filter &= Q(timestamp__lte=end_date)
+    return history_filter
+
+
+def _report_querysets(start_date=None, end_date=None):
+    # Stock Levels with below_threshold annotation
+    stock_levels = Product.objects.annotate(
+        below_threshold=ExpressionWrapper(
+            Q(stock_quantity__lt=F("threshold")), output_field=BooleanField()
+        )
+    ).values("name", "stock_quantity", "threshold", "below_threshold")
+
+    # Sales/Restocking History
+    history = (
+        InventoryHistory.objects.filter(history_date_filter(start_date, end_date))
+        .order_by("-timestamp")
+        .values("product__name", "action", "quantity_changed", "timestamp")
+    )
+    return stock_levels, history
+
+
+def _total_value_kwargs():
+    return {
+        "total_value": Sum(
+            F("price") * F("stock_quantity"), output_field=DecimalField()
+        )
+    }
+
+
+def build_inventory_report(start_date=None, end_date=None):
+    """Total inventory value, stock levels and history for a date range."""
+    total_value = Product.objects.aggregate(**_total_value_kwargs())["total_value"]
+    stock_levels, history = _report_querysets(start_date, end_date)
+
+    return {
+        "total_value": total_value or 0,
+        "stock_levels": list(stock_levels),
+        # Archived rows are older than everything still in the live table
+        "sales_history": [*history, *archived_history(start_date, end_date)],
+    }
+
+
+def build_valuation_report(start_date=None, end_date=None):
+    """
+    Current stock value per category. The dates are accepted for a uniform
+    signature and ignored.
+    """
+    categories = (
+        Product.objects.values("category__name")
+        .annotate(
+            products=Count("id"),
+            units=Sum("stock_quantity"),
+            **_total_value_kwargs(),
+        )
+        .order_by("category__name")
+    )
+    rows = list(categories)
+    return {
+        "total_value": sum(row["total_value"] or 0 for row in rows),
+        "categories": rows,
+    }
+
+
+def build_movement_report(start_date=None, end_date=None):
+    """Stock moved per month, product and action, archived months included."""
+    live = (
+        InventoryHistory.objects.filter(history_date_filter(start_date, end_date))
+        .annotate(month=TruncMonth("timestamp"))
+        .values("month", "product__name", "action")
+        .annotate(quantity=Sum("quantity_changed"), changes=Count("id"))
+        .order_by()
+    )
+    totals = {}
+    for row in live:
+        key = (row["month"], row["product__name"], row["action"])
+        totals[key] = [row["quantity"], row["changes"]]
+    for row in archived_history(start_date, end_date):
+        key = (month_start(row["timestamp"]), row["product__name"], row["action"])
+        quantity, changes = totals.get(key, (0, 0))
+        totals[key] = [quantity + row["quantity_changed"], changes + 1]
+
+    return {
+        "movements": [
+            {
+                "month": month,
+                "product": product,
+                "action": action,
+                "quantity": quantity,
+                "changes": changes,
+            }
+            for (month, product, action), (quantity, changes) in sorted(
+                totals.items(),
+                key=lambda item: (item[0][0], item[0][1] or "", item[0][2]),
+            )
+        ]
+    }
+
+
+async def abuild_inventory_report(start_date=None, end_date=None):
+    """Async twin of build_inventory_report, safe to await from ASGI views."""
+    total_value = (await Product.objects.aaggregate(**_total_value_kwargs()))[
+        "total_value"
+    ]
+    stock_levels, history = _report_querysets(start_date, end_date)
+
+    return {
+        "total_value": total_value or 0,
+        "stock_levels": [row async for row in stock_levels],
+        "sales_history": [row async for row in history]
+        # The generator queries the database, drain it in a thread
+        + await sync_to_async(list)(archived_history(start_date, end_date)),
+    }
@@ -0,0 +1,90 @@
+"""
+Read-replica routing.
+
+ReplicaRouter sends reads to whatever alias the current request (or
+``read_from`` block) selected, and every write to ``default``. Nothing is
+routed to the replica unless a view opts in, see ReplicaReadMixin in
+views.py, so management commands, signals and the admin keep reading the
+primary.
+
+After a user writes through the API they are pinned to the primary for
+REPLICA_PIN_SECONDS so they read their own writes despite replication lag.
+Pins live in the default cache; with several workers it must be a shared
+cache (Redis, memcached or the database cache) for pins to be seen by the
+worker that serves the next read.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = "replica"
+
+# Alias reads go to for the current request, None means the primary
+_read_alias = ContextVar("read_alias", default=None)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def use_read_database(alias):
+    """Route reads to ``alias``; returns a token for ``reset_read_database``."""
+    if alias not in settings.DATABASES:
+        alias = None
+    return _read_alias.set(alias)
+
+
+def reset_read_database(token):
+    _read_alias.reset(token)
+
+
+@contextmanager
+def read_from(alias=REPLICA_DB_ALIAS):
+    token = use_read_database(alias)
+    try:
+        yield
+    finally:
+        reset_read_database(token)
+
+
+def _pin_key(user):
+    return f"replica-pin:{user._meta.label_lower}:{user.pk}"
+
+
+def pin_to_primary(user):
+    if user is not None and user.is_authenticated and replica_configured():
+        cache.set(_pin_key(user), True, getattr(settings, "REPLICA_PIN_SECONDS", 5))
+
+
+def is_pinned(user):
+    if user is None or not user.is_authenticated:
+        return False
+    return bool(cache.get(_pin_key(user)))
+
+
+async def ais_pinned(user):
+    if user is None or not user.is_authenticated:
+        return False
+    return bool(await cache.aget(_pin_key(user)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        if _read_alias.get() is not None:
+            # The request has started writing, keep its remaining reads on
+            # the primary so they see the write
+            _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        aliases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
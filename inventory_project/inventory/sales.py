@@ -0,0 +1,328 @@
+"""
+Per-product sales rollups.
+
+ProductSales holds the units, revenue (quantity x price_at_purchase) and
+number of orders of each product per day. A sale order is added to the
+rollups on the day it becomes completed, and taken out again on that same
+day if it stops being a completed sale or is deleted; Order.sales_day
+records which day that is, so sync_orders() is idempotent. Writes are
+upserts that add to the existing rows (INSERT ... ON CONFLICT DO UPDATE),
+one statement per batch of rows.
+
+compact() folds daily rows older than SALES_DAILY_RETENTION_DAYS into
+monthly rows, so the table grows with the number of products sold per day
+rather than with the order history. The top-seller, velocity and
+days-of-cover endpoints read the daily rows of their window only.
+rebuild() recomputes everything from the orders, e.g. after bulk loads.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, FloatField
+from django.db.models import Q, Sum
+from django.db.models.functions import Cast, TruncMonth
+from django.utils import timezone
+from .models import Order, OrderItem, ProductSales
+
+BATCH_SIZE = 500
+
+UPSERT_SQL = """
+    INSERT INTO {table} (product_id, period, {start}, units, revenue, orders)
+    VALUES {values}
+    ON CONFLICT (product_id, period, {start}) DO UPDATE SET
+        units = {table}.units + excluded.units,
+        revenue = {table}.revenue + excluded.revenue,
+        orders = {table}.orders + excluded.orders
+"""
+
+
+def retention_days():
+    return getattr(settings, "SALES_DAILY_RETENTION_DAYS", 90)
+
+
+def counts(order):
+    """Whether ``order`` belongs in the rollups."""
+    return (
+        order.order_type == Order.OrderTypeChoices.SALE
+        and order.status == Order.StatusChoices.COMPLETED
+    )
+
+
+def add_rows(rows, period=ProductSales.PeriodChoices.DAY):
+    """Add ``{(start, product id): [units, revenue, orders]}`` to the rollups."""
+    rows = [(key, totals) for key, totals in rows.items() if any(totals)]
+    if not rows:
+        return
+    connection = connections[router.db_for_write(ProductSales)]
+    table = connection.ops.quote_name(ProductSales._meta.db_table)
+    start = connection.ops.quote_name("start")
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), BATCH_SIZE):
+            batch = rows[offset : offset + BATCH_SIZE]
+            params = []
+            for (day, product_id), (units, revenue, orders) in batch:
+                params += [
+                    product_id,
+                    period,
+                    connection.ops.adapt_datefield_value(day),
+                    units,
+                    connection.ops.adapt_decimalfield_value(revenue, 14, 2),
+                    orders,
+                ]
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(batch))
+            cursor.execute(
+                UPSERT_SQL.format(table=table, start=start, values=values), params
+            )
+
+
+def order_rows(days, sign=1):
+    """
+    Rollup rows of the orders in ``days`` (``{order id: day}``), negated
+    with ``sign=-1``.
+    """
+    rows = defaultdict(lambda: [0, Decimal(0), 0])
+    items = OrderItem.objects.filter(order_id__in=list(days)).values_list(
+        "order_id", "product_id", "quantity", "price_at_purchase"
+    )
+    counted = set()
+    for order_id, product_id, quantity, price in items:
+        totals = rows[days[order_id], product_id]
+        totals[0] += sign * quantity
+        totals[1] += sign * quantity * price
+        if (order_id, product_id) not in counted:
+            # An order can hold several items of a product
+            counted.add((order_id, product_id))
+            totals[2] += sign
+    return rows
+
+
+def merge(rows, more):
+    for key, totals in more.items():
+        current = rows.setdefault(key, [0, Decimal(0), 0])
+        for index, value in enumerate(totals):
+            current[index] += value
+    return rows
+
+
+def sync_orders(order_ids):
+    """
+    Add orders that became completed sales to today's rollups and take out
+    those that no longer are. Orders already in the right state are left
+    alone, so calling this again is harmless.
+    """
+    today = timezone.localdate()
+    with transaction.atomic(using=router.db_for_write(ProductSales)):
+        orders = (
+            Order.objects.select_for_update()
+            .filter(pk__in=list(order_ids))
+            .only("id", "order_type", "status", "sales_day")
+            .order_by("pk")
+        )
+        added, removed = {}, {}
+        for order in orders:
+            if counts(order) and order.sales_day is None:
+                added[order.pk] = today
+            elif not counts(order) and order.sales_day is not None:
+                removed[order.pk] = order.sales_day
+        if not added and not removed:
+            return
+        add_rows(merge(order_rows(added), order_rows(removed, sign=-1)))
+        if added:
+            Order.objects.filter(pk__in=list(added)).update(sales_day=today)
+        if removed:
+            Order.objects.filter(pk__in=list(removed)).update(sales_day=None)
+
+
+def remove_order(order):
+    """Take an order that is being deleted out of the rollups."""
+    day = Order.objects.filter(pk=order.pk).values_list("sales_day", flat=True).first()
+    if day is not None:
+        add_rows(order_rows({order.pk: day}, sign=-1))
+
+
+@contextmanager
+def items_changing(order):
+    """
+    Keep the rollups right while the items of a saved ``order`` are edited
+    in the block: a counted order's old items are taken out of its day and
+    the new ones added back.
+    """
+    with transaction.atomic(using=router.db_for_write(ProductSales)):
+        day = (
+            Order.objects.select_for_update()
+            .filter(pk=order.pk)
+            .values_list("sales_day", flat=True)
+            .first()
+        )
+        if day is None:
+            yield
+            return
+        before = order_rows({order.pk: day}, sign=-1)
+        yield
+        add_rows(merge(before, order_rows({order.pk: day})))
+
+
+def compact(days=None):
+    """
+    Fold daily rows older than ``days`` (SALES_DAILY_RETENTION_DAYS) into
+    monthly rows and drop empty rows. Returns how many daily rows went.
+    """
+    cutoff = timezone.localdate() - timedelta(
+        days=retention_days() if days is None else days
+    )
+    old = ProductSales.objects.filter(
+        period=ProductSales.PeriodChoices.DAY, start__lt=cutoff
+    )
+    with transaction.atomic(using=router.db_for_write(ProductSales)):
+        months = (
+            old.annotate(month=TruncMonth("start"))
+            .values("month", "product_id")
+            .annotate(
+                total_units=Sum("units"),
+                total_revenue=Sum("revenue"),
+                total_orders=Sum("orders"),
+            )
+            .order_by()
+        )
+        add_rows(
+            {
+                (row["month"], row["product_id"]): [
+                    row["total_units"],
+                    row["total_revenue"],
+                    row["total_orders"],
+                ]
+                for row in months
+            },
+            period=ProductSales.PeriodChoices.MONTH,
+        )
+        deleted, _ = old.delete()
+        ProductSales.objects.filter(units=0, revenue=0, orders=0).delete()
+    return deleted
+
+
+def rebuild():
+    """
+    Recompute the rollups from the orders. Completed sales that were never
+    counted (bulk loads) are counted on the day they were last updated.
+    Returns how many orders are counted.
+    """
+    with transaction.atomic(using=router.db_for_write(ProductSales)):
+        Order.objects.exclude(
+            order_type=Order.OrderTypeChoices.SALE,
+            status=Order.StatusChoices.COMPLETED,
+        ).exclude(sales_day=None).update(sales_day=None)
+        uncounted = Order.objects.filter(
+            order_type=Order.OrderTypeChoices.SALE,
+            status=Order.StatusChoices.COMPLETED,
+            sales_day=None,
+        ).values_list("pk", "updated_at")
+        by_day = defaultdict(list)
+        for pk, updated_at in uncounted.iterator():
+            by_day[timezone.localdate(updated_at)].append(pk)
+        for day, pks in by_day.items():
+            for offset in range(0, len(pks), BATCH_SIZE):
+                Order.objects.filter(pk__in=pks[offset : offset + BATCH_SIZE]).update(
+                    sales_day=day
+                )
+
+        ProductSales.objects.all().delete()
+        totals = (
+            OrderItem.objects.filter(order__sales_day__isnull=False)
+            .values("order__sales_day", "product_id")
+            .annotate(
+                total_units=Sum("quantity"),
+                total_revenue=Sum(
+                    F("quantity") * F("price_at_purchase"),
+                    output_field=DecimalField(max_digits=14, decimal_places=2),
+                ),
+                total_orders=Count("order_id", distinct=True),
+            )
+            .order_by()
+        )
+        ProductSales.objects.bulk_create(
+            (
+                ProductSales(
+                    product_id=row["product_id"],
+                    period=ProductSales.PeriodChoices.DAY,
+                    start=row["order__sales_day"],
+                    units=row["total_units"],
+                    revenue=row["total_revenue"],
+                    orders=row["total_orders"],
+                )
+                for row in totals.iterator()
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        compact()
+        return Order.objects.filter(sales_day__isnull=False).count()
+
+
+def window(days):
+    """Daily rollup rows of the last ``days`` days, today included."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    return ProductSales.objects.filter(
+        period=ProductSales.PeriodChoices.DAY, start__gte=since
+    )
+
+
+def top_sellers(days, limit, by="units"):
+    """The ``limit`` best-selling products of the last ``days`` days."""
+    return list(
+        window(days)
+        .values("product_id", "product__name", "product__sku")
+        .annotate(total_units=Sum("units"), total_revenue=Sum("revenue"))
+        .filter(Q(total_units__gt=0) | Q(total_revenue__gt=0))
+        .order_by(f"-total_{by}", "product_id")[:limit]
+    )
+
+
+def velocity(product, days):
+    """Units per day of ``product`` over the last ``days`` days and its cover."""
+    totals = (
+        window(days)
+        .filter(product=product)
+        .aggregate(total_units=Sum("units"), total_revenue=Sum("revenue"))
+    )
+    units = totals["total_units"] or 0
+    per_day = units / days
+    return {
+        "product": product.pk,
+        "days": days,
+        "units": units,
+        "revenue": totals["total_revenue"] or Decimal(0),
+        "units_per_day": round(per_day, 3),
+        "stock_quantity": product.stock_quantity,
+        "days_of_cover": (
+            round(product.stock_quantity / per_day, 1) if per_day > 0 else None
+        ),
+    }
+
+
+def lowest_cover(days, limit):
+    """
+    The ``limit`` products sold in the last ``days`` days whose stock lasts
+    the fewest days at that rate. Products without sales are left out.
+    """
+    rows = list(
+        window(days)
+        .values(
+            "product_id", "product__name", "product__sku", "product__stock_quantity"
+        )
+        .annotate(total_units=Sum("units"))
+        .filter(total_units__gt=0)
+        .annotate(
+            days_of_cover=ExpressionWrapper(
+                Cast("product__stock_quantity", FloatField()) * days / F("total_units"),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("days_of_cover", "product_id")[:limit]
+    )
+    for row in rows:
+        row["units_per_day"] = round(row["total_units"] / days, 3)
+        row["days_of_cover"] = round(row["days_of_cover"], 1)
+    return rows
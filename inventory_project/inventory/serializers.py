@@ -1,17 +1,225 @@
 from rest_framework import serializers
 from django.db.models import Sum, F, DecimalField
 from decimal import Decimal
+from django.db import transaction
 from .models import (
     User,
     Category,
     Supplier,
     Product,
+    ProductBarcode,
     Order,
     OrderItem,
+    OrderItemAllocation,
     InventoryHistory,
+    Warehouse,
+    StockLocation,
+    ReportJob,
+)
+from . import (
+    category_tree,
+    feed,
+    history_capture,
+    report_jobs,
+    sales,
+    stock,
+    throttling,
 )
 from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.reverse import reverse
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+
+def requested_fields(request):
+    """Parse ``?fields=a,b`` and ``?exclude=c`` into (fields or None, exclude)."""
+
+    def parse(param):
+        value = request.query_params.get(param)
+        if not value:
+            return None
+        return {name.strip() for name in value.split(",") if name.strip()}
+
+    return parse("fields"), parse("exclude") or set()
+
+
+class DynamicFieldsMixin:
+    """Drop fields not asked for with ``?fields=`` / ``?exclude=`` on reads."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        fields, exclude = requested_fields(request)
+        for name in list(self.fields):
+            if (fields is not None and name not in fields) or name in exclude:
+                self.fields.pop(name)
+
+
+class SerializerColumns:
+    """
+    The model columns a (possibly narrowed) ModelSerializer reads.
+
+    ``narrowable`` means the queryset can be cut down to ``only`` without
+    the serializer touching a deferred column. ``fast`` means every field can
+    also be rendered straight from a ``.values(*values)`` row with
+    ``represent``, skipping model instances and serializer field binding.
+    Serializers can supply ``values_representations`` for fields with no
+    column of their own: ``{name: (columns, function(row))}``.
+    """
+
+    def __init__(self, serializer):
+        model = serializer.Meta.model
+        overrides = getattr(serializer, "values_representations", {})
+        pk_name = model._meta.pk.name
+
+        self.only = {pk_name}
+        self.values = set()
+        self.select_related = set()
+        self.prefetch_related = set()
+        self.narrowable = True
+        self.fast = True
+        self.converters = []
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in overrides:
+                columns, function = overrides[name]
+                self.only.update(columns)
+                self.values.update(columns)
+                self.converters.append((name, function))
+            else:
+                self.add_field(model, name, field)
+
+    def add_field(self, model, name, field):
+        if field.source == "*":
+            self.narrowable = self.fast = False
+            return
+        path = field.source.split(".")
+        if isinstance(field, serializers.SlugRelatedField):
+            path.append(field.slug_field)
+        try:
+            model_field = model._meta.get_field(path[0])
+        except FieldDoesNotExist:
+            # A property or method: needs whole instances
+            self.narrowable = self.fast = False
+            return
+
+        if model_field.one_to_many or model_field.many_to_many:
+            # Reverse or m2m relation, e.g. an order's items
+            self.prefetch_related.add(path[0])
+            self.fast = False
+            return
+        if len(path) > 2 or (len(path) == 2 and not model_field.many_to_one):
+            self.narrowable = self.fast = False
+            return
+
+        column = "__".join(path)
+        if len(path) == 2:
+            self.select_related.add(path[0])
+        elif model_field.is_relation and not isinstance(
+            field, serializers.PrimaryKeyRelatedField
+        ):
+            # e.g. StringRelatedField renders the related instance
+            self.select_related.add(path[0])
+            self.narrowable = self.fast = False
+            return
+        self.only.add(column)
+        self.values.add(column)
+
+        if isinstance(field, serializers.RelatedField):
+            convert = None  # the column already holds the pk or slug
+        else:
+            convert = field.to_representation
+
+        def represent(row, column=column, convert=convert):
+            value = row[column]
+            if value is None or convert is None:
+                return value
+            return convert(value)
+
+        self.converters.append((name, represent))
+
+    def represent(self, rows):
+        converters = self.converters
+        return [{name: convert(row) for name, convert in converters} for row in rows]
+
+
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField that takes its object from ``prefetched`` when a
+    BulkRelatedListSerializer has already loaded the keys of the whole list.
+    """
+
+    prefetched = None
+
+    def lookup_key(self, data):
+        """``data`` as a primary key value, None if it is not a valid one."""
+        if isinstance(data, bool) or self.pk_field is not None:
+            return None
+        try:
+            return self.get_queryset().model._meta.pk.to_python(data)
+        except ValidationError:
+            return None
+
+    def to_internal_value(self, data):
+        key = self.lookup_key(data)
+        if self.prefetched is None or key is None:
+            return super().to_internal_value(data)
+        try:
+            return self.prefetched[key]
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+
+
+class BulkRelatedListSerializer(serializers.ListSerializer):
+    """
+    List serializer for nested many=True writes. The keys of each of the
+    child's PrefetchedPrimaryKeyRelatedFields are loaded with one
+    ``in_bulk`` query for the whole list, instead of one query per item,
+    and every missing key is reported in one error. The validated items
+    hold the loaded instances.
+    """
+
+    def related_fields(self):
+        return [
+            field
+            for field in self.child.fields.values()
+            if isinstance(field, PrefetchedPrimaryKeyRelatedField)
+            and not field.read_only
+        ]
+
+    def to_internal_value(self, data):
+        fields = self.related_fields()
+        if not fields or not isinstance(data, list):
+            return super().to_internal_value(data)
+        errors = {}
+        try:
+            for field in fields:
+                keys = {
+                    field.lookup_key(item.get(field.field_name))
+                    for item in data
+                    if isinstance(item, dict)
+                }
+                keys.discard(None)
+                field.prefetched = field.get_queryset().in_bulk(keys)
+                missing = sorted(keys - field.prefetched.keys())
+                if missing:
+                    model = field.get_queryset().model
+                    errors[field.field_name] = [
+                        f"{model._meta.verbose_name_plural.capitalize()} do not "
+                        f"exist: {missing}"
+                    ]
+            if errors:
+                raise serializers.ValidationError(errors)
+            return super().to_internal_value(data)
+        finally:
+            for field in fields:
+                field.prefetched = None
 
 
 # User serializer
@@ -35,11 +243,49 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issue tokens with the user's role, so throttling needs no user lookup."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[throttling.ROLE_CLAIM] = throttling.user_role(user)
+        return token
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = "__all__"
-        read_only_fields = ["created_at", "updated_at"]
+        read_only_fields = [
+            "path",
+            "product_count",
+            "total_stock",
+            "total_value",
+            "created_at",
+            "updated_at",
+        ]
+
+    def validate_parent(self, parent):
+        category = self.instance
+        if (
+            parent is not None
+            and category is not None
+            and parent.path.startswith(category.path)
+        ):
+            raise serializers.ValidationError(
+                "A category cannot be moved below itself."
+            )
+        path = category.path if category is not None else ""
+        if (
+            parent is not None
+            and category_tree.depth_after_move(path, parent.path)
+            > category_tree.MAX_DEPTH
+        ):
+            raise serializers.ValidationError(
+                f"Categories nest at most {category_tree.MAX_DEPTH} levels deep."
+            )
+        return parent
 
 
 class SupplierSerializer(serializers.ModelSerializer):
@@ -57,10 +303,133 @@ class SupplierSerializer(serializers.ModelSerializer):
         return value
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class WarehouseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Warehouse
+        fields = "__all__"
+
+
+class StockLocationSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    warehouse_code = serializers.CharField(source="warehouse.code", read_only=True)
+
+    class Meta:
+        model = StockLocation
+        fields = [
+            "id",
+            "product",
+            "product_name",
+            "warehouse",
+            "warehouse_code",
+            "quantity",
+            "updated_at",
+        ]
+
+
+class StockAdjustmentSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    warehouse = serializers.IntegerField()
+    quantity_changed = serializers.IntegerField()
+
+    def validate_quantity_changed(self, value):
+        if value == 0:
+            raise serializers.ValidationError("Quantity changed must not be zero.")
+        return value
+
+
+class CycleCountRowsField(serializers.Field):
+    """
+    Counted quantities as ``[[product, counted_quantity], ...]`` (or objects
+    with those keys), returned as ``{product: counted_quantity}``. Rows are
+    checked in one loop; a nested serializer per row is too slow for
+    uploads of tens of thousands of rows.
+    """
+
+    default_error_messages = {
+        "invalid": "Expected a non-empty list of counts.",
+        "max_length": "At most {max_length} counts per upload.",
+        "row": "Count {index} must be a product id and a quantity of at least 0.",
+        "duplicate": "Product {product} is counted more than once.",
+    }
+    max_length = 100_000
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            self.fail("invalid")
+        if len(data) > self.max_length:
+            self.fail("max_length", max_length=self.max_length)
+        counts = {}
+        for index, row in enumerate(data):
+            if isinstance(row, dict):
+                row = (row.get("product"), row.get("counted_quantity"))
+            try:
+                product, counted = row
+            except (TypeError, ValueError):
+                self.fail("row", index=index)
+            # bool is an int subclass; reject it like IntegerField does
+            if type(product) is not int or type(counted) is not int or counted < 0:
+                self.fail("row", index=index)
+            if product in counts:
+                self.fail("duplicate", product=product)
+            counts[product] = counted
+        return counts
+
+
+class CycleCountSerializer(serializers.Serializer):
+    counts = CycleCountRowsField()
+    apply = serializers.BooleanField(default=True)
+
+
+class SalesWindowSerializer(serializers.Serializer):
+    """Query parameters of the endpoints reading the sales rollups."""
+
+    days = serializers.IntegerField(min_value=1, default=30)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=10)
+    by = serializers.ChoiceField(choices=["units", "revenue"], default="units")
+
+    def validate_days(self, value):
+        # Older days have been compacted into months
+        if value > sales.retention_days():
+            raise serializers.ValidationError(
+                f"Ensure this value is less than or equal to {sales.retention_days()}."
+            )
+        return value
+
+
+class StockTransferLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    source = serializers.IntegerField()
+    destination = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+    def validate(self, data):
+        if data["source"] == data["destination"]:
+            raise serializers.ValidationError(
+                "Source and destination must be different warehouses."
+            )
+        return data
+
+
+class StockTransferSerializer(serializers.Serializer):
+    """
+    A group of moves applied together by inventory.stock.transfer. Ids stay
+    plain integers so validation runs no queries.
+    """
+
+    lines = StockTransferLineSerializer(many=True, allow_empty=False, max_length=1000)
+
+
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     category = serializers.SlugRelatedField(read_only=True, slug_field="name")
     is_below_threshold = serializers.SerializerMethodField()
 
+    values_representations = {
+        "is_below_threshold": (
+            ("stock_quantity", "threshold"),
+            lambda row: row["stock_quantity"] < row["threshold"],
+        ),
+    }
+
     class Meta:
         model = Product
         fields = "__all__"
@@ -70,11 +439,35 @@ class ProductSerializer(serializers.ModelSerializer):
         # Return whether the stock quantity is below the threshold
         return obj.is_below_threshold()
 
+    def validate_sku(self, value):
+        # Blank means no SKU; only real SKUs have to be unique
+        return value or None
+
+
+class ProductBarcodeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductBarcode
+        fields = ["id", "product", "code", "created_at"]
+        read_only_fields = ["created_at"]
+
+
+class ProductLookupSerializer(serializers.Serializer):
+    codes = serializers.ListField(
+        child=serializers.CharField(max_length=64),
+        allow_empty=False,
+        max_length=1000,
+    )
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
+    serializer_related_field = PrefetchedPrimaryKeyRelatedField
+
     class Meta:
         model = OrderItem
         fields = "__all__"
+        # Items are always written nested under their order
+        read_only_fields = ["order"]
+        list_serializer_class = BulkRelatedListSerializer
 
     def validate_quantity(self, value):
         if value <= 0:
@@ -82,7 +475,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return value
 
 
-class DetailedOrderSerializer(serializers.ModelSerializer):
+class DetailedOrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(
         many=True, read_only=True
     )  # Include related order items
@@ -105,20 +498,33 @@ class DetailedOrderSerializer(serializers.ModelSerializer):
 
 
 # oder serializer
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
 
     class Meta:
         model = Order
         fields = "__all__"
 
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items")
+        # Products were loaded during validation; allocate and insert the
+        # items together rather than through one OrderItem.save each
+        validated_data["total_amount"] = sum(
+            item["price_at_purchase"] * item["quantity"] for item in items_data
+        )
         order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            OrderItem.objects.create(order=order, **item_data)
+        items = [OrderItem(order=order, **item_data) for item_data in items_data]
+        try:
+            with history_capture.acting_user(order.user):
+                allocations = stock.allocate(items)
+        except stock.InsufficientStock as exc:
+            raise serializers.ValidationError({"items": [str(exc)]})
+        OrderItem.objects.bulk_create(items)
+        OrderItemAllocation.objects.bulk_create(allocations)
         return order
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         items_data = validated_data.pop("items", [])
         for attr, value in validated_data.items():
@@ -126,18 +532,178 @@ class OrderSerializer(serializers.ModelSerializer):
         instance.save()
 
         # Update or create order items
-        for item_data in items_data:
-            OrderItem.objects.update_or_create(
-                order=instance,
-                product=item_data["product"],
-                defaults={
-                    "quantity": item_data["quantity"],
-                    "price_at_purchase": item_data["price_at_purchase"],
-                },
-            )
+        with sales.items_changing(instance):
+            for item_data in items_data:
+                OrderItem.objects.update_or_create(
+                    order=instance,
+                    product=item_data["product"],
+                    defaults={
+                        "quantity": item_data["quantity"],
+                        "price_at_purchase": item_data["price_at_purchase"],
+                    },
+                )
         return instance
 
 
+class BulkOrderItemSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    price_at_purchase = serializers.DecimalField(
+        max_digits=10, decimal_places=2, min_value=Decimal("0")
+    )
+
+
+class BulkOrderSerializer(serializers.Serializer):
+    """
+    One order of a batch import. Foreign keys stay plain ids here so that
+    validating a batch runs no queries; create_many resolves them in bulk.
+
+    Orders are placed for the caller, who may leave ``user`` out; staff may
+    import orders of other users.
+    """
+
+    order_type = serializers.ChoiceField(choices=Order.OrderTypeChoices.choices)
+    status = serializers.ChoiceField(
+        choices=Order.StatusChoices.choices, default=Order.StatusChoices.PENDING
+    )
+    user = serializers.IntegerField(required=False)
+    items = BulkOrderItemSerializer(many=True, allow_empty=False)
+
+    def validate(self, data):
+        caller = self.context["request"].user
+        order_user_model = Order._meta.get_field("user").related_model
+        caller_id = caller.pk if isinstance(caller, order_user_model) else None
+        if "user" not in data:
+            if caller_id is None:
+                raise serializers.ValidationError(
+                    {"user": ["This field is required."]}
+                )
+            data["user"] = caller_id
+        elif data["user"] != caller_id and not caller.is_staff:
+            raise serializers.ValidationError(
+                {"user": ["Orders can only be placed for yourself."]}
+            )
+        return data
+
+    @staticmethod
+    def create_many(validated_orders):
+        """
+        Allocate stock and insert a batch of validated orders.
+
+        ``validated_orders`` is a list of ``(index, validated_data)``. Products
+        are fetched (and locked) once, orders are allocated in submission
+        order with the same rule as OrderItem.save, and an order that cannot
+        be filled is rejected on its own without touching the others. Items
+        are picked from warehouses as in inventory.stock.allocate.
+        Returns ``(index, result)`` pairs.
+        """
+        product_ids = sorted(
+            {item["product"] for _, data in validated_orders for item in data["items"]}
+        )
+        user_ids = {data["user"] for _, data in validated_orders}
+
+        results = []
+        # A large batch can take longer than the feeds' settle time
+        with feed.hold(), transaction.atomic():
+            # Lock in pk order so concurrent batches cannot deadlock
+            products = {
+                product.pk: product
+                for product in Product.objects.select_for_update()
+                .filter(pk__in=product_ids)
+                .order_by("pk")
+            }
+            # Order.user points at inventory.User, not the auth.User imported above
+            order_user_model = Order._meta.get_field("user").related_model
+            users = order_user_model.objects.in_bulk(user_ids)
+            available = {pk: product.stock_quantity for pk, product in products.items()}
+
+            accepted = []
+            for index, data in validated_orders:
+                errors = BulkOrderSerializer.allocation_errors(
+                    data, products, users, available
+                )
+                if errors:
+                    results.append(
+                        (index, {"index": index, "status": "failed", "errors": errors})
+                    )
+                    continue
+                for item in data["items"]:
+                    available[item["product"]] -= item["quantity"]
+                accepted.append((index, data))
+
+            orders = Order.objects.bulk_create(
+                [
+                    Order(
+                        order_type=data["order_type"],
+                        status=data["status"],
+                        user=users[data["user"]],
+                        total_amount=sum(
+                            item["price_at_purchase"] * item["quantity"]
+                            for item in data["items"]
+                        ),
+                    )
+                    for _, data in accepted
+                ]
+            )
+            items = OrderItem.objects.bulk_create(
+                [
+                    OrderItem(
+                        order=order,
+                        product=products[item["product"]],
+                        quantity=item["quantity"],
+                        price_at_purchase=item["price_at_purchase"],
+                    )
+                    for order, (_, data) in zip(orders, accepted)
+                    for item in data["items"]
+                ]
+            )
+            allocations, locations = stock.pick_locations(items)
+            OrderItemAllocation.objects.bulk_create(allocations)
+            stock.save_locations(locations)
+
+            changed = [
+                product
+                for pk, product in products.items()
+                if available[pk] != product.stock_quantity
+            ]
+            for product in changed:
+                product.stock_quantity = available[product.pk]
+            stock.save_totals(changed)
+            # bulk_create sends no post_save, so count completed sales here
+            sales.sync_orders([order.pk for order in orders if sales.counts(order)])
+
+        results.extend(
+            (index, {"index": index, "status": "created", "id": order.pk})
+            for order, (index, _) in zip(orders, accepted)
+        )
+        return results
+
+    @staticmethod
+    def allocation_errors(data, products, users, available):
+        errors = {}
+        if data["user"] not in users:
+            errors["user"] = [f"Invalid pk \"{data['user']}\" - object does not exist."]
+
+        requested = {}
+        for item in data["items"]:
+            requested[item["product"]] = (
+                requested.get(item["product"], 0) + item["quantity"]
+            )
+        missing = sorted(pk for pk in requested if pk not in products)
+        short = sorted(
+            pk
+            for pk, quantity in requested.items()
+            if pk in products and quantity > available[pk]
+        )
+        if missing:
+            errors["items"] = [f"Products do not exist: {missing}"]
+        if short:
+            errors.setdefault("items", []).append(
+                f"Insufficient stock for products: {short}"
+            )
+        return errors
+
+
 # inventory History Serializer
 class InventoryHistorySerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source="product.name", read_only=True)
@@ -201,3 +767,56 @@ class InventoryReportSerializer(serializers.ModelSerializer):
             }
             for record in history
         ]
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    kind = serializers.ChoiceField(choices=sorted(report_jobs.REPORTS))
+    start_date = serializers.DateField(required=False, allow_null=True, write_only=True)
+    end_date = serializers.DateField(required=False, allow_null=True, write_only=True)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            "id",
+            "kind",
+            "params",
+            "start_date",
+            "end_date",
+            "status",
+            "error",
+            "result_size",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "expires_at",
+            "download_url",
+        ]
+        read_only_fields = [
+            "params",
+            "status",
+            "error",
+            "result_size",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "expires_at",
+        ]
+
+    def validate(self, attrs):
+        # Parameters are stored in one canonical form, so that identical
+        # requests hash the same
+        kind = attrs["kind"]
+        params = {}
+        if kind not in report_jobs.UNDATED:
+            for name in ("start_date", "end_date"):
+                value = attrs.get(name)
+                params[name] = value.isoformat() if value else None
+        return {"kind": kind, "params": params}
+
+    def get_download_url(self, job):
+        if job.status != ReportJob.StatusChoices.DONE:
+            return None
+        return reverse(
+            "report-job-download", args=[job.pk], request=self.context.get("request")
+        )
@@ -1,7 +1,20 @@
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (
+    pre_save,
+    post_save,
+    pre_delete,
+    post_delete,
+    post_migrate,
+)
 from django.dispatch import receiver
 from django.core.mail import send_mail
-from .models import Product
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import Category, Supplier, Product, Order, InventoryHistory
+from . import category_tree, events, feed, history_capture, middleware, sales
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Product)
@@ -13,4 +26,116 @@ def notify_low_stock(sender, instance, **kwargs):
             from_email="your_email@example.com",
             recipient_list=["admin@example.com"],  # Replace with recipients
         )
-     
\ No newline at end of file
+
+
+@receiver(pre_save, sender=Product)
+def load_category_state(sender, instance, **kwargs):
+    # Products saved without having been loaded (or loaded with deferred
+    # fields) need their stored values to update the category totals
+    if instance.pk is None or hasattr(instance, "_category_state"):
+        return
+    instance._category_state = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list("category_id", "stock_quantity", "price")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_category_totals(sender, instance, **kwargs):
+    category_tree.record_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_category_totals(sender, instance, **kwargs):
+    category_tree.remove_product(instance)
+
+
+@receiver(pre_delete, sender=Category)
+def remove_category_totals(sender, instance, **kwargs):
+    category_tree.remove(instance)
+
+
+@receiver(post_save, sender=Order)
+def sync_sales_rollups(sender, instance, **kwargs):
+    # After commit, so that the items of a new order are there too
+    pk = instance.pk
+    transaction.on_commit(lambda: sales.sync_orders([pk]))
+
+
+@receiver(pre_delete, sender=Order)
+def remove_sales_rollups(sender, instance, **kwargs):
+    sales.remove_order(instance)
+
+
+@receiver(post_save, sender=InventoryHistory)
+def publish_history_event(sender, instance, created, **kwargs):
+    if not created:
+        return
+    event = events.history_event(instance)
+
+    def publish():
+        try:
+            events.publish(event)
+        except Exception as e:
+            logger.error(f"Failed to publish inventory history event: {e}")
+
+    # Only committed rows reach the stream
+    transaction.on_commit(publish)
+
+
+@receiver(pre_delete, sender=Category)
+def touch_category_products(sender, instance, **kwargs):
+    # The products lose their category through a plain UPDATE; move them in
+    # the change feed too
+    instance.products.update(updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=Category)
+def load_category_name(sender, instance, **kwargs):
+    if instance.pk is None or hasattr(instance, "_stored_name"):
+        return
+    instance._stored_name = (
+        Category.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Category)
+def touch_renamed_category_products(sender, instance, created, **kwargs):
+    # Products carry their category's name in the API and the catalogue
+    # snapshot; move them in the change feed and the snapshot refresh
+    stored = getattr(instance, "_stored_name", None)
+    if not created and stored is not None and stored != instance.name:
+        instance.products.update(updated_at=timezone.now())
+    instance._stored_name = instance.name
+
+
+@receiver(pre_delete, sender=Product)
+def touch_product_orders(sender, instance, **kwargs):
+    # Cascading deletes remove the product's items from these orders
+    Order.objects.filter(items__product=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Supplier)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def record_tombstone(sender, instance, **kwargs):
+    feed.record_tombstone(instance)
+
+
+@receiver(connection_created)
+def register_history_functions(sender, connection, **kwargs):
+    history_capture.register_functions(connection)
+
+
+@receiver(connection_created)
+def install_query_observers(sender, connection, **kwargs):
+    # Request metrics and profiles see queries from any thread through it
+    middleware.install_query_observers(connection)
+
+
+@receiver(post_migrate)
+def sync_history_triggers(sender, app_config=None, using="default", **kwargs):
+    if app_config is not None and app_config.label == "inventory":
+        history_capture.sync_triggers(connections[using])
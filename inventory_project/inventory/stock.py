@@ -0,0 +1,260 @@
+"""
+Per-warehouse stock.
+
+Product.stock_quantity is the total of a product's StockLocation rows and is
+maintained incrementally: every change below writes the locations and the
+product total in the same transaction, so reads never sum locations.
+
+Every change locks the affected Product rows first, in pk order. That
+serialises concurrent changes to a product's locations without locking the
+location rows themselves, and cannot deadlock. Location quantities are then
+written back with one grouped UPDATE (bulk_update) per batch.
+
+Stock not held at any location (products edited outside the API) still
+counts towards the total; fulfilment uses it last and records no allocation
+for it.
+"""
+
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from . import category_tree, history_capture
+from .models import (
+    Product,
+    Warehouse,
+    StockLocation,
+    OrderItemAllocation,
+    InventoryHistory,
+)
+
+
+class InsufficientStock(ValueError):
+    pass
+
+
+def default_warehouse():
+    """Warehouse that direct edits of Product.stock_quantity apply to."""
+    warehouse, _ = Warehouse.objects.get_or_create(
+        code=getattr(settings, "DEFAULT_WAREHOUSE_CODE", "MAIN"),
+        defaults={"name": "Main warehouse", "priority": 0},
+    )
+    return warehouse
+
+
+def lock_products(product_ids):
+    return {
+        product.pk: product
+        for product in Product.objects.select_for_update()
+        .filter(pk__in=sorted(set(product_ids)))
+        .order_by("pk")
+    }
+
+
+def available_locations(product_ids):
+    """
+    Locations with stock at active warehouses, grouped by product in pick
+    order: warehouse priority, then the fullest location.
+    """
+    locations = {}
+    queryset = (
+        StockLocation.objects.filter(
+            product_id__in=product_ids, quantity__gt=0, warehouse__is_active=True
+        )
+        .select_related("warehouse")
+        .order_by("product_id", "warehouse__priority", "-quantity")
+    )
+    for location in queryset:
+        locations.setdefault(location.product_id, []).append(location)
+    return locations
+
+
+def plan_picks(locations, quantity):
+    """
+    Pick ``quantity`` from ``locations`` (in pick order): the first location
+    that can supply all of it, otherwise each location in turn until the
+    quantity is covered or the locations run out. The picked amounts are
+    taken off ``location.quantity`` so later lines of a batch see what is
+    left. Returns ``[(location, quantity)]``.
+    """
+    for location in locations:
+        if location.quantity >= quantity:
+            location.quantity -= quantity
+            return [(location, quantity)]
+    picks = []
+    for location in locations:
+        take = min(location.quantity, quantity)
+        if take:
+            location.quantity -= take
+            quantity -= take
+            picks.append((location, take))
+        if not quantity:
+            break
+    return picks
+
+
+def pick_locations(items):
+    """
+    Choose warehouses for order items (anything with ``product_id`` and
+    ``quantity``). The product rows must already be locked. Returns the
+    unsaved OrderItemAllocation rows and the locations to write back with
+    save_locations().
+    """
+    locations = available_locations({item.product_id for item in items})
+    allocations, changed = [], {}
+    for item in items:
+        for location, quantity in plan_picks(
+            locations.get(item.product_id, []), item.quantity
+        ):
+            allocations.append(
+                OrderItemAllocation(
+                    order_item=item, warehouse=location.warehouse, quantity=quantity
+                )
+            )
+            changed[location.pk] = location
+    return allocations, list(changed.values())
+
+
+def save_locations(locations):
+    now = timezone.now()
+    for location in locations:
+        location.updated_at = now
+    StockLocation.objects.bulk_update(
+        locations, ["quantity", "updated_at"], batch_size=500
+    )
+
+
+def save_totals(products):
+    now = timezone.now()
+    for product in products:
+        product.updated_at = now
+    Product.objects.bulk_update(
+        products, ["stock_quantity", "updated_at"], batch_size=500
+    )
+    category_tree.record_products(products)
+
+
+def allocate(items):
+    """
+    Take the stock for unsaved order items: check the product totals, pick
+    warehouses and write locations and totals. Returns the allocations to
+    create once the items are saved. Raises InsufficientStock.
+    """
+    requested = Counter()
+    for item in items:
+        requested[item.product_id] += item.quantity
+    with transaction.atomic():
+        products = lock_products(requested)
+        for product_id, quantity in requested.items():
+            if quantity > products[product_id].stock_quantity:
+                raise InsufficientStock("Insufficient stock for this product.")
+            products[product_id].stock_quantity -= quantity
+        allocations, changed = pick_locations(items)
+        save_locations(changed)
+        save_totals(list(products.values()))
+    return allocations
+
+
+def adjust(product_id, warehouse_id, delta, user=None):
+    """
+    Add (or with a negative ``delta`` remove) stock at one location, update
+    the product total and log it to InventoryHistory (attributed to
+    ``user``, an inventory User).
+    """
+    with history_capture.acting_user(user):
+        product = lock_products([product_id]).get(product_id)
+        if product is None:
+            raise Product.DoesNotExist(f"Product {product_id} does not exist.")
+        if not Warehouse.objects.filter(pk=warehouse_id).exists():
+            raise Warehouse.DoesNotExist(f"Warehouse {warehouse_id} does not exist.")
+        location, _ = StockLocation.objects.get_or_create(
+            product=product, warehouse_id=warehouse_id
+        )
+        if location.quantity + delta < 0:
+            raise InsufficientStock(
+                f"Only {location.quantity} of product {product_id} at warehouse "
+                f"{warehouse_id}."
+            )
+        location.quantity += delta
+        location.save(update_fields=["quantity", "updated_at"])
+        product.stock_quantity += delta
+        save_totals([product])
+        if not history_capture.enabled():
+            InventoryHistory.objects.create(
+                product=product,
+                user=user,
+                action="add" if delta > 0 else "remove",
+                quantity_changed=delta,
+            )
+    return location
+
+
+def apply_to_default_warehouse(product, delta):
+    """
+    Mirror a direct change of ``product.stock_quantity`` on the default
+    warehouse's location. The caller holds the product lock.
+    """
+    if not delta:
+        return
+    location, _ = StockLocation.objects.get_or_create(
+        product=product, warehouse=default_warehouse()
+    )
+    if location.quantity + delta < 0:
+        raise InsufficientStock(
+            f"The default warehouse only holds {location.quantity}; adjust stock "
+            "per warehouse with /api/stock-locations/adjust/ instead."
+        )
+    location.quantity += delta
+    location.save(update_fields=["quantity", "updated_at"])
+
+
+def transfer(lines):
+    """
+    Move stock between warehouses. ``lines`` are ``(product_id, source_id,
+    destination_id, quantity)``; either every line is applied or none is.
+    Product totals do not change.
+    """
+    lines = list(lines)
+    product_ids = {line[0] for line in lines}
+    warehouse_ids = {line[1] for line in lines} | {line[2] for line in lines}
+    with transaction.atomic():
+        products = lock_products(product_ids)
+        missing = sorted(product_ids - set(products))
+        if missing:
+            raise Product.DoesNotExist(f"Products do not exist: {missing}")
+        found = set(
+            Warehouse.objects.filter(pk__in=warehouse_ids).values_list("pk", flat=True)
+        )
+        if warehouse_ids - found:
+            raise Warehouse.DoesNotExist(
+                f"Warehouses do not exist: {sorted(warehouse_ids - found)}"
+            )
+
+        StockLocation.objects.bulk_create(
+            [
+                StockLocation(product_id=product_id, warehouse_id=destination_id)
+                for product_id, _, destination_id, _ in lines
+            ],
+            ignore_conflicts=True,
+        )
+        locations = {
+            (location.product_id, location.warehouse_id): location
+            for location in StockLocation.objects.filter(
+                product_id__in=product_ids, warehouse_id__in=warehouse_ids
+            )
+        }
+        changed = {}
+        for product_id, source_id, destination_id, quantity in lines:
+            source = locations.get((product_id, source_id))
+            if source is None or source.quantity < quantity:
+                raise InsufficientStock(
+                    f"Only {source.quantity if source else 0} of product "
+                    f"{product_id} at warehouse {source_id}."
+                )
+            destination = locations[(product_id, destination_id)]
+            source.quantity -= quantity
+            destination.quantity += quantity
+            changed[source.pk] = source
+            changed[destination.pk] = destination
+        save_locations(list(changed.values()))
+    return list(changed.values())
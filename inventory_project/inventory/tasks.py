@@ -0,0 +1,9 @@
+"""Celery tasks, run by ``celery -A inventory_project worker``."""
+
+from inventory_project.celery import app
+from . import report_jobs
+
+
+@app.task(ignore_result=True)
+def run_report_job(job_id):
+    report_jobs.run(job_id)
@@ -0,0 +1,192 @@
+"""
+Per-role API throttling with token buckets.
+
+Every caller gets a bucket per scope that holds up to ``N`` requests and
+refills at ``N`` per period, from REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]:
+``"<role>"`` for ordinary requests and ``"<scope>.<role>"`` for views or
+actions with a ``throttle_scope`` (low_stock, reports, bulk orders, signup).
+Roles are ``anon``, ``staff`` and ``admin``; a scope or role without a rate
+is not throttled.
+
+A bucket is stored as a single number, the time at which it will be full
+again, so taking a token is one atomic update of one key:
+
+* on the Redis cache backend it is one EVALSHA of a Lua script, atomic
+  across every worker, using the Redis server's clock;
+* on other backends it is an ``add`` of a new bucket or an ``incr`` of the
+  time in microseconds, atomic wherever the backend's incr is (memcached,
+  and the local-memory cache within its process). The key expires about
+  when the bucket is full again; until it does, at most a second, a full
+  bucket refills from the stored time rather than from now.
+
+The caller's role comes from the ``role`` claim that RoleTokenObtainPairSerializer
+adds to issued tokens (or from the already-authenticated user), so a check
+never queries the database.
+"""
+
+import math
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+from .models import RoleChoices, User
+
+ROLE_CLAIM = "role"
+ANON_ROLE = "anon"
+
+DURATIONS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+# KEYS[1] holds the time the bucket is full again; ARGV is the refill
+# interval per token and the capacity. Returns the seconds to wait, "0" if
+# a token was taken.
+TAKE_TOKEN_SCRIPT = """
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local interval = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local full_at = math.max(tonumber(redis.call("GET", KEYS[1]) or "0"), now)
+local wait = full_at + interval - now - capacity * interval
+if wait > 0 then
+    return tostring(wait)
+end
+full_at = full_at + interval
+redis.call("SET", KEYS[1], tostring(full_at), "PX", math.ceil((full_at - now) * 1000))
+return "0"
+"""
+
+
+def parse_rate(rate):
+    """``"100/min"`` -> ``(100, 60)``; None for no limit."""
+    if rate is None:
+        return None
+    count, period = rate.split("/")
+    return int(count), DURATIONS[period[0]]
+
+
+def user_role(user):
+    """
+    Role for a user at login: its own ``role``, else the role of the
+    inventory User with the same username, else admin for superusers.
+    """
+    role = getattr(user, "role", None)
+    if role is None:
+        role = (
+            User.objects.filter(username=user.get_username())
+            .values_list("role", flat=True)
+            .first()
+        )
+    if role is None:
+        role = RoleChoices.ADMIN if user.is_superuser else RoleChoices.STAFF
+    return str(role)
+
+
+def request_role(user, token=None):
+    """Role of an authenticated request, from the token claim or the user."""
+    if user is None or not user.is_authenticated:
+        return ANON_ROLE
+    if token is not None and ROLE_CLAIM in token:
+        return token[ROLE_CLAIM]
+    role = getattr(user, "role", None)
+    if role is None:
+        role = RoleChoices.ADMIN if user.is_superuser else RoleChoices.STAFF
+    return str(role)
+
+
+class TokenBucket:
+    """Take tokens from buckets kept in the ``alias`` cache."""
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+        self._script = None
+
+    def take(self, key, count, duration):
+        """
+        Take one token from a bucket of ``count`` tokens refilled over
+        ``duration`` seconds. Returns 0 or the seconds until one is free.
+        """
+        interval = duration / count
+        if isinstance(self.cache, RedisCache):
+            return self._take_redis(key, interval, count)
+        return self._take_incr(key, interval, count)
+
+    def _take_incr(self, key, interval, count):
+        # Times in whole microseconds, as incr only adds integers
+        interval = math.ceil(interval * 1_000_000)
+        now = int(time.time() * 1_000_000)
+        while True:
+            if self.cache.add(key, now + interval, self._expiry(now + interval, now)):
+                return 0
+            try:
+                full_at = self.cache.incr(key, interval)
+                break
+            except ValueError:
+                # Expired between add() and incr()
+                continue
+        wait = full_at - now - count * interval
+        if wait > 0:
+            try:
+                # Give the token back
+                self.cache.decr(key, interval)
+            except ValueError:
+                pass
+            return wait / 1_000_000
+        self.cache.touch(key, self._expiry(full_at, now))
+        return 0
+
+    @staticmethod
+    def _expiry(full_at, now):
+        return math.ceil((full_at - now) / 1_000_000)
+
+    def _take_redis(self, key, interval, count):
+        key = self.cache.make_and_validate_key(key)
+        client = self.cache._cache.get_client(key, write=True)
+        if self._script is None:
+            self._script = client.register_script(TAKE_TOKEN_SCRIPT)
+        return float(self._script(keys=[key], args=[interval, count], client=client))
+
+
+_buckets = {}
+
+
+def get_bucket():
+    alias = getattr(settings, "THROTTLE_CACHE", "default")
+    if alias not in _buckets:
+        _buckets[alias] = TokenBucket(alias)
+    return _buckets[alias]
+
+
+def throttle_wait(scope, role, ident):
+    """
+    Take a token for ``ident`` from the ``scope`` bucket of its role.
+    Returns None if the request may go ahead, else the seconds to wait.
+    """
+    if not getattr(settings, "THROTTLE_ENABLED", True):
+        return None
+    name = f"{scope}.{role}" if scope else role
+    rate = parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(name))
+    if rate is None:
+        return None
+    wait = get_bucket().take(f"throttle:{name}:{ident}", *rate)
+    return wait or None
+
+
+class RoleThrottle(BaseThrottle):
+    """
+    Token-bucket throttle keyed by role and caller.
+
+    Views pick a separate bucket with ``throttle_scope`` (or per action with
+    ``@action(..., throttle_scope=...)``). Authenticated callers are keyed by
+    user id, anonymous ones by client address.
+    """
+
+    def allow_request(self, request, view):
+        user = request.user
+        role = request_role(user, request.auth)
+        ident = user.pk if role != ANON_ROLE else self.get_ident(request)
+        self._wait = throttle_wait(getattr(view, "throttle_scope", None), role, ident)
+        return self._wait is None
+
+    def wait(self):
+        return self._wait
@@ -1,47 +1,241 @@
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import mixins, viewsets
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import APIView
 from rest_framework import response
+from rest_framework.response import Response
+from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction
 from django.db.models import Sum, F, Q, DecimalField, ExpressionWrapper, BooleanField
+from django.db.models import ProtectedError
 from .models import Category, Supplier, Product, Order, OrderItem, User, UserToken
+from .models import Warehouse, StockLocation, ProductBarcode, ReportJob
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import (
+    IsAuthenticated,
+    IsAdminUser,
+    AllowAny,
+    SAFE_METHODS,
+)
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.views import TokenVerifyView
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
 from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from django.utils.cache import patch_vary_headers
 from django.utils.dateparse import parse_date
-from django.http import HttpResponse
+from django.utils.http import content_disposition_header
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views import View
 import csv
 from datetime import datetime
 from .models import InventoryHistory
+from .reports import build_inventory_report, parse_report_dates
+from .filters import ProductFilter
+from .renderers import FastJSONRenderer, FastJSONParser
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.parsers import FormParser, MultiPartParser
+from . import (
+    catalogue,
+    category_tree,
+    codes,
+    cycle_counts,
+    events,
+    feed,
+    history_capture,
+    profiling,
+    report_jobs,
+    routers,
+    sales,
+    stock,
+)
+from .middleware import time_serializer
 from .serializers import (
     CategorySerializer,
     SupplierSerializer,
     ProductSerializer,
+    ProductBarcodeSerializer,
+    ProductLookupSerializer,
     OrderSerializer,
+    BulkOrderSerializer,
     DetailedOrderSerializer,
     InventoryHistorySerializer,
     InventoryReportSerializer,
     UserSerializer,
+    RoleTokenObtainPairSerializer,
+    SerializerColumns,
+    WarehouseSerializer,
+    StockLocationSerializer,
+    StockAdjustmentSerializer,
+    StockTransferSerializer,
+    ReportJobSerializer,
+    CycleCountSerializer,
+    SalesWindowSerializer,
 )
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def history_user(request):
+    # InventoryHistory.user points at inventory.User; JWT logins resolve to
+    # django.contrib.auth's User, which cannot be stored there
+    return request.user if isinstance(request.user, User) else None
+
+
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 100
 
 
-class UserViewSet(ModelViewSet):
+class SerializerTimingMixin:
+    """
+    Report the time spent building serializer data to RequestMetricsMiddleware
+    (the ``inventory_request_serializer_duration_seconds`` histogram).
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        return time_serializer(super().get_serializer(*args, **kwargs))
+
+
+class ReplicaReadMixin:
+    """
+    Serve safe-method actions from the read replica (see inventory.routers).
+
+    ``read_database`` picks the alias per view; set it to None to keep a view
+    on the primary, or override it for one action with
+    ``@action(..., read_database=None)``. Users who wrote recently are kept
+    on the primary, and a successful write pins them there. POST actions
+    that only read (their input does not fit in a URL) are marked with
+    ``@action(..., reads_only=True)``.
+    """
+
+    read_database = routers.REPLICA_DB_ALIAS
+    reads_only = False
+
+    def is_read_request(self, request):
+        return request.method in SAFE_METHODS or self.reads_only
+
+    def get_read_database(self, request):
+        if not self.is_read_request(request) or routers.is_pinned(request.user):
+            return None
+        return self.read_database
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication runs in super().initial(), the pin check needs the user
+        super().initial(request, *args, **kwargs)
+        self._read_database_token = routers.use_read_database(
+            self.get_read_database(request)
+        )
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_read_database_token", None)
+        if token is not None:
+            routers.reset_read_database(token)
+            self._read_database_token = None
+        if not self.is_read_request(request) and response.status_code < 400:
+            routers.pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class SparseFieldsMixin:
+    """
+    Read actions only load the columns the response needs.
+
+    The serializer (see DynamicFieldsMixin) decides which fields are
+    rendered; retrieve and non-simple lists use ``.only()`` on those columns,
+    and lists whose fields map straight to columns are rendered from a
+    ``.values()`` projection without building model instances.
+    """
+
+    def get_serializer_columns(self):
+        if not hasattr(self, "_serializer_columns"):
+            self._serializer_columns = SerializerColumns(self.get_serializer())
+        return self._serializer_columns
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        columns = self.get_serializer_columns()
+        if columns.select_related:
+            queryset = queryset.select_related(*columns.select_related)
+        if columns.prefetch_related:
+            queryset = queryset.prefetch_related(*columns.prefetch_related)
+        if columns.narrowable:
+            queryset = queryset.only(*sorted(columns.only))
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        columns = self.get_serializer_columns()
+        if not columns.fast:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            *sorted(columns.values)
+        )
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(columns.represent(page))
+        return Response(columns.represent(queryset))
+
+
+class ChangeFeedMixin:
+    """
+    ``changes`` action for downstream sync (see inventory.feed): rows changed
+    since the ``since`` cursor, oldest first, and tombstones of rows deleted
+    since then. Clients keep calling with the returned ``next`` cursor while
+    ``has_more`` is true, then store it for the next sync.
+    """
+
+    change_feed_field = "updated_at"
+    change_feed_permission_classes = None
+    change_feed_page_size = 500
+    change_feed_max_page_size = 5000
+
+    def get_permissions(self):
+        if self.action == "changes" and self.change_feed_permission_classes:
+            return [permission() for permission in self.change_feed_permission_classes]
+        return super().get_permissions()
+
+    def get_change_queryset(self):
+        return self.get_queryset()
+
+    @action(detail=False, methods=["get"])
+    def changes(self, request):
+        try:
+            limit = int(request.query_params.get("limit", self.change_feed_page_size))
+        except ValueError:
+            raise ValidationError({"limit": "Must be an integer."})
+        limit = min(max(limit, 1), self.change_feed_max_page_size)
+        try:
+            rows, tombstones, cursor, has_more = feed.changes(
+                self.get_change_queryset(),
+                self.change_feed_field,
+                request.query_params.get("since"),
+                limit,
+            )
+        except feed.InvalidCursor as exc:
+            raise ValidationError({"since": str(exc)})
+        return Response(
+            {
+                "results": self.get_serializer(rows, many=True).data,
+                "deleted": [
+                    {"id": tombstone.object_id, "deleted_at": tombstone.deleted_at}
+                    for tombstone in tombstones
+                ],
+                "next": cursor,
+                "has_more": has_more,
+            }
+        )
+
+
+class UserViewSet(SerializerTimingMixin, ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
@@ -50,6 +244,11 @@ class UserViewSet(ModelViewSet):
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    @property
+    def throttle_scope(self):
+        # Sign-up is open to anyone, give it its own small bucket
+        return "signup" if self.action == "create" else None
+
 
 # log-in views functionality
 class LoginView(APIView):
@@ -63,10 +262,10 @@ class LoginView(APIView):
                 {"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
-        print(f"Authenticated User: {user}")  # Debug statement
+        logger.debug(f"Authenticated user: {user}")
 
         # Generate tokens
-        refresh = RefreshToken.for_user(user)
+        refresh = RoleTokenObtainPairSerializer.get_token(user)
         access_token = str(refresh.access_token)
 
         # Save the token in the database
@@ -98,29 +297,85 @@ class LogoutView(APIView):
             )
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(
+    ChangeFeedMixin, ReplicaReadMixin, SerializerTimingMixin, viewsets.ModelViewSet
+):
     # permission_classes = [IsAuthenticated]
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    @action(detail=True, methods=["get"])
+    def subtree(self, request, pk=None):
+        """The category and all its descendants, in tree order."""
+        category = self.get_object()
+        categories = self.get_queryset().filter(category_tree.subtree(category.path))
+        return Response(
+            self.get_serializer(categories.order_by("path"), many=True).data
+        )
+
+    def perform_destroy(self, instance):
+        try:
+            instance.delete()
+        except ProtectedError:
+            raise ValidationError(
+                {"detail": ["Move or delete the subcategories of this category first."]}
+            )
+
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(
+    ChangeFeedMixin, ReplicaReadMixin, SerializerTimingMixin, viewsets.ModelViewSet
+):
     # permission_classes = [IsAuthenticated]
     queryset = Supplier.objects.all()
     serializer_class = SupplierSerializer
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(
+    ChangeFeedMixin,
+    ReplicaReadMixin,
+    SparseFieldsMixin,
+    SerializerTimingMixin,
+    viewsets.ModelViewSet,
+):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser]
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     pagination_class = StandardResultsSetPagination
+    throttle_scope = None  # low_stock has its own
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     search_fields = ["name", "description"]  # Full-text search
-    filterset_fields = ["category", "price"]  # Filters by exact match
+    filterset_class = ProductFilter  # category, price, category_tree
     ordering_fields = ["name", "price", "stock_quantity"]  # Ordering
 
-    @action(detail=False, methods=["get"])
+    def retrieve(self, request, *args, **kwargs):
+        row = self.get_catalogue_row()
+        if row is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_serializer_columns().represent([row])[0])
+
+    def get_catalogue_row(self):
+        """
+        The product from the catalogue snapshot (inventory.catalogue) if one
+        is fresh, the response fits its columns and the caller may read
+        slightly stale data (not pinned to the primary, no filters).
+        """
+        snapshot = catalogue.snapshot()
+        if snapshot is None or self.get_read_database(self.request) is None:
+            return None
+        if set(self.request.query_params) - {"fields", "exclude"}:
+            return None
+        columns = self.get_serializer_columns()
+        if not columns.fast or not columns.values <= set(catalogue.COLUMNS):
+            return None
+        try:
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            return None
+        return snapshot.get(pk)
+
+    @action(detail=False, methods=["get"], throttle_scope="expensive")
     def low_stock(self, request):
         """
         Retrieves products with stock below their threshold and sends email notifications.
@@ -145,6 +400,98 @@ class ProductViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get", "post"], reads_only=True)
+    def lookup(self, request):
+        """
+        Stock for up to 1,000 SKUs or barcodes: ``?codes=a,b`` or a POST of
+        ``{"codes": [...]}``. Unknown codes are listed under ``missing``.
+        """
+        if request.method == "GET":
+            param = request.query_params.get("codes", "")
+            data = {"codes": [code for code in param.split(",") if code]}
+        else:
+            data = request.data
+        serializer = ProductLookupSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        results, missing = codes.lookup(serializer.validated_data["codes"])
+        return Response({"results": results, "missing": missing})
+
+    @action(
+        detail=False, methods=["post"], url_path="cycle-count", throttle_scope="bulk"
+    )
+    def cycle_count(self, request):
+        """
+        Reconcile physical counts with the stock totals:
+        ``{"counts": [[product, counted_quantity], ...]}``. Returns the
+        variance report; with ``"apply": false`` nothing is changed.
+        """
+        serializer = CycleCountSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            report = cycle_counts.reconcile(
+                serializer.validated_data["counts"],
+                user=history_user(request),
+                apply=serializer.validated_data["apply"],
+            )
+        except cycle_counts.CycleCountError as exc:
+            raise ValidationError({"counts": [str(exc)]})
+        return Response(report)
+
+    def get_sales_window(self):
+        serializer = SalesWindowSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @action(detail=False, methods=["get"], url_path="top-sellers")
+    def top_sellers(self, request):
+        """
+        Best-selling products of the last ``?days=30``, by ``?by=units`` or
+        revenue, from the sales rollups (inventory.sales).
+        """
+        params = self.get_sales_window()
+        rows = sales.top_sellers(params["days"], params["limit"], params["by"])
+        return Response(
+            [
+                {
+                    "product": row["product_id"],
+                    "name": row["product__name"],
+                    "sku": row["product__sku"],
+                    "units": row["total_units"],
+                    "revenue": row["total_revenue"],
+                }
+                for row in rows
+            ]
+        )
+
+    @action(detail=True, methods=["get"])
+    def velocity(self, request, pk=None):
+        """Units sold per day over the last ``?days=30`` and days of cover."""
+        params = self.get_sales_window()
+        return Response(sales.velocity(self.get_object(), params["days"]))
+
+    @action(detail=False, methods=["get"], url_path="days-of-cover")
+    def days_of_cover(self, request):
+        """
+        Products that run out soonest at the rate they sold over the last
+        ``?days=30``.
+        """
+        params = self.get_sales_window()
+        rows = sales.lowest_cover(params["days"], params["limit"])
+        return Response(
+            [
+                {
+                    "product": row["product_id"],
+                    "name": row["product__name"],
+                    "sku": row["product__sku"],
+                    "stock_quantity": row["product__stock_quantity"],
+                    "units": row["total_units"],
+                    "units_per_day": row["units_per_day"],
+                    "days_of_cover": row["days_of_cover"],
+                }
+                for row in rows
+            ]
+        )
+
     def send_low_stock_email(self, low_stock_products):
         """
         Sends an email notification for low-stock products.
@@ -162,17 +509,28 @@ class ProductViewSet(viewsets.ModelViewSet):
             logger.error(f"Failed to send low stock email: {e}")
 
     def perform_create(self, serializer):
-        product = serializer.save()
+        user = history_user(self.request)
+        with history_capture.acting_user(user):
+            product = serializer.save()
+            # New stock is received at the default warehouse
+            stock.apply_to_default_warehouse(product, product.stock_quantity)
+        if history_capture.enabled():
+            # The insert trigger logged it
+            return
         # Log the creation as "add" action
         InventoryHistory.objects.create(
             product=product,
-            user=self.request.user,
+            user=user,
             action="add",
             quantity_changed=product.stock_quantity,
         )
 
+    @transaction.atomic
     def perform_update(self, serializer):
-        product = self.get_object()
+        product = stock.lock_products([serializer.instance.pk])[serializer.instance.pk]
+        # Save the locked row: Model.save() writes every column, and the
+        # instance get_object() read may predate orders committed since
+        serializer.instance = product
         old_stock = product.stock_quantity
         new_stock = serializer.validated_data.get("stock_quantity", old_stock)
         quantity_difference = new_stock - old_stock
@@ -182,21 +540,53 @@ class ProductViewSet(viewsets.ModelViewSet):
             else "remove" if quantity_difference < 0 else "update"
         )
 
-        # Save the updated product
-        updated_product = serializer.save()
+        user = history_user(self.request)
+        with history_capture.acting_user(user):
+            # Save the updated product
+            updated_product = serializer.save()
+        # A changed total is applied to the default warehouse
+        try:
+            stock.apply_to_default_warehouse(updated_product, quantity_difference)
+        except stock.InsufficientStock as exc:
+            raise ValidationError({"stock_quantity": [str(exc)]})
 
+        if quantity_difference and history_capture.enabled():
+            # The update trigger logged the stock change
+            return
         # Log the stock change
         InventoryHistory.objects.create(
             product=updated_product,
-            user=self.request.user,
+            user=user,
             action=action,
             quantity_changed=quantity_difference,
         )
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class ProductBarcodeViewSet(
+    ReplicaReadMixin, SerializerTimingMixin, viewsets.ModelViewSet
+):
+    permission_classes = [IsAuthenticated]
+    queryset = ProductBarcode.objects.order_by("pk")
+    serializer_class = ProductBarcodeSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ["product", "code"]
+
+
+class OrderViewSet(
+    ChangeFeedMixin,
+    ReplicaReadMixin,
+    SparseFieldsMixin,
+    SerializerTimingMixin,
+    viewsets.ModelViewSet,
+):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser]
     serializer_class = OrderSerializer
+    bulk_max_orders = 5000
+    throttle_scope = None  # bulk_create has its own
+    # The feed returns every user's orders, for staff sync accounts only
+    change_feed_permission_classes = [IsAdminUser]
 
     def get_queryset(self):
         # Ensure the user is authenticated
@@ -206,118 +596,403 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Return orders for the authenticated user
         return Order.objects.filter(user=self.request.user)
 
+    def get_change_queryset(self):
+        return Order.objects.select_related("user").prefetch_related("items")
+
     def get_serializer_class(self):
-        if self.action in ["list", "retrieve"]:
+        if self.action in ["list", "retrieve", "changes"]:
             return DetailedOrderSerializer
+        if self.action == "bulk_create":
+            return BulkOrderSerializer
         return OrderSerializer
 
+    @action(detail=False, methods=["post"], url_path="bulk", throttle_scope="bulk")
+    def bulk_create(self, request):
+        """
+        Create a batch of orders. Each order succeeds or fails on its own;
+        the response lists the outcome per order, by position in the batch.
+        """
+        if not isinstance(request.data, list):
+            return Response(
+                {"error": "Expected a list of orders."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(request.data) > self.bulk_max_orders:
+            return Response(
+                {"error": f"At most {self.bulk_max_orders} orders per batch."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results = [None] * len(request.data)
+        validated = []
+        for index, payload in enumerate(request.data):
+            serializer = self.get_serializer(data=payload)
+            if serializer.is_valid():
+                validated.append((index, serializer.validated_data))
+            else:
+                results[index] = {
+                    "index": index,
+                    "status": "failed",
+                    "errors": serializer.errors,
+                }
+
+        for index, result in BulkOrderSerializer.create_many(validated):
+            results[index] = result
+
+        created = sum(1 for result in results if result["status"] == "created")
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results},
+            status=status.HTTP_200_OK,
+        )
+
+
+class WarehouseViewSet(ReplicaReadMixin, SerializerTimingMixin, viewsets.ModelViewSet):
+    permission_classes = [IsAuthenticated]
+    queryset = Warehouse.objects.all()
+    serializer_class = WarehouseSerializer
+
+
+class StockLocationViewSet(
+    ReplicaReadMixin, SerializerTimingMixin, viewsets.ReadOnlyModelViewSet
+):
+    """
+    Per-warehouse quantities. Quantities change through the adjust and
+    transfer actions (or order placement) so product totals stay in step.
+    """
+
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    parser_classes = [FastJSONParser, FormParser, MultiPartParser]
+    queryset = StockLocation.objects.select_related("product", "warehouse").order_by(
+        "product_id", "warehouse__priority"
+    )
+    serializer_class = StockLocationSerializer
+    pagination_class = StandardResultsSetPagination
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = {
+        "product": ["exact"],
+        "warehouse": ["exact"],
+        "quantity": ["gte", "lte"],
+    }
+    ordering_fields = ["quantity", "updated_at"]
+
+    def get_serializer_class(self):
+        if self.action == "adjust":
+            return StockAdjustmentSerializer
+        if self.action == "transfer":
+            return StockTransferSerializer
+        return super().get_serializer_class()
+
+    @action(detail=False, methods=["post"])
+    def adjust(self, request):
+        """Receive (positive) or write off (negative) stock at one warehouse."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            location = stock.adjust(
+                data["product"],
+                data["warehouse"],
+                data["quantity_changed"],
+                history_user(request),
+            )
+        except (Product.DoesNotExist, Warehouse.DoesNotExist) as exc:
+            raise ValidationError({"detail": [str(exc)]})
+        except stock.InsufficientStock as exc:
+            raise ValidationError({"quantity_changed": [str(exc)]})
+        return Response(time_serializer(StockLocationSerializer(location)).data)
+
+    @action(detail=False, methods=["post"])
+    def transfer(self, request):
+        """Move stock between warehouses; all lines succeed or none do."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = [
+            (line["product"], line["source"], line["destination"], line["quantity"])
+            for line in serializer.validated_data["lines"]
+        ]
+        try:
+            locations = stock.transfer(lines)
+        except (
+            Product.DoesNotExist,
+            Warehouse.DoesNotExist,
+            stock.InsufficientStock,
+        ) as exc:
+            raise ValidationError({"lines": [str(exc)]})
+        locations = self.get_queryset().filter(
+            pk__in=[location.pk for location in locations]
+        )
+        return Response(
+            time_serializer(StockLocationSerializer(locations, many=True)).data
+        )
+
 
 # Inventory history viewset
-class InventoryHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class InventoryHistoryViewSet(
+    ChangeFeedMixin,
+    ReplicaReadMixin,
+    SerializerTimingMixin,
+    viewsets.ReadOnlyModelViewSet,
+):
     # permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     queryset = InventoryHistory.objects.all().order_by("-timestamp")
     serializer_class = InventoryHistorySerializer
+    # History rows are never updated
+    change_feed_field = "timestamp"
+
+    def get_change_queryset(self):
+        return self.get_queryset().select_related("product", "user")
+
 
+class InventoryHistoryStreamView(View):
+    """
+    Server-sent events feed of committed InventoryHistory rows.
 
-class ReportViewSet(viewsets.ModelViewSet):
+    Optional ``product`` and ``category`` query parameters narrow the feed.
+    Reconnecting clients send ``Last-Event-ID`` (or ``?last_event_id=``) and
+    get every matching row they missed before the live events resume.
+
+    Only served by the ASGI application, where a connection is a coroutine.
+    Under WSGI each open stream would hold a sync worker for as long as the
+    client stays connected, so it answers 503 there unless
+    HISTORY_STREAM_ALLOW_WSGI is set (the default with DEBUG, for runserver).
+    """
+
+    heartbeat = 15  # seconds between keep-alives / catch-up queries
+    replay_limit = 500
+    retry_ms = 3000
+
+    def get(self, request):
+        try:
+            filters = {
+                key: int(request.GET[key])
+                for key in ("product", "category")
+                if request.GET.get(key)
+            }
+            last_id = request.headers.get("Last-Event-ID") or request.GET.get(
+                "last_event_id"
+            )
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            return JsonResponse(
+                {"error": "product, category and Last-Event-ID must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if isinstance(request, ASGIRequest):
+            stream = self.astream(filters, last_id)
+        elif getattr(settings, "HISTORY_STREAM_ALLOW_WSGI", False):
+            stream = self.stream(filters, last_id)
+        else:
+            # EventSource does not reconnect after an error status
+            return JsonResponse(
+                {
+                    "error": "The live stream is only served by the ASGI "
+                    "application (inventory_project.asgi)."
+                },
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+        stream_response = StreamingHttpResponse(
+            stream, content_type="text/event-stream"
+        )
+        stream_response["Cache-Control"] = "no-cache"
+        stream_response["X-Accel-Buffering"] = "no"
+        return stream_response
+
+    def missed_queryset(self, filters, last_id):
+        queryset = InventoryHistory.objects.select_related("product", "user").filter(
+            pk__gt=last_id
+        )
+        if "product" in filters:
+            queryset = queryset.filter(product_id=filters["product"])
+        if "category" in filters:
+            queryset = queryset.filter(product__category_id=filters["category"])
+        return queryset.order_by("pk")[: self.replay_limit]
+
+    def latest_queryset(self):
+        return InventoryHistory.objects.order_by("-pk").values_list("pk", flat=True)
+
+    @staticmethod
+    def matches(event, filters):
+        return all(event.get(key) == value for key, value in filters.items())
+
+    @staticmethod
+    def format_event(event):
+        return (
+            f"id: {event['id']}\n"
+            f"event: inventory-history\n"
+            f"data: {events.encode_event(event)}\n\n"
+        )
+
+    def stream(self, filters, last_id):
+        subscription = events.subscribe(events.SyncSubscription())
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            if last_id is None:
+                last_id = self.latest_queryset().first() or 0
+            catch_up = True
+            while True:
+                if catch_up:
+                    for record in self.missed_queryset(filters, last_id):
+                        last_id = record.pk
+                        yield self.format_event(events.history_event(record))
+                event = subscription.get(self.heartbeat)
+                catch_up = event is None
+                if catch_up:
+                    yield ": keep-alive\n\n"
+                elif event["id"] > last_id and self.matches(event, filters):
+                    last_id = event["id"]
+                    yield self.format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    async def astream(self, filters, last_id):
+        subscription = events.subscribe(events.AsyncSubscription())
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            if last_id is None:
+                last_id = await self.latest_queryset().afirst() or 0
+            catch_up = True
+            while True:
+                if catch_up:
+                    async for record in self.missed_queryset(filters, last_id):
+                        last_id = record.pk
+                        yield self.format_event(events.history_event(record))
+                event = await subscription.get(self.heartbeat)
+                catch_up = event is None
+                if catch_up:
+                    yield ": keep-alive\n\n"
+                elif event["id"] > last_id and self.matches(event, filters):
+                    last_id = event["id"]
+                    yield self.format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+
+class ReportViewSet(ReplicaReadMixin, SerializerTimingMixin, viewsets.ModelViewSet):
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    throttle_scope = "expensive"
     queryset = InventoryHistory.objects.order_by("-timestamp")
     serializer_class = InventoryReportSerializer
 
-
-@action(detail=False, methods=["get"])
-def inventory_report(self, request):
-    # Extract date filters
-    start_date = parse_date(request.query_params.get("start_date"))
-    end_date = parse_date(request.query_params.get("end_date"))
-
-    # Filter history by date range
-    history_filter = Q()
-    if start_date and end_date:
-        history_filter &= Q(timestamp__range=(start_date, end_date))
-    elif start_date:
-        history_filter &= Q(timestamp__gte=start_date)
-    elif end_date:
-        history_filter &= Q(timestamp__lte=end_date)
-
-    # Total Inventory Value
-    total_value = (
-        Product.objects.aggregate(total_value=Sum(F("price") * F("stock_quantity")))[
-            "total_value"
-        ]
-        or 0
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="inventory-report",
+        url_name="inventory_report",
     )
+    def inventory_report(self, request):
+        # Extract date filters
+        start_date, end_date = parse_report_dates(request.query_params)
+        report_data = build_inventory_report(start_date, end_date)
+        return Response(report_data)
+
+
+class ReportJobViewSet(
+    SerializerTimingMixin,
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Submit a report (POST with ``kind`` and optional ``start_date`` /
+    ``end_date``), poll the job, then fetch ``download/`` once it is done.
+    An identical report that is queued, running or still cached is returned
+    (200) instead of starting a new job (202).
+    """
 
-    # Stock Levels with below_threshold annotation
-    stock_levels = Product.objects.annotate(
-        below_threshold=ExpressionWrapper(
-            F("stock_quantity") < F("threshold"), output_field=BooleanField()
+    permission_classes = [IsAuthenticated]
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+
+    @property
+    def throttle_scope(self):
+        return "expensive" if self.action == "create" else None
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job, created = report_jobs.submit(**serializer.validated_data)
+        # A reused job, or one picked up already, may have moved on
+        job.refresh_from_db()
+        return Response(
+            self.get_serializer(job).data,
+            status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK,
         )
-    ).values("name", "stock_quantity", "threshold", "below_threshold")
 
-    # Sales/Restocking History
-    history = (
-        InventoryHistory.objects.filter(history_filter)
-        .order_by("-timestamp")
-        .values("product__name", "action", "quantity_changed", "timestamp")
-    )
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != ReportJob.StatusChoices.DONE:
+            return Response(
+                {"detail": f"The report is {job.status}."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if not report_jobs.is_available(job):
+            return Response(
+                {"detail": "The report has expired; submit it again."},
+                status=status.HTTP_410_GONE,
+            )
+        path = report_jobs.result_file(job)
+        filename = f"{job.kind}-report-{job.pk}.json"
+        if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+            # Send the stored file as it is
+            response = FileResponse(
+                open(path, "rb"),
+                as_attachment=True,
+                filename=filename,
+                content_type="application/json",
+            )
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            # Decompress on the fly; FileResponse would decompress the whole
+            # file once just to find its length
+            response = StreamingHttpResponse(
+                report_jobs.read_result(job), content_type="application/json"
+            )
+            response.headers["Content-Length"] = report_jobs.result_length(job)
+            response.headers["Content-Disposition"] = content_disposition_header(
+                True, filename
+            )
+        patch_vary_headers(response, ["Accept-Encoding"])
+        return response
 
-    report_data = {
-        "total_value": total_value,
-        "stock_levels": list(stock_levels),
-        "sales_history": list(history),
-    }
 
-    return response(report_data)
-
-    # @action(
-    #     detail=False,
-    #     methods=["get"],
-    #     url_path="inventory-report",
-    #     url_name="inventory_report",
-    # )
-    # def inventory_report(self, request):
-    #     # Extract date filters
-    #     start_date_param = request.query_params.get("start_date")
-    #     end_date_param = request.query_params.get("end_date")
-
-    #     start_date = parse_date(str(start_date_param)) if start_date_param else None
-    #     end_date = parse_date(str(end_date_param)) if end_date_param else None
-
-    #     # Filter history by date range
-    #     history_filter = Q()
-    #     if start_date and end_date:
-    #         history_filter &= Q(timestamp__range=(start_date, end_date))
-    #     elif start_date:
-    #         history_filter &= Q(timestamp__gte=start_date)
-    #     elif end_date:
-    #         history_filter &= Q(timestamp__lte=end_date)
-
-    #     # Total Inventory Value
-    #     total_value = (
-    #         Product.objects.aggregate(
-    #             total_value=Sum(
-    #                 F("price") * F("stock_quantity"), output_field=DecimalField()
-    #             )
-    #         )["total_value"]
-    #         or 0
-    #     )
-
-    #     # Stock Levels
-    #     stock_levels = Product.objects.values(
-    #         "name", "stock_quantity", "threshold"
-    #     ).annotate(below_threshold=F("stock_quantity") < F("threshold"))
-
-    #     # Sales/Restocking History
-    #     history = (
-    #         InventoryHistory.objects.filter(history_filter)
-    #         .order_by("-timestamp")
-    #         .values("product__name", "action", "quantity_changed", "timestamp")
-    #     )
-
-    #     report_data = {
-    #         "total_value": total_value,
-    #         "stock_levels": list(stock_levels),
-    #         "sales_history": list(history),
-    #     }
-
-    #     return response(report_data)
+class ProfileViewSet(viewsets.ViewSet):
+    """
+    Request profiles stored by ProfilingMiddleware: the list (newest
+    first), one profile with its SQL and slowest calls, and ``download/``
+    for the profile file itself.
+    """
+
+    permission_classes = [IsAdminUser]
+    lookup_value_regex = r"[0-9T]+-[0-9a-f]+"
+
+    def list(self, request):
+        return Response(profiling.list_profiles())
+
+    def retrieve(self, request, pk=None):
+        return Response(self.get_profile(pk))
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        meta = self.get_profile(pk)
+        path = profiling.artefact(meta)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            raise NotFound("The profile has been rotated away.")
+        return FileResponse(
+            file,
+            as_attachment=True,
+            filename=path.name,
+            content_type="application/octet-stream",
+        )
+
+    @staticmethod
+    def get_profile(pk):
+        meta = profiling.load(pk)
+        if meta is None:
+            raise NotFound()
+        return meta
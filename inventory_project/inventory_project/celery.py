@@ -0,0 +1,15 @@
+"""
+Celery application for background report jobs (inventory.report_jobs).
+
+Start a worker with ``celery -A inventory_project worker``. Settings are
+read from the ``CELERY_*`` Django settings.
+"""
+
+import os
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inventory_project.settings")
+
+app = Celery("inventory_project")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -0,0 +1,63 @@
+"""
+Build DATABASES from DATABASE_URL (and optional DATABASE_REPLICA_URL).
+
+PostgreSQL connections are pooled with psycopg 3's built-in pool support
+(Django 5.1+); requirements.txt installs psycopg and psycopg_pool. Without
+them, or with DATABASE_POOL=false, connections are kept open between
+requests (CONN_MAX_AGE) with health checks, so a gunicorn worker does not
+reconnect on every request. A replica URL adds a ``replica`` alias; tests
+mirror it onto ``default``.
+"""
+
+from importlib.util import find_spec
+from dj_database_url import parse
+
+POSTGRES_ENGINES = (
+    "django.db.backends.postgresql",
+    "django.contrib.gis.db.backends.postgis",
+)
+
+
+def psycopg_pool_available():
+    return find_spec("psycopg") is not None and find_spec("psycopg_pool") is not None
+
+
+def database_config(
+    url,
+    conn_max_age=600,
+    pool=None,
+    pool_min_size=2,
+    pool_max_size=10,
+    pool_timeout=10,
+):
+    """
+    Django DATABASES entry for ``url``.
+
+    ``pool`` is True/False to force connection pooling on or off, or None to
+    use it whenever the URL is PostgreSQL and psycopg_pool is installed.
+    """
+    config = parse(url, conn_max_age=conn_max_age, conn_health_checks=True)
+    if config["ENGINE"] not in POSTGRES_ENGINES:
+        return config
+
+    if pool is None:
+        pool = psycopg_pool_available()
+    if pool:
+        # Django refuses persistent connections on top of a pool
+        config["CONN_MAX_AGE"] = 0
+        config["CONN_HEALTH_CHECKS"] = False
+        config.setdefault("OPTIONS", {})["pool"] = {
+            "min_size": pool_min_size,
+            "max_size": pool_max_size,
+            "timeout": pool_timeout,
+        }
+    return config
+
+
+def build_databases(default_url, replica_url=None, **options):
+    databases = {"default": database_config(default_url, **options)}
+    if replica_url:
+        replica = database_config(replica_url, **options)
+        replica["TEST"] = {"MIRROR": "default"}
+        databases["replica"] = replica
+    return databases
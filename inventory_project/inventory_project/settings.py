@@ -13,8 +13,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 from datetime import timedelta
-from decouple import Config
-from dj_database_url import parse
+from decouple import Csv, config
+from .databases import build_databases
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -24,11 +24,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = Config("SECRET_KEY")
+SECRET_KEY = config("SECRET_KEY")
 
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = Config("DEBUG", default=False, cast=bool)
+DEBUG = config("DEBUG", default=False, cast=bool)
 
 
 ALLOWED_HOSTS = ["127.0.0.1"]
@@ -49,8 +49,16 @@ INSTALLED_APPS = [
     "django_filters",
 ]
 
+# Every middleware here runs natively under ASGI too; a sync-only one would
+# make Django run the rest of the chain in a thread for each request
 MIDDLEWARE = [
+    "inventory.middleware.RequestMetricsMiddleware",
+    "inventory.middleware.ProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    # whitenoise.middleware.WhiteNoiseMiddleware, async-capable
+    "inventory.middleware.StaticFilesMiddleware",
+    "inventory.middleware.CompressionMiddleware",
+    "inventory.middleware.IdempotencyMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -92,7 +100,57 @@ WSGI_APPLICATION = "inventory_project.wsgi.application"
 
 default_dburl = "sqlite:///" + os.path.join(BASE_DIR, "db.sqlite3")
 
-DATABASE = {"default": Config("DATABASE_URL", default=default_dburl, cast=parse)}
+# See inventory_project/databases.py: persistent connections with health
+# checks, psycopg pools when available, and an optional read replica.
+# "auto" pools PostgreSQL connections whenever psycopg_pool is installed
+DATABASE_POOL = config("DATABASE_POOL", default="auto")
+
+DATABASES = build_databases(
+    config("DATABASE_URL", default=default_dburl),
+    replica_url=config("DATABASE_REPLICA_URL", default=None),
+    conn_max_age=config("DATABASE_CONN_MAX_AGE", default=600, cast=int),
+    pool=None if DATABASE_POOL == "auto" else DATABASE_POOL.lower() in ("1", "true"),
+    pool_min_size=config("DATABASE_POOL_MIN_SIZE", default=2, cast=int),
+    pool_max_size=config("DATABASE_POOL_MAX_SIZE", default=10, cast=int),
+)
+
+# Safe-method API reads go to the "replica" alias when it is configured; a
+# user who writes reads from the primary for REPLICA_PIN_SECONDS afterwards
+DATABASE_ROUTERS = ["inventory.routers.ReplicaRouter"]
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+
+# Replica pins and idempotency keys have to be visible to every worker: set
+# REDIS_URL (needs the redis package) when running more than one process
+REDIS_URL = config("REDIS_URL", default=None)
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# Seconds a SKU/barcode lookup result is cached (inventory.codes)
+PRODUCT_CODE_CACHE_TTL = config("PRODUCT_CODE_CACHE_TTL", default=5, cast=int)
+
+# Memory-mapped product snapshot shared by the workers on a host, written by
+# the refresh_product_catalogue command (inventory.catalogue); empty disables
+PRODUCT_CATALOGUE_PATH = config("PRODUCT_CATALOGUE_PATH", default="")
+# Older snapshots are ignored and reads go to the database
+PRODUCT_CATALOGUE_MAX_AGE = config("PRODUCT_CATALOGUE_MAX_AGE", default=10, cast=int)
+
+# Change feeds (inventory.feed): rows newer than this are held back so late
+# commits are not skipped, and tombstones of deleted rows are kept this long
+FEED_SETTLE_SECONDS = config("FEED_SETTLE_SECONDS", default=5, cast=int)
+TOMBSTONE_RETENTION_DAYS = config("TOMBSTONE_RETENTION_DAYS", default=30, cast=int)
+
+# Idempotency-Key replay for API writes (inventory.middleware.IdempotencyMiddleware).
+# With the local-memory cache, keys are only honoured within one process and
+# check --deploy fails (inventory.checks)
+IDEMPOTENCY_CACHE = "default"
+IDEMPOTENCY_TTL = config("IDEMPOTENCY_TTL", default=24 * 60 * 60, cast=int)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,6 +190,71 @@ STATIC_URL = "static/"
 
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
+# Whitenoise serves static files with the gzip/Brotli variants and hashed
+# names written by collectstatic
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
+    },
+}
+
+# Warehouse (by code) that direct edits of Product.stock_quantity apply to
+DEFAULT_WAREHOUSE_CODE = config("DEFAULT_WAREHOUSE_CODE", default="MAIN")
+
+# InventoryHistory older than this is moved to the archive by
+# "manage.py archive_inventory_history" (see inventory/history_storage.py)
+HISTORY_RETENTION_DAYS = config("HISTORY_RETENTION_DAYS", default=365, cast=int)
+HISTORY_ARCHIVE_DIR = config(
+    "HISTORY_ARCHIVE_DIR", default=os.path.join(BASE_DIR, "history_archive")
+)
+
+# Background report jobs (inventory/report_jobs.py). Without a broker they
+# run in a thread of the web process, and the Procfile worker exits at once.
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default="")
+CELERY_TASK_IGNORE_RESULT = True
+REPORT_RESULTS_DIR = config(
+    "REPORT_RESULTS_DIR", default=os.path.join(BASE_DIR, "report_results")
+)
+REPORT_RESULT_TTL = config("REPORT_RESULT_TTL", default=3600, cast=int)
+# Jobs still queued or running after this long are marked failed
+REPORT_JOB_TIMEOUT = config("REPORT_JOB_TIMEOUT", default=3600, cast=int)
+
+# Daily per-product sales rollups older than this are folded into monthly
+# ones by "manage.py compact_product_sales" (inventory/sales.py); the
+# top-seller, velocity and days-of-cover windows are limited to it
+SALES_DAILY_RETENTION_DAYS = config("SALES_DAILY_RETENTION_DAYS", default=90, cast=int)
+
+# "python" logs stock changes from the views; "trigger" lets database
+# triggers do it (see inventory/history_capture.py). Run migrate after
+# changing it.
+HISTORY_CAPTURE = config("HISTORY_CAPTURE", default="python")
+
+# /api/inventory-history/stream/ holds its connection open. Serve it from the
+# ASGI application (inventory_project.asgi with an async worker class, as in
+# the Procfile); under WSGI every client would tie up a sync worker, so it
+# answers 503 there unless this is set (runserver, with DEBUG)
+HISTORY_STREAM_ALLOW_WSGI = config(
+    "HISTORY_STREAM_ALLOW_WSGI", default=DEBUG, cast=bool
+)
+
+# Response compression (inventory.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = config("COMPRESSION_MIN_SIZE", default=1024, cast=int)
+COMPRESSION_GZIP_LEVEL = config("COMPRESSION_GZIP_LEVEL", default=6, cast=int)
+COMPRESSION_BROTLI_QUALITY = config("COMPRESSION_BROTLI_QUALITY", default=5, cast=int)
+COMPRESSION_CONTENT_TYPES = (
+    "application/json",
+    "text/html",
+    "text/plain",
+    "text/csv",
+)
+# Random padding per compressed response against BREACH; 0 disables it
+COMPRESSION_MAX_RANDOM_BYTES = config(
+    "COMPRESSION_MAX_RANDOM_BYTES", default=100, cast=int
+)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -149,11 +272,32 @@ REST_FRAMEWORK = {
         "rest_framework.filters.SearchFilter",
         "rest_framework.filters.OrderingFilter",
     ],
+    "DEFAULT_THROTTLE_CLASSES": ["inventory.throttling.RoleThrottle"],
+    # "<role>" for ordinary requests, "<scope>.<role>" for a view's
+    # throttle_scope; see inventory.throttling
+    "DEFAULT_THROTTLE_RATES": {
+        "anon": "60/min",
+        "staff": "600/min",
+        "admin": "3000/min",
+        "expensive.anon": "5/min",
+        "expensive.staff": "30/min",
+        "expensive.admin": "120/min",
+        "bulk.staff": "60/min",
+        "bulk.admin": "300/min",
+        "signup.anon": "10/hour",
+    },
 }
 
+# Token buckets live in this cache; use a shared one (Redis) with several
+# workers so they spend from the same buckets
+THROTTLE_CACHE = "default"
+THROTTLE_ENABLED = config("THROTTLE_ENABLED", default=True, cast=bool)
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    # Adds the caller's role claim used by inventory.throttling
+    "TOKEN_OBTAIN_SERIALIZER": "inventory.serializers.RoleTokenObtainPairSerializer",
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -177,6 +321,10 @@ LOGGING = {
             "class": "logging.FileHandler",
             "filename": "errors.log",
         },
+        "console": {
+            "level": "INFO",
+            "class": "logging.StreamHandler",
+        },
     },
     "loggers": {
         "django": {
@@ -184,5 +332,36 @@ LOGGING = {
             "level": "ERROR",
             "propagate": True,
         },
+        "inventory": {
+            "handlers": ["console", "file"],
+            "level": config("INVENTORY_LOG_LEVEL", default="INFO"),
+            "propagate": False,
+        },
     },
 }
+
+# Request metrics (served at /metrics). Readable with
+# "Authorization: Bearer <METRICS_TOKEN>", from METRICS_ALLOWED_IPS
+# (comma-separated) or by staff logged in to the admin; closed otherwise
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="", cast=Csv())
+# Flag a request as a likely N+1 when one SQL template runs this many times
+METRICS_N_PLUS_ONE_THRESHOLD = config(
+    "METRICS_N_PLUS_ONE_THRESHOLD", default=10, cast=int
+)
+
+# Request profiling (inventory.middleware.ProfilingMiddleware); off unless
+# enabled. Profiles a random fraction of requests with cProfile, keeps a
+# stack profile of requests slower than the threshold (seconds, 0 disables)
+# and profiles requests from admins that send PROFILING_HEADER.
+PROFILING_ENABLED = config("PROFILING_ENABLED", default=False, cast=bool)
+PROFILING_SAMPLE_RATE = config("PROFILING_SAMPLE_RATE", default=0.0, cast=float)
+PROFILING_SLOW_THRESHOLD = config("PROFILING_SLOW_THRESHOLD", default=0.0, cast=float)
+PROFILING_SAMPLE_INTERVAL = config(
+    "PROFILING_SAMPLE_INTERVAL", default=0.01, cast=float
+)
+PROFILING_HEADER = "X-Profile"
+PROFILING_PATHS = ("/api/",)
+# Profiles are stored here; only the newest PROFILING_MAX_PROFILES are kept
+PROFILING_DIR = config("PROFILING_DIR", default=os.path.join(BASE_DIR, "profiles"))
+PROFILING_MAX_PROFILES = config("PROFILING_MAX_PROFILES", default=200, cast=int)
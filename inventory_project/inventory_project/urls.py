@@ -33,6 +33,20 @@ from inventory.views import (
     UserViewSet,
     LoginView,
     LogoutView,
+    InventoryHistoryStreamView,
+    WarehouseViewSet,
+    StockLocationViewSet,
+    ProductBarcodeViewSet,
+    ReportJobViewSet,
+    ProfileViewSet,
+)
+from inventory.metrics import metrics_view
+from inventory.async_views import (
+    AsyncProductView,
+    AsyncCategoryView,
+    AsyncInventoryHistoryView,
+    AsyncLowStockView,
+    AsyncInventoryReportView,
 )
 
 
@@ -41,18 +55,66 @@ router.register(r"users", UserViewSet, basename="user")
 router.register(r"categories", CategoryViewSet)
 router.register(r"suppliers", SupplierViewSet)
 router.register(r"products", ProductViewSet)
+router.register(r"product-barcodes", ProductBarcodeViewSet)
 router.register(r"orders", OrderViewSet, basename="order")
+router.register(r"warehouses", WarehouseViewSet)
+router.register(r"stock-locations", StockLocationViewSet)
 router.register(
     r"inventory-history", InventoryHistoryViewSet, basename="inventory-history"
 )
 router.register(r"reports", ReportViewSet, basename="reports")
+router.register(r"report-jobs", ReportJobViewSet, basename="report-job")
+router.register(r"profiles", ProfileViewSet, basename="profile")
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
+    path(
+        "api/inventory-history/stream/",
+        InventoryHistoryStreamView.as_view(),
+        name="inventory-history-stream",
+    ),
     path("api/", include(router.urls)),
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
     path("api/token/verify/", TokenVerifyView.as_view(), name="token_verify"),
     path("api/login/", LoginView.as_view(), name="login"),
     path("api/logout/", LogoutView.as_view(), name="logout"),
+    # Async read paths, served by the ASGI deployment
+    path("api/async/products/", AsyncProductView.as_view(), name="async-product-list"),
+    path(
+        "api/async/products/low_stock/",
+        AsyncLowStockView.as_view(),
+        name="async-product-low-stock",
+    ),
+    path(
+        "api/async/products/<int:pk>/",
+        AsyncProductView.as_view(),
+        name="async-product-detail",
+    ),
+    path(
+        "api/async/categories/",
+        AsyncCategoryView.as_view(),
+        name="async-category-list",
+    ),
+    path(
+        "api/async/categories/<int:pk>/",
+        AsyncCategoryView.as_view(),
+        name="async-category-detail",
+    ),
+    path(
+        "api/async/inventory-history/",
+        AsyncInventoryHistoryView.as_view(),
+        name="async-inventory-history-list",
+    ),
+    path(
+        "api/async/inventory-history/<int:pk>/",
+        AsyncInventoryHistoryView.as_view(),
+        name="async-inventory-history-detail",
+    ),
+    path(
+        "api/async/reports/inventory-report/",
+        AsyncInventoryReportView.as_view(),
+        name="async-inventory-report",
+    ),
 ]